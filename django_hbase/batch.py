@@ -0,0 +1,100 @@
+from collections import defaultdict
+from django.conf import settings
+from django_hbase.client import HBaseClient
+
+import threading
+
+
+class HBaseBatch:
+    """
+    buffers puts and deletes of every model saved inside the with block and
+    sends them in chunks of batch_size mutations per table (one thrift call
+    per chunk instead of one per row)
+
+    transaction=True: if the block raises, buffered mutations are dropped
+    instead of sent. chunks already flushed because they reached batch_size
+    stay written, same as happybase.Table.batch
+
+    callback: called once the mutation is sent, e.g. to invalidate a cached row
+
+    a batch opened while another one is active joins it, e.g. bulk_create
+    inside a with block: its mutations are sent or dropped with the outer
+    batch, by the batch_size and transaction of the outer batch
+    """
+    local = threading.local()
+
+    def __init__(self, batch_size=None, transaction=False):
+        self.batch_size = batch_size or settings.HBASE_BATCH_SIZE
+        self.transaction = transaction
+        # table_name => [(op, row_key, row_data)]
+        self.mutations = defaultdict(list)
+        # table_name => [callback]
+        self.callbacks = defaultdict(list)
+        # the batch this one joined
+        self.outer = None
+
+    @classmethod
+    def current(cls):
+        stack = getattr(cls.local, 'stack', None)
+        if not stack:
+            return None
+        return stack[-1]
+
+    def __enter__(self):
+        self.outer = self.current()
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        self.local.stack.append(self.outer or self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.local.stack.pop()
+        if self.outer is not None:
+            # left to the outer batch
+            self.outer = None
+            return False
+        if exc_type is not None and self.transaction:
+            self.mutations.clear()
+            self.callbacks.clear()
+            return False
+        self.flush()
+        return False
+
+    def put(self, table_name, row_key, row_data, callback=None):
+        self.add(table_name, ('put', row_key, row_data), callback)
+
+    def delete(self, table_name, row_key, callback=None):
+        self.add(table_name, ('delete', row_key, None), callback)
+
+    def add(self, table_name, mutation, callback=None):
+        if self.outer is not None:
+            self.outer.add(table_name, mutation, callback)
+            return
+        if callback is not None:
+            self.callbacks[table_name].append(callback)
+        mutations = self.mutations[table_name]
+        mutations.append(mutation)
+        if len(mutations) >= self.batch_size:
+            self.flush_table(table_name)
+
+    def flush(self):
+        for table_name in list(self.mutations.keys()):
+            self.flush_table(table_name)
+
+    def flush_table(self, table_name):
+        mutations = self.mutations.pop(table_name, None)
+        callbacks = self.callbacks.pop(table_name, [])
+        if not mutations:
+            return
+
+        def send(conn):
+            with conn.table(table_name).batch(transaction=self.transaction) as batch:
+                for op, row_key, row_data in mutations:
+                    if op == 'put':
+                        batch.put(row_key, row_data)
+                    else:
+                        batch.delete(row_key)
+
+        HBaseClient.execute(send)
+        for callback in callbacks:
+            callback()
@@ -0,0 +1,68 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+import threading
+
+
+class RowCache:
+    """
+    raw row data of one table in a django cache, keyed by the hex row key
+    Meta.cache = {'backend': 'default', 'ttl': 3600, 'negative_ttl': 60}
+      backend: name in settings.CACHES, 'testing' is used in unit tests
+      ttl: seconds, default timeout of the backend if missing
+      negative_ttl: seconds to remember a missing row
+    missing rows are cached as {} so hot misses don't reach hbase either
+    """
+
+    def __init__(self, name, backend='default', ttl=DEFAULT_TIMEOUT, negative_ttl=60):
+        self.name = name
+        self.backend = backend
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def cache(self):
+        return caches['testing'] if settings.TESTING else caches[self.backend]
+
+    def get_key(self, row_key):
+        return 'hbase:{}:{}'.format(self.name, row_key.hex())
+
+    def get_many(self, row_keys):
+        # row keys => {row_key: row_data} of the cached ones
+        keys = {self.get_key(row_key): row_key for row_key in row_keys}
+        cached = self.cache.get_many(list(keys))
+        with self.lock:
+            self.hits += len(cached)
+            self.misses += len(keys) - len(cached)
+        return {keys[key]: row_data for key, row_data in cached.items()}
+
+    def set_many(self, rows):
+        # {row_key: row_data}, row_data is {} for a missing row
+        found = {self.get_key(row_key): row_data for row_key, row_data in rows.items() if row_data}
+        missing = {self.get_key(row_key): {} for row_key, row_data in rows.items() if not row_data}
+        if found:
+            self.cache.set_many(found, timeout=self.ttl)
+        if missing:
+            self.cache.set_many(missing, timeout=self.negative_ttl)
+
+    def delete(self, row_key):
+        self.cache.delete(self.get_key(row_key))
+
+    def stats(self):
+        with self.lock:
+            hits, misses = self.hits, self.misses
+        requests = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / requests if requests else 0.0,
+        }
+
+    def reset_stats(self):
+        with self.lock:
+            self.hits = 0
+            self.misses = 0
@@ -1,14 +1,166 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from django.conf import settings
+from django.utils.module_loading import import_string
+from thriftpy2.transport import TTransportException
 
-import happybase
+import asyncio
+import functools
+import socket
+import threading
+import time
 
 
 class HBaseClient:
-    conn = None
+    # thrift connections are not thread-safe, every thread checks out its own
+    # connection from the pool and returns it when the with block ends
+    pool = None
+    executor = None
+    async_executor = None
+    lock = threading.Lock()
+    # depth of the nested connection() blocks of each thread, they share one connection
+    local = threading.local()
 
     @classmethod
-    def get_connection(cls):
-        if cls.conn:
-            return cls.conn
-        cls.conn = happybase.Connection(settings.HBASE_HOST)
-        return cls.conn
+    def get_pool(cls):
+        if cls.pool:
+            return cls.pool
+        with cls.lock:
+            # another thread may have created the pool while we were waiting
+            if cls.pool is None:
+                # happybase.ConnectionPool, or django_hbase.memory.MemoryConnectionPool
+                # to run without an hbase server
+                cls.pool = cls.new_pool(size=settings.HBASE_POOL_SIZE)
+        return cls.pool
+
+    @classmethod
+    def get_connection_kwargs(cls, **overrides):
+        # happybase.Connection arguments from settings, the pool ignores autoconnect
+        kwargs = {
+            'host': settings.HBASE_HOST,
+            'port': settings.HBASE_PORT,
+            'timeout': settings.HBASE_TIMEOUT,
+            'autoconnect': settings.HBASE_AUTOCONNECT,
+            'table_prefix': settings.HBASE_TABLE_PREFIX,
+            'table_prefix_separator': settings.HBASE_TABLE_PREFIX_SEPARATOR,
+            'transport': settings.HBASE_TRANSPORT,
+            'protocol': settings.HBASE_PROTOCOL,
+        }
+        kwargs.update(overrides)
+        return kwargs
+
+    @classmethod
+    def get_full_table_name(cls, table_name):
+        # the name hbase knows table_name by, e.g. in hbase shell statements
+        kwargs = cls.get_connection_kwargs()
+        if kwargs['table_prefix'] is None:
+            return table_name
+        return '{}{}{}'.format(kwargs['table_prefix'], kwargs['table_prefix_separator'], table_name)
+
+    @classmethod
+    def new_pool(cls, size=1, **overrides):
+        # a pool outside of HBaseClient.pool, e.g. to compare wire formats
+        pool_class = import_string(settings.HBASE_CONNECTION_POOL)
+        return pool_class(size=size, **cls.get_connection_kwargs(**overrides))
+
+    @classmethod
+    def get_executor(cls):
+        if cls.executor:
+            return cls.executor
+        with cls.lock:
+            if cls.executor is None:
+                cls.executor = ThreadPoolExecutor(
+                    max_workers=settings.HBASE_SCAN_WORKERS,
+                    thread_name_prefix='hbase',
+                )
+        return cls.executor
+
+    @classmethod
+    def get_async_executor(cls):
+        # one thread per pooled connection, more threads would only wait for a connection
+        if cls.async_executor:
+            return cls.async_executor
+        with cls.lock:
+            if cls.async_executor is None:
+                cls.async_executor = ThreadPoolExecutor(
+                    max_workers=settings.HBASE_POOL_SIZE,
+                    thread_name_prefix='hbase-async',
+                )
+        return cls.async_executor
+
+    @classmethod
+    async def run_async(cls, func, *args, **kwargs):
+        """
+        await func(*args, **kwargs) on the async executor, the event loop is not blocked
+        by thrift calls. an HBaseBatch of the caller does not apply inside func
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            cls.get_async_executor(),
+            functools.partial(func, *args, **kwargs),
+        )
+
+    @classmethod
+    @contextmanager
+    def connection(cls):
+        # happybase.ConnectionPool hands a nested checkout the connection of the
+        # outer block, which may still read from a scanner. only the outermost
+        # checkout may reconnect, an inner one would close the socket under it
+        pool = cls.get_pool()
+        with pool.connection(timeout=settings.HBASE_POOL_TIMEOUT) as conn:
+            depth = getattr(cls.local, 'depth', 0)
+            if depth == 0:
+                cls.check_health(conn)
+            conn.last_used_at = time.time()
+            cls.local.depth = depth + 1
+            try:
+                yield conn
+            finally:
+                cls.local.depth = depth
+            conn.last_used_at = time.time()
+
+    @classmethod
+    def check_health(cls, conn):
+        # thrift server closes idle sockets, but the client side transport
+        # still looks open. reconnect before use instead of failing the call
+        last_used_at = getattr(conn, 'last_used_at', None)
+        if last_used_at is None:
+            return
+        if time.time() - last_used_at < settings.HBASE_CONNECTION_MAX_IDLE:
+            return
+        conn.close()
+        conn._refresh_thrift_client()
+        conn.open()
+        # fresh socket, the next checkouts must not reconnect again
+        conn.last_used_at = time.time()
+
+    @classmethod
+    def execute(cls, func, retries=None):
+        """
+        run func(conn) with a pooled connection
+        the pool replaces a tainted connection when a thrift error is raised,
+        so we retry the call on the fresh connection
+        retries=0 for calls that are not idempotent, e.g. counter_inc: the
+        error may come after the region server applied the call
+        """
+        if retries is None:
+            retries = settings.HBASE_MAX_RETRIES
+        for attempt in range(retries + 1):
+            try:
+                with cls.connection() as conn:
+                    return func(conn)
+            except (TTransportException, socket.error):
+                if attempt == retries:
+                    raise
+
+    @classmethod
+    def execute_many(cls, funcs):
+        """
+        run every func(conn) in parallel on the executor, each with its own
+        pooled connection. results keep the order of funcs
+        """
+        if len(funcs) == 1:
+            return [cls.execute(funcs[0])]
+        executor = cls.get_executor()
+        futures = [executor.submit(cls.execute, func) for func in funcs]
+        return [future.result() for future in futures]
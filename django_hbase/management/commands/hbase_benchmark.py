@@ -0,0 +1,230 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+from django_hbase.client import HBaseClient
+from django_hbase.memory import MemoryConnectionPool
+from django_hbase.models.codecs import KEY_CODECS
+from thriftpy2.thrift import TException
+
+import itertools
+import socket
+import statistics
+import time
+
+WIRE_TRANSPORTS = ['buffered', 'framed']
+WIRE_PROTOCOLS = ['binary', 'compact']
+
+
+class Command(BaseCommand):
+    help = 'Microbenchmarks for django_hbase'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--suite', choices=['decode', 'salt', 'wire'], default='decode')
+        parser.add_argument('--model', default='friendships.hbase_models.HBaseFollowing')
+        parser.add_argument('--rows', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--buckets', type=int, default=16, help='salt buckets of the salt suite')
+        parser.add_argument('--key-encoding', choices=list(KEY_CODECS), help='override Meta.key_encoding')
+        parser.add_argument(
+            '--transport',
+            action='append',
+            choices=WIRE_TRANSPORTS,
+            help='transports of the wire suite, default all',
+        )
+        parser.add_argument(
+            '--protocol',
+            action='append',
+            choices=WIRE_PROTOCOLS,
+            help='protocols of the wire suite, default all',
+        )
+
+    def handle(self, *args, **options):
+        model_class = import_string(options['model'])
+        if options['key_encoding']:
+            model_class = self.derive_model_class(model_class, key_encoding=options['key_encoding'])
+        getattr(self, 'run_{}'.format(options['suite']))(model_class, options)
+
+    def make_rows(self, model_class, num_rows):
+        # synthetic rows as table.scan returns them, every field is an int
+        rows = []
+        for i in range(num_rows):
+            data = {key: i + 1 for key in model_class.get_field_hash()}
+            row_key = model_class.serialize_row_key(data)
+            row_data = {
+                column_key.encode('utf-8'): value.encode('utf-8')
+                for column_key, value in model_class.serialize_row_data(data).items()
+            }
+            rows.append((row_key, row_data))
+        return rows
+
+    def best_of(self, repeat, func):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        return best
+
+    def report(self, name, elapsed, num_rows):
+        self.stdout.write('{:<20} {:>10.2f} us/row {:>12.0f} rows/s'.format(
+            name,
+            elapsed / num_rows * 1e6,
+            num_rows / elapsed,
+        ))
+
+    def run_decode(self, model_class, options):
+        rows = self.make_rows(model_class, options['rows'])
+
+        def init_from_row():
+            for row_key, row_data in rows:
+                model_class.init_from_row(row_key, row_data)
+
+        elapsed = self.best_of(options['repeat'], init_from_row)
+        self.report('init_from_row', elapsed, len(rows))
+        baseline = elapsed
+
+        elapsed = self.best_of(options['repeat'], lambda: model_class.decode_rows(rows))
+        self.report('decode_rows', elapsed, len(rows))
+        self.stdout.write('{:<20} {:>10.1f}x'.format('speedup', baseline / elapsed))
+
+        # every instance must match the per row path
+        expected = [model_class.init_from_row(row_key, row_data).to_dict() for row_key, row_data in rows]
+        if [instance.to_dict() for instance in model_class.decode_rows(rows)] != expected:
+            raise CommandError('decode_rows and init_from_row disagree')
+
+    def make_prefix_rows(self, model_class, num_rows):
+        # field values of num_rows rows under the same first row key field,
+        # e.g. every follower of user 1, scanned with prefix (1, None)
+        second_key = model_class.Meta.row_key[1]
+        return [
+            {**{key: 1 for key in model_class.get_field_hash()}, second_key: i + 1}
+            for i in range(num_rows)
+        ]
+
+    def run_salt(self, model_class, options):
+        """
+        writes of one hot row key prefix (e.g. a celebrity's followers) with and
+        without salt, on the in-process backend so no hbase server is needed
+        """
+        num_rows = options['rows']
+        rows = self.make_prefix_rows(model_class, num_rows)
+        prefix = (1, None)
+
+        previous_pool = HBaseClient.pool
+        HBaseClient.pool = MemoryConnectionPool(size=1)
+        try:
+            for salt_buckets in [0, options['buckets']]:
+                salted_class = self.make_salted_class(model_class, salt_buckets)
+                instances = [salted_class(**data) for data in rows]
+
+                def create():
+                    salted_class.bulk_create(instances)
+
+                elapsed = self.best_of(1, create)
+                self.stdout.write(f'salt_buckets={salt_buckets}')
+                self.report('bulk_create', elapsed, num_rows)
+
+                # rows per leading key byte, a region boundary can only fall between them
+                rows_per_bucket = {}
+                for instance in instances:
+                    leading_byte = salted_class.salt_row_key(instance.row_key)[0]
+                    rows_per_bucket[leading_byte] = rows_per_bucket.get(leading_byte, 0) + 1
+                counts = list(rows_per_bucket.values())
+                self.stdout.write('{:<20} {:>10} min {:>8} max {:>8.1f} stdev'.format(
+                    f'{len(counts)} key ranges',
+                    min(counts),
+                    max(counts),
+                    statistics.pstdev(counts),
+                ))
+
+                for limit in [20, None]:
+                    elapsed = self.best_of(options['repeat'], lambda: salted_class.filter(
+                        prefix=prefix,
+                        limit=limit,
+                        reverse=True,
+                    ))
+                    self.report(f'filter limit={limit}', elapsed, limit or num_rows)
+        finally:
+            HBaseClient.pool = previous_pool
+
+    def run_wire(self, model_class, options):
+        """
+        put, get and scan throughput of every thrift transport / protocol pair
+        against the configured HBASE_CONNECTION_POOL. the thrift server speaks
+        one wire format, pairs it doesn't understand fail and are reported
+        """
+        if settings.HBASE_CONNECTION_POOL != 'happybase.ConnectionPool':
+            self.stderr.write(
+                f'{settings.HBASE_CONNECTION_POOL} has no wire format, every pair measures the same code',
+            )
+        num_rows = options['rows']
+        rows = self.make_prefix_rows(model_class, num_rows)
+        wire_class = self.derive_model_class(model_class, table_name='benchmark_wire', indexes=())
+        table_name = wire_class.get_table_name()
+        column_families = wire_class.get_column_families()[table_name]
+
+        pairs = itertools.product(
+            options['transport'] or WIRE_TRANSPORTS,
+            options['protocol'] or WIRE_PROTOCOLS,
+        )
+        previous_pool = HBaseClient.pool
+        try:
+            for transport, protocol in pairs:
+                self.stdout.write(f'transport={transport} protocol={protocol}')
+                try:
+                    HBaseClient.pool = HBaseClient.new_pool(transport=transport, protocol=protocol)
+                    HBaseClient.execute(lambda conn: conn.create_table(table_name, column_families))
+                except (TException, socket.error) as e:
+                    self.stdout.write(f'{"failed":<20} {e!r}')
+                    continue
+                try:
+                    self.run_wire_pair(wire_class, rows, options)
+                finally:
+                    HBaseClient.execute(lambda conn: conn.delete_table(table_name, True))
+        finally:
+            HBaseClient.pool = previous_pool
+
+    def run_wire_pair(self, wire_class, rows, options):
+        num_rows = len(rows)
+        instances = [wire_class(**data) for data in rows]
+
+        # one thrift call per row, then one per HBASE_BATCH_SIZE rows
+        elapsed = self.best_of(1, lambda: [instance.save() for instance in instances])
+        self.report('put', elapsed, num_rows)
+        elapsed = self.best_of(options['repeat'], lambda: wire_class.bulk_create(instances))
+        self.report('bulk_create', elapsed, num_rows)
+
+        keys = [{key: data[key] for key in wire_class.Meta.row_key} for data in rows]
+        elapsed = self.best_of(1, lambda: [wire_class.get(**key) for key in keys])
+        self.report('get', elapsed, num_rows)
+        elapsed = self.best_of(options['repeat'], lambda: wire_class.get_many(keys))
+        self.report('get_many', elapsed, num_rows)
+
+        elapsed = self.best_of(options['repeat'], lambda: wire_class.filter(prefix=(1, None)))
+        self.report('scan', elapsed, num_rows)
+        elapsed = self.best_of(options['repeat'], lambda: list(wire_class.filter_iter(prefix=(1, None))))
+        self.report('scan iter', elapsed, num_rows)
+
+    def derive_model_class(self, model_class, **meta_options):
+        # same fields, Meta overridden with meta_options
+        meta = type('Meta', (model_class.Meta,), meta_options)
+        return type(model_class.__name__, (model_class,), {
+            'Meta': meta,
+            '__module__': model_class.__module__,
+        })
+
+    def make_salted_class(self, model_class, salt_buckets):
+        salted_class = self.derive_model_class(
+            model_class,
+            table_name=f'benchmark_salt_{salt_buckets}',
+            salt_buckets=salt_buckets,
+            # index tables are not part of this benchmark
+            indexes=(),
+        )
+        HBaseClient.execute(lambda conn: conn.create_table(
+            salted_class.get_table_name(),
+            salted_class.get_column_families()[salted_class.get_table_name()],
+        ))
+        return salted_class
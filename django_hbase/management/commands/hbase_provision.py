@@ -0,0 +1,153 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import autodiscover_modules, import_string
+from django_hbase.client import HBaseClient
+from django_hbase.models import HBaseModel
+
+import subprocess
+
+# happybase column family option => hbase shell attribute
+SHELL_ATTRIBUTES = {
+    'max_versions': 'VERSIONS',
+    'compression': 'COMPRESSION',
+    'in_memory': 'IN_MEMORY',
+    'bloom_filter_type': 'BLOOMFILTER',
+    'block_cache_enabled': 'BLOCKCACHE',
+    'time_to_live': 'TTL',
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Create or alter the tables of every HBaseModel with the column family options '
+        'of their Meta, pre-split into --regions regions. '
+        'Thrift can neither pre-split nor alter a table, those steps are written as an '
+        'hbase shell script, run it with --shell or pipe it into `hbase shell -n`. '
+        'Its table names carry HBASE_TABLE_PREFIX like the ones of thrift calls.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--model',
+            action='append',
+            help='e.g. friendships.hbase_models.HBaseFollowing, default all HBaseModel subclasses',
+        )
+        parser.add_argument('--regions', type=int, default=1, help='pre-split new tables')
+        parser.add_argument('--dry-run', action='store_true', help='only print the hbase shell script')
+        parser.add_argument('--shell', action='store_true', help='run the script with `hbase shell -n`')
+
+    def handle(self, *args, **options):
+        if options['regions'] < 1:
+            raise CommandError('--regions should be at least 1')
+        if options['model']:
+            model_classes = [import_string(path) for path in options['model']]
+        else:
+            # hbase models are not loaded by django, import <app>.hbase_models first
+            autodiscover_modules('hbase_models')
+            model_classes = HBaseModel.__subclasses__()
+
+        existing_tables = HBaseClient.execute(lambda conn: {
+            table.decode('utf-8') for table in conn.tables()
+        })
+        self.created_tables = []
+        statements = []
+        for model_class in model_classes:
+            statements.extend(self.provision(model_class, existing_tables, options))
+
+        if not statements:
+            if not self.created_tables:
+                self.stdout.write(self.style.SUCCESS('All tables are up to date'))
+            return
+        script = '\n'.join(statements)
+        if options['shell'] and not options['dry_run']:
+            subprocess.run(['hbase', 'shell', '-n'], input=script, text=True, check=True)
+            self.stdout.write(self.style.SUCCESS(f'{len(statements)} hbase shell statements run'))
+            return
+        self.stdout.write(script)
+
+    def provision(self, model_class, existing_tables, options):
+        statements = []
+        num_regions = options['regions']
+        split_points = {}
+        if num_regions > 1:
+            try:
+                split_points = model_class.get_split_points(num_regions)
+            except NotImplementedError as e:
+                self.stderr.write(f'{model_class.__name__} is not pre-split: {e}')
+
+        for table_name, column_families in model_class.get_column_families().items():
+            if table_name in existing_tables:
+                statements.extend(self.alter_statements(table_name, column_families))
+                continue
+            points = split_points.get(table_name)
+            if not points:
+                if not options['dry_run']:
+                    HBaseClient.execute(lambda conn: conn.create_table(table_name, column_families))
+                    self.created_tables.append(table_name)
+                    self.stdout.write(f'{table_name} created')
+                    continue
+            statements.append(self.create_statement(table_name, column_families, points))
+        return statements
+
+    def alter_statements(self, table_name, column_families):
+        def get_families(conn):
+            return conn.table(table_name).families()
+
+        current_families = HBaseClient.execute(get_families)
+        statements = []
+        for family, family_options in column_families.items():
+            current = current_families.get(family.encode('utf-8'))
+            if current is None:
+                statements.append("alter '{}', {}".format(
+                    HBaseClient.get_full_table_name(table_name),
+                    self.family_spec(family, family_options),
+                ))
+                continue
+            drift = {
+                key: value
+                for key, value in family_options.items()
+                if not self.same_option(current.get(key), value)
+            }
+            if drift:
+                self.stderr.write(f'{table_name} {family}: {drift} differs from {current}')
+                statements.append("alter '{}', {}".format(
+                    HBaseClient.get_full_table_name(table_name),
+                    self.family_spec(family, drift),
+                ))
+        return statements
+
+    def same_option(self, current, value):
+        if isinstance(current, bytes):
+            current = current.decode('utf-8')
+        if isinstance(value, str) and isinstance(current, str):
+            return value.upper() == current.upper()
+        return current == value
+
+    def create_statement(self, table_name, column_families, split_points):
+        specs = [
+            self.family_spec(family, family_options)
+            for family, family_options in column_families.items()
+        ]
+        if split_points:
+            specs.append('SPLITS => [{}]'.format(', '.join(
+                self.quote(point) for point in split_points
+            )))
+        return "create '{}', {}".format(HBaseClient.get_full_table_name(table_name), ', '.join(specs))
+
+    def family_spec(self, family, family_options):
+        attributes = ["NAME => '{}'".format(family)]
+        for key, value in family_options.items():
+            if key not in SHELL_ATTRIBUTES:
+                raise CommandError(f'Unknown column family option {key}')
+            if isinstance(value, bool):
+                value = "'{}'".format(str(value).lower())
+            elif isinstance(value, str):
+                value = "'{}'".format(value.upper())
+            attributes.append('{} => {}'.format(SHELL_ATTRIBUTES[key], value))
+        return '{' + ', '.join(attributes) + '}'
+
+    def quote(self, point):
+        # ruby double quoted string, bytes outside [0-9A-Za-z] are escaped
+        return '"{}"'.format(''.join(
+            chr(byte) if chr(byte).isascii() and chr(byte).isalnum() else '\\x{:02X}'.format(byte)
+            for byte in point
+        ))
@@ -0,0 +1,88 @@
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+from django_hbase.batch import HBaseBatch
+from django_hbase.client import HBaseClient
+from django_hbase.models.codecs import KEY_CODECS
+from django_hbase.models.hbase_models import INDEX_ROW_KEY_COLUMN
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy every row of an HBaseModel table into a new table, re-encoding row keys. '
+        'Index tables are written next to it as <target table>_by_<fields>, keyed and '
+        'pointing to the rows in the new encoding. '
+        'Point Meta.table_name / Meta.key_encoding to the new table once it finishes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', help='e.g. friendships.hbase_models.HBaseFollowing')
+        parser.add_argument('--from-encoding', choices=list(KEY_CODECS), default='string')
+        parser.add_argument('--to-encoding', choices=list(KEY_CODECS), default='binary')
+        parser.add_argument('--target-table', default=None)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        model_class = import_string(options['model'])
+        source_codec = KEY_CODECS[options['from_encoding']](model_class._row_key_fields)
+        target_codec = KEY_CODECS[options['to_encoding']](model_class._row_key_fields)
+        source_table = model_class.get_table_name()
+        target_table = options['target_table'] or '{}_{}'.format(
+            source_table,
+            options['to_encoding'],
+        )
+        # (index fields, key codec, table name) of every index in the new encoding
+        target_indexes = [
+            (
+                index_fields,
+                KEY_CODECS[options['to_encoding']](tuple((key, model_class._fields[key]) for key in index_fields)),
+                '{}_by_{}'.format(target_table, '_'.join(index_fields)),
+            )
+            for index_fields, codec in model_class._indexes.values()
+        ]
+        self.create_tables(model_class, target_table, target_indexes)
+
+        count = 0
+        batch_size = options['batch_size']
+        with HBaseBatch(batch_size=batch_size) as batch, HBaseClient.connection() as conn:
+            rows = conn.table(source_table).scan(batch_size=batch_size)
+            for row_key, row_data in rows:
+                # salt buckets stay the same, only the key encoding changes
+                data = source_codec.decode(model_class.unsalt_row_key(row_key))
+                target_row_key = model_class.salt_row_key(target_codec.encode(data))
+                batch.put(target_table, target_row_key, row_data)
+                if target_indexes:
+                    column_decoders = model_class._column_decoders
+                    for column_key, column_value in row_data.items():
+                        key, deserialize = column_decoders[column_key]
+                        data[key] = deserialize(column_value)
+                for index_fields, codec, index_table in target_indexes:
+                    index_key = model_class.serialize_index_key(index_fields, codec, data)
+                    if index_key is not None:
+                        batch.put(index_table, index_key, {
+                            INDEX_ROW_KEY_COLUMN: target_row_key,
+                            **row_data,
+                        })
+                count += 1
+                if count % (batch_size * 10) == 0:
+                    self.stdout.write(f'{count} rows rewritten')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{count} rows rewritten from {source_table} ({source_codec.name}) '
+            f'to {target_table} ({target_codec.name})'
+        ))
+
+    def create_tables(self, model_class, target_table, target_indexes):
+        # same column families, options and ttl as the tables of the model
+        column_families = model_class.get_column_families()
+        tables_to_create = {target_table: column_families[model_class.get_table_name()]}
+        for index_fields, codec, index_table in target_indexes:
+            tables_to_create[index_table] = column_families[model_class.get_index_table_name(index_fields)]
+
+        def create(conn):
+            tables = [table.decode('utf-8') for table in conn.tables()]
+            for table_name, families in tables_to_create.items():
+                if table_name in tables:
+                    continue
+                conn.create_table(table_name, families)
+
+        HBaseClient.execute(create)
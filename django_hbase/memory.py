@@ -0,0 +1,398 @@
+"""
+in-process stand-in for happybase, implements the part of the
+happybase.ConnectionPool / Connection / Table API django_hbase uses
+
+    HBASE_CONNECTION_POOL = 'django_hbase.memory.MemoryConnectionPool'
+
+rows are kept in a sorted list of row keys, so scans see the same
+lexicographic order as HBase. data lives as long as the pool (the process)
+"""
+from bisect import bisect_left, bisect_right, insort
+from contextlib import contextmanager
+
+import re
+import struct
+import threading
+import time
+
+VALUE_FILTER_PATTERN = re.compile(
+    r"^SingleColumnValueFilter\('((?:[^']|'')*)', '((?:[^']|'')*)', (=|!=|<|<=|>|>=), "
+    r"'binary:((?:[^']|'')*)', (true|false), (true|false)\)$"
+)
+COMPARATORS = {
+    '=': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+}
+COUNTER = struct.Struct('>q')
+
+
+def ensure_bytes(value):
+    if value is None or isinstance(value, bytes):
+        return value
+    return value.encode('utf-8')
+
+
+def bytes_increment(value):
+    # same as happybase.util.bytes_increment, the first key after all keys with this prefix
+    value = bytearray(value)
+    for i in range(len(value) - 1, -1, -1):
+        if value[i] != 0xff:
+            value[i] += 1
+            return bytes(value[:i + 1])
+    return None
+
+
+def now_in_ms():
+    return int(time.time() * 1000)
+
+
+def unquote(value):
+    return value.replace("''", "'").encode('utf-8')
+
+
+def compile_filter(filter_string):
+    """
+    'FirstKeyOnlyFilter() AND KeyOnlyFilter()' => [func(cells) => cells or None]
+    only the filters emitted by django_hbase are supported
+    """
+    if not filter_string:
+        return []
+    funcs = []
+    for part in filter_string.split(' AND '):
+        part = part.strip()
+        if part == 'KeyOnlyFilter()':
+            funcs.append(lambda cells: {
+                column: (b'', timestamp)
+                for column, (value, timestamp) in cells.items()
+            })
+            continue
+        if part == 'FirstKeyOnlyFilter()':
+            funcs.append(lambda cells: dict([min(cells.items())]))
+            continue
+        match = VALUE_FILTER_PATTERN.match(part)
+        if match is None:
+            raise NotImplementedError(f'Filter not supported by the memory backend: {part}')
+        family, qualifier, operator, value, filter_if_missing, _ = match.groups()
+        funcs.append(value_filter(
+            unquote(family) + b':' + unquote(qualifier),
+            COMPARATORS[operator],
+            unquote(value),
+            filter_if_missing == 'true',
+        ))
+    return funcs
+
+
+def value_filter(column, compare, value, filter_if_missing):
+    def func(cells):
+        if column not in cells:
+            return None if filter_if_missing else cells
+        if not compare(cells[column][0], value):
+            return None
+        return cells
+    return func
+
+
+class MemoryTable:
+
+    def __init__(self, name, store):
+        self.name = name
+        self.store = store
+
+    def families(self):
+        # {b'cf': options} like happybase
+        return {
+            ensure_bytes(name): dict(options)
+            for name, options in self.store.families.items()
+        }
+
+    def put(self, row, data, timestamp=None, wal=True):
+        row = ensure_bytes(row)
+        timestamp = timestamp if timestamp is not None else now_in_ms()
+        with self.store.lock:
+            cells = self.store.rows.get(row)
+            if cells is None:
+                cells = self.store.rows[row] = {}
+                insort(self.store.row_keys, row)
+            for column, value in data.items():
+                column = ensure_bytes(column)
+                # a put with the same timestamp overwrites the cell, like hbase
+                versions = [
+                    version
+                    for version in cells.get(column, [])
+                    if version[0] != timestamp
+                ]
+                cells[column] = versions
+                versions.append((timestamp, ensure_bytes(value)))
+                versions.sort(key=lambda version: version[0], reverse=True)
+                del versions[self.store.max_versions(column):]
+
+    def delete(self, row, columns=None, timestamp=None, wal=True):
+        row = ensure_bytes(row)
+        with self.store.lock:
+            cells = self.store.rows.get(row)
+            if cells is None:
+                return
+            if columns is None:
+                self.store.remove_row(row)
+                return
+            for column in self.store.match_columns(cells, columns):
+                del cells[column]
+            if not cells:
+                self.store.remove_row(row)
+
+    def row(self, row, columns=None, timestamp=None, include_timestamp=False):
+        with self.store.lock:
+            cells = self.store.read(ensure_bytes(row), columns, timestamp)
+        return self.make_row(cells or {}, include_timestamp)
+
+    def rows(self, rows, columns=None, timestamp=None, include_timestamp=False):
+        results = []
+        with self.store.lock:
+            for row in rows:
+                row = ensure_bytes(row)
+                cells = self.store.read(row, columns, timestamp)
+                if cells:
+                    results.append((row, self.make_row(cells, include_timestamp)))
+        return results
+
+    def scan(self, row_start=None, row_stop=None, row_prefix=None, columns=None,
+             filter=None, timestamp=None, include_timestamp=False, batch_size=1000,
+             scan_batching=None, limit=None, sorted_columns=False, reverse=False):
+        if batch_size < 1:
+            raise ValueError("'batch_size' must be >= 1")
+        if limit is not None and limit < 1:
+            raise ValueError("'limit' must be >= 1")
+        row_start, row_stop, row_prefix = map(ensure_bytes, (row_start, row_stop, row_prefix))
+        if row_prefix is not None:
+            if row_start is not None or row_stop is not None:
+                raise TypeError("'row_prefix' cannot be combined with 'row_start' or 'row_stop'")
+            if reverse:
+                row_start, row_stop = bytes_increment(row_prefix), row_prefix
+            else:
+                row_start, row_stop = row_prefix, bytes_increment(row_prefix)
+        filter_funcs = compile_filter(filter)
+
+        with self.store.lock:
+            row_keys = self.store.row_keys_in_range(row_start, row_stop, reverse)
+        returned = 0
+        for row_key in row_keys:
+            with self.store.lock:
+                # evaluate filters on all cells, projection happens afterwards like hbase
+                cells = self.store.read(row_key, None, timestamp)
+            for func in filter_funcs:
+                if not cells:
+                    break
+                cells = func(cells)
+            if cells and columns is not None:
+                cells = {
+                    column: cells[column]
+                    for column in self.store.match_columns(cells, columns)
+                }
+            if not cells:
+                continue
+            yield row_key, self.make_row(cells, include_timestamp)
+            returned += 1
+            if limit is not None and returned >= limit:
+                return
+
+    def batch(self, timestamp=None, batch_size=None, transaction=False, wal=True):
+        return MemoryBatch(self, timestamp, batch_size, transaction)
+
+    def counter_get(self, row, column):
+        return self.counter_inc(row, column, value=0)
+
+    def counter_set(self, row, column, value=0):
+        self.put(row, {column: COUNTER.pack(value)})
+
+    def counter_inc(self, row, column, value=1):
+        row, column = ensure_bytes(row), ensure_bytes(column)
+        with self.store.lock:
+            cells = self.store.read(row, [column], None) or {}
+            current = COUNTER.unpack(cells[column][0])[0] if column in cells else 0
+            if value or column in cells:
+                self.put(row, {column: COUNTER.pack(current + value)})
+        return current + value
+
+    def counter_dec(self, row, column, value=1):
+        return self.counter_inc(row, column, -value)
+
+    def make_row(self, cells, include_timestamp):
+        if include_timestamp:
+            return dict(cells)
+        return {column: value for column, (value, timestamp) in cells.items()}
+
+
+class MemoryTableStore:
+
+    def __init__(self, families):
+        # RLock, counter_inc calls put while holding the lock
+        self.lock = threading.RLock()
+        self.families = families
+        self.row_keys = []
+        # row_key => {column: [(timestamp, value), ...] newest first}
+        self.rows = {}
+
+    def family_options(self, column):
+        family = column.split(b':', 1)[0].decode('utf-8')
+        return self.families.get(family) or {}
+
+    def max_versions(self, column):
+        return self.family_options(column).get('max_versions', 1)
+
+    def remove_row(self, row):
+        del self.rows[row]
+        del self.row_keys[bisect_left(self.row_keys, row)]
+
+    def match_columns(self, cells, columns):
+        # columns may be 'cf' (whole family) or 'cf:qualifier'
+        columns = [ensure_bytes(column) for column in columns]
+        return [
+            column
+            for column in cells
+            if column in columns or column.split(b':', 1)[0] in columns
+        ]
+
+    def read(self, row, columns, timestamp):
+        """
+        latest visible version of each cell => {column: (value, timestamp)}
+        timestamp: only cells written before it, cells past the family TTL are expired
+        """
+        cells = self.rows.get(row)
+        if not cells:
+            return None
+        if columns is not None:
+            cells = {column: cells[column] for column in self.match_columns(cells, columns)}
+        now = now_in_ms()
+        result = {}
+        for column, versions in cells.items():
+            ttl = self.family_options(column).get('time_to_live')
+            for version_timestamp, value in versions:
+                if timestamp is not None and version_timestamp >= timestamp:
+                    continue
+                if ttl is not None and version_timestamp < now - ttl * 1000:
+                    break
+                result[column] = (value, version_timestamp)
+                break
+        return result
+
+    def row_keys_in_range(self, row_start, row_stop, reverse):
+        keys = self.row_keys
+        if not reverse:
+            # [row_start, row_stop)
+            low = 0 if row_start is None else bisect_left(keys, row_start)
+            high = len(keys) if row_stop is None else bisect_left(keys, row_stop)
+            return keys[low:high]
+        # reverse scan: row_start >= key > row_stop
+        high = len(keys) if row_start is None else bisect_right(keys, row_start)
+        low = 0 if row_stop is None else bisect_right(keys, row_stop)
+        return keys[low:high][::-1]
+
+
+class MemoryBatch:
+
+    def __init__(self, table, timestamp=None, batch_size=None, transaction=False):
+        self.table = table
+        self.timestamp = timestamp
+        self.batch_size = batch_size
+        self.transaction = transaction
+        self.mutations = []
+
+    def put(self, row, data, wal=None):
+        self.mutations.append(('put', row, data))
+        self.send_if_full()
+
+    def delete(self, row, columns=None, wal=None):
+        self.mutations.append(('delete', row, columns))
+        self.send_if_full()
+
+    def send_if_full(self):
+        if self.batch_size is not None and len(self.mutations) >= self.batch_size:
+            self.send()
+
+    def send(self):
+        for op, row, data in self.mutations:
+            if op == 'put':
+                self.table.put(row, data, timestamp=self.timestamp)
+            else:
+                self.table.delete(row, columns=data)
+        self.mutations = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None and self.transaction:
+            return
+        self.send()
+
+
+class MemoryConnection:
+
+    def __init__(self, tables, lock, table_prefix=None, table_prefix_separator=b'_'):
+        self.tables_by_name = tables
+        self.lock = lock
+        self.table_prefix = ensure_bytes(table_prefix)
+        self.table_prefix_separator = ensure_bytes(table_prefix_separator)
+
+    def table_name(self, name):
+        name = ensure_bytes(name)
+        if self.table_prefix is None:
+            return name
+        return self.table_prefix + self.table_prefix_separator + name
+
+    def tables(self):
+        names = list(self.tables_by_name.keys())
+        if self.table_prefix is None:
+            return names
+        prefix = self.table_prefix + self.table_prefix_separator
+        return [name[len(prefix):] for name in names if name.startswith(prefix)]
+
+    def create_table(self, name, families):
+        name = self.table_name(name)
+        with self.lock:
+            if name in self.tables_by_name:
+                raise ValueError(f'Table {name} already exists')
+            self.tables_by_name[name] = MemoryTableStore(families)
+
+    def delete_table(self, name, disable=False):
+        with self.lock:
+            del self.tables_by_name[self.table_name(name)]
+
+    def table(self, name, use_prefix=True):
+        name = self.table_name(name) if use_prefix else ensure_bytes(name)
+        return MemoryTable(name, self.tables_by_name[name])
+
+    # connection management is a no-op in memory
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def _refresh_thrift_client(self):
+        pass
+
+
+class MemoryConnectionPool:
+    """
+    same constructor and connection() context manager as happybase.ConnectionPool,
+    every connection shares the tables of this pool
+    """
+
+    def __init__(self, size, **kwargs):
+        self.size = size
+        self.tables = {}
+        self.lock = threading.Lock()
+        self.connection_kwargs = {
+            key: kwargs[key]
+            for key in ('table_prefix', 'table_prefix_separator')
+            if key in kwargs
+        }
+
+    @contextmanager
+    def connection(self, timeout=None):
+        yield MemoryConnection(self.tables, self.lock, **self.connection_kwargs)
@@ -0,0 +1,195 @@
+import struct
+
+
+class BadRowKeyError(Exception):
+    pass
+
+
+class StringKeyCodec:
+    """
+    fields joined by ':', ints left padded with 0 to 16 digits
+    {key1: 1, key2: 2} => b"0000000000000001:0000000000000002"
+    """
+    name = 'string'
+
+    def __init__(self, fields):
+        # ((name, field), ...) in row key order
+        self.fields = fields
+
+    def encode(self, data, is_prefix=False):
+        values = []
+        for key, field in self.fields:
+            value = data.get(key)
+            if value is None:
+                if not is_prefix:
+                    raise BadRowKeyError(f"{key} is missing in row key")
+                break
+            value = field.serialize(value)
+            if ':' in value:
+                raise BadRowKeyError(f"{key} should not contain ':' in value: {value}")
+            values.append(value)
+        return bytes(':'.join(values), encoding='utf-8')
+
+    def split_points(self, num_regions):
+        # reversed ints start with the last digit of the id, uniform over 0-9
+        key, field = self.fields[0]
+        if field.field_type not in ('int', 'timestamp') or not field.reverse:
+            raise NotImplementedError(f'{key} is not a reversed int, row keys are not uniform')
+        return uniform_split_points(
+            num_regions,
+            10,
+            lambda value, width: str(value).zfill(width).encode('utf-8'),
+        )
+
+    def decode(self, row_key):
+        if isinstance(row_key, bytes):
+            # bytes to str
+            row_key = row_key.decode('utf-8')
+        return {
+            key: field.deserialize(value)
+            for (key, field), value in zip(self.fields, row_key.split(':'))
+        }
+
+    def decode_many(self, row_keys):
+        """
+        [bytes row key, ...] => [[values of field 1], [values of field 2], ...]
+        every key is split at once, row keys of a scan always have every field
+        """
+        num_fields = len(self.fields)
+        parts = b':'.join(row_keys).split(b':')
+        if len(parts) != num_fields * len(row_keys):
+            raise BadRowKeyError('row keys should have every row key field')
+        columns = []
+        for index, (key, field) in enumerate(self.fields):
+            values = parts[index::num_fields]
+            if field.field_type in ('int', 'timestamp'):
+                columns.append(field.deserialize_many(values))
+            else:
+                columns.append([field.deserialize(value.decode('utf-8')) for value in values])
+        return columns
+
+
+class BinaryKeyCodec:
+    """
+    fixed width 8 bytes per field, no separator
+    ints are packed big-endian so byte order == numeric order, prefix and range
+    scans keep working. reverse=True fields are packed little-endian, i.e. the
+    big-endian bytes reversed, which spreads sequential ids across regions
+    {key1: 1, key2: 2} => b"\\x00\\x00\\x00\\x00\\x00\\x00\\x00\\x01\\x00...\\x02"
+    """
+    name = 'binary'
+    width = 8
+    big_endian = struct.Struct('>Q')
+    little_endian = struct.Struct('<Q')
+
+    def __init__(self, fields):
+        for key, field in fields:
+            if field.field_type not in ('int', 'timestamp'):
+                raise NotImplementedError(
+                    f'binary key encoding only supports integer fields, got {key}'
+                )
+        self.fields = tuple(
+            (key, self.little_endian if field.reverse else self.big_endian)
+            for key, field in fields
+        )
+
+    def encode(self, data, is_prefix=False):
+        values = []
+        for key, packer in self.fields:
+            value = data.get(key)
+            if value is None:
+                if not is_prefix:
+                    raise BadRowKeyError(f"{key} is missing in row key")
+                break
+            try:
+                values.append(packer.pack(int(value)))
+            except struct.error:
+                raise BadRowKeyError(f"{key} should be an unsigned 64-bit int: {value}")
+        return b''.join(values)
+
+    def split_points(self, num_regions):
+        # little-endian ints start with the lowest byte of the id, uniform over 0-255
+        key, packer = self.fields[0]
+        if packer is not self.little_endian:
+            raise NotImplementedError(f'{key} is not a reversed int, row keys are not uniform')
+        return uniform_split_points(
+            num_regions,
+            256,
+            lambda value, width: value.to_bytes(width, 'big'),
+        )
+
+    def decode(self, row_key):
+        data = {}
+        for index, (key, packer) in enumerate(self.fields):
+            offset = index * self.width
+            if offset + self.width > len(row_key):
+                break
+            data[key] = packer.unpack_from(row_key, offset)[0]
+        return data
+
+    def decode_many(self, row_keys):
+        """
+        [bytes row key, ...] => [[values of field 1], [values of field 2], ...]
+        the joined keys are unpacked with one struct call per byte order
+        """
+        num_fields = len(self.fields)
+        num_values = num_fields * len(row_keys)
+        joined = b''.join(row_keys)
+        if len(joined) != self.width * num_values:
+            raise BadRowKeyError('row keys should have every row key field')
+        unpacked = {}
+        for byte_order in {packer.format[0] for key, packer in self.fields}:
+            unpacked[byte_order] = struct.unpack(f'{byte_order}{num_values}Q', joined)
+        return [
+            list(unpacked[packer.format[0]][index::num_fields])
+            for index, (key, packer) in enumerate(self.fields)
+        ]
+
+
+KEY_CODECS = {
+    StringKeyCodec.name: StringKeyCodec,
+    BinaryKeyCodec.name: BinaryKeyCodec,
+}
+
+
+def row_key_after(row_key):
+    # the first possible row key after row_key, start here to skip row_key itself
+    return row_key + b'\x00'
+
+
+def row_key_prefix_end(prefix):
+    # the first row key after every key starting with prefix, None if there is none
+    prefix = bytearray(prefix)
+    while prefix and prefix[-1] == 0xff:
+        prefix.pop()
+    if not prefix:
+        return None
+    prefix[-1] += 1
+    return bytes(prefix)
+
+
+def row_key_before(row_key, max_extra_length=16):
+    """
+    the last possible row key before row_key (among keys at most max_extra_length
+    bytes longer), start a reverse scan here to skip row_key itself
+    """
+    if not row_key:
+        return row_key
+    if row_key[-1] == 0:
+        return row_key[:-1]
+    return row_key[:-1] + bytes([row_key[-1] - 1]) + b'\xff' * max_extra_length
+
+
+def uniform_split_points(num_regions, base, encode):
+    """
+    num_regions - 1 split points for keys whose leading digits (in base) are uniform
+    uniform_split_points(4, 10, ...) => [b'2', b'5', b'7']
+    """
+    width = 1
+    while base ** width < num_regions:
+        width += 1
+    space = base ** width
+    return [
+        encode(space * i // num_regions, width)
+        for i in range(1, num_regions)
+    ]
@@ -1,3 +1,6 @@
+import struct
+
+
 class HBaseField:
     field_type = None
 
@@ -5,6 +8,22 @@ class HBaseField:
         self.reverse = reverse
         self.column_family = column_family
 
+    def serialize(self, value):
+        value = str(value)
+        if self.reverse:
+            value = value[::-1]
+        return value
+
+    def deserialize(self, value):
+        # value is str when it comes from the row key, bytes from a column
+        if self.reverse:
+            value = value[::-1]
+        return value
+
+    def deserialize_many(self, values):
+        # [bytes, ...] => [value, ...], bulk path of HBaseModel.decode_rows
+        return list(map(self.deserialize, values))
+
 
 class IntegerField(HBaseField):
     field_type = 'int'
@@ -12,9 +31,66 @@ class IntegerField(HBaseField):
     def __init__(self, *args, **kwargs):
         super(IntegerField, self).__init__(*args, **kwargs)
 
+    def serialize(self, value):
+        # int are fixed as 16 digits, left padding with 0
+        value = str(value).rjust(16, '0')
+        if self.reverse:
+            value = value[::-1]
+        return value
+
+    def deserialize(self, value):
+        if self.reverse:
+            value = value[::-1]
+        return int(value)
+
+    def deserialize_many(self, values):
+        return deserialize_ints(values, self.reverse)
+
 
 class TimestampField(HBaseField):
     field_type = 'timestamp'
 
     def __init__(self, *args, auto_now_add=False, **kwargs):
         super(TimestampField, self).__init__(*args, **kwargs)
+
+    def deserialize(self, value):
+        if self.reverse:
+            value = value[::-1]
+        return int(value)
+
+    def deserialize_many(self, values):
+        return deserialize_ints(values, self.reverse)
+
+
+class CounterField(HBaseField):
+    """
+    atomic counter column, 8 bytes big-endian signed int like hbase counters
+    change it with Model.increment instead of save, increments are not batched
+    """
+    field_type = 'counter'
+    packer = struct.Struct('>q')
+
+    def __init__(self, *args, **kwargs):
+        super(CounterField, self).__init__(*args, **kwargs)
+        if self.reverse or not self.column_family:
+            raise ValueError('CounterField should be a column and can not be reversed')
+
+    def serialize(self, value):
+        return self.packer.pack(int(value))
+
+    def deserialize(self, value):
+        return self.packer.unpack(value)[0]
+
+    def deserialize_many(self, values):
+        return [value for value, in self.packer.iter_unpack(b''.join(values))]
+
+
+def deserialize_ints(values, reverse):
+    """
+    [b'0000000000000001', ...] => [1, ...] without a python loop
+    reversed digits are restored by reversing the joined bytes, which also
+    reverses the order of the values
+    """
+    if not reverse:
+        return list(map(int, values))
+    return list(map(int, b':'.join(values)[::-1].split(b':')))[::-1]
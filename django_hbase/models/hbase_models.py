@@ -1,166 +1,564 @@
+from contextlib import contextmanager
 from django.conf import settings
+from django_hbase.batch import HBaseBatch
+from django_hbase.cache import RowCache
 from django_hbase.client import HBaseClient
-from django_hbase.models import HBaseField, IntegerField, TimestampField
+from django_hbase.models import HBaseField
+from django_hbase.models.codecs import (
+    BadRowKeyError,
+    KEY_CODECS,
+    row_key_after,
+    row_key_before,
+    row_key_prefix_end,
+)
 
-
-class BadRowKeyError(Exception):
-    pass
+import heapq
+import itertools
+import operator
+import zlib
 
 
 class EmptyColumnError(Exception):
     pass
 
 
-class HBaseModel:
+# index rows point back to the primary row with this column, the other columns
+# are copies of the primary row so get_by_index is a single point get
+INDEX_COLUMN_FAMILY = 'i'
+INDEX_ROW_KEY_COLUMN = 'i:row_key'
+
+
+class HBaseModelMeta(type):
+    """
+    compiles the field metadata of a model once at class creation:
+      _fields: {name: field} in declaration order
+      _row_key_fields: ((name, field), ...) in Meta.row_key order
+      _column_fields: ((name, column_key, field), ...)
+      _column_decoders: {b'cf:name': (name, field.deserialize)}
+      _key_codec: encodes / decodes row keys, Meta.key_encoding 'string' or 'binary'
+      _slot_setters: {name: slot descriptor __set__}, used by decode_rows
+      _indexes: {frozenset(index fields): (index fields, key codec)} from Meta.indexes
+      _salt_buckets: Meta.salt_buckets, 0 if row keys are not salted
+      _row_cache: RowCache of Meta.cache, None if rows are not cached
+    field objects are moved off the class so instances can use __slots__
+    """
+
+    def __new__(mcs, name, bases, attrs):
+        fields = {}
+        for base in reversed(bases):
+            fields.update(getattr(base, '_fields', {}))
+        own_fields = [
+            key
+            for key, value in attrs.items()
+            if isinstance(value, HBaseField)
+        ]
+        for key in own_fields:
+            fields[key] = attrs.pop(key)
+        attrs['__slots__'] = tuple(own_fields)
+        cls = super().__new__(mcs, name, bases, attrs)
+
+        cls._fields = fields
+        cls._row_key_fields = tuple(
+            (key, fields[key])
+            for key in cls.Meta.row_key
+        )
+        cls._column_fields = tuple(
+            (key, '{}:{}'.format(field.column_family, key), field)
+            for key, field in fields.items()
+            if field.column_family
+        )
+        cls._column_decoders = {
+            column_key.encode('utf-8'): (key, field.deserialize)
+            for key, column_key, field in cls._column_fields
+        }
+        key_encoding = getattr(cls.Meta, 'key_encoding', 'string')
+        cls._key_codec = KEY_CODECS[key_encoding](cls._row_key_fields)
+        cls._slot_setters = {
+            key: next(
+                klass.__dict__[key]
+                for klass in cls.__mro__
+                if key in klass.__dict__
+            ).__set__
+            for key in fields
+        }
+        cls._indexes = {
+            frozenset(index): (
+                tuple(index),
+                KEY_CODECS[key_encoding](tuple((key, fields[key]) for key in index)),
+            )
+            for index in getattr(cls.Meta, 'indexes', ())
+        }
+        cls._salt_buckets = getattr(cls.Meta, 'salt_buckets', 0) or 0
+        if not 0 <= cls._salt_buckets <= 256:
+            raise ValueError(f'{name}.Meta.salt_buckets should be between 0 and 256')
+        cache_options = getattr(cls.Meta, 'cache', None)
+        cls._row_cache = RowCache(cls.Meta.table_name, **cache_options) if cache_options else None
+        return cls
+
+
+class HBaseModel(metaclass=HBaseModelMeta):
+    __slots__ = ()
+
     class Meta:
         table_name = None
         row_key = ()
+        # 'string': b"0000000000000001:1700000000000000" (default)
+        # 'binary': fixed width big-endian ints, 16 bytes instead of 33
+        key_encoding = 'string'
+        # [('field1', 'field2'), ...], each index is a table keyed by the fields,
+        # maintained on save / delete and read with get_by_index
+        indexes = ()
+        # N > 0: rows are spread over N buckets by a 1 byte salt prefix,
+        # crc32(row key) % N, so sequential keys don't all hit one region.
+        # scans run on every bucket in parallel and are merged in key order
+        salt_buckets = 0
+        # options of every column family, as happybase create_table takes them
+        # e.g. {'bloom_filter_type': 'ROW', 'compression': 'GZ', 'max_versions': 1}
+        column_family_options = {}
+        # {'backend': 'default', 'ttl': 3600, 'negative_ttl': 60}, get / get_many
+        # read through the cache, save / delete invalidate the row
+        cache = None
+        # seconds, cells older than this are dropped by hbase on compaction and
+        # hidden from reads before that. time_to_live of every column family
+        ttl = None
 
     @classmethod
+    @contextmanager
     def get_table(cls):
-        conn = HBaseClient.get_connection()
-        if not cls.Meta.table_name:
-            raise NotImplementedError('Missing table_name in HBaseModel meta class')
-        return conn.table(cls.get_table_name())
+        # the table is bound to a pooled connection, only use it inside the with block
+        with HBaseClient.connection() as conn:
+            yield conn.table(cls.get_table_name())
+
+    @classmethod
+    def execute(cls, func, retries=None):
+        # run func(table) with a pooled connection, retried on a broken transport
+        table_name = cls.get_table_name()
+        return HBaseClient.execute(lambda conn: func(conn.table(table_name)), retries=retries)
 
     @property
     def row_key(self):
-        return self.serialize_row_key(self.__dict__)
+        return self.serialize_row_key(self.to_dict())
 
     @classmethod
     def get_field_hash(cls):
-        field_hash = {}
-        for field in cls.__dict__:
-            field_obj = getattr(cls, field)
-            if isinstance(field_obj, HBaseField):
-                field_hash[field] = field_obj
-        return field_hash
+        return cls._fields
 
     def __init__(self, **kwargs):
-        for key, field in self.get_field_hash().items():
-            value = kwargs.get(key)
-            setattr(self, key, value)  # set self.__dict__
+        for key in self._fields:
+            setattr(self, key, kwargs.get(key))
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self._fields}
 
     @classmethod
     def init_from_row(cls, row_key, row_data):
         if not row_data:
             return None
         data = cls.deserialize_row_key(row_key)
+        column_decoders = cls._column_decoders
         for column_key, column_value in row_data.items():
-            # remove column family
-            column_key = column_key.decode('utf-8')
-            key = column_key[column_key.find(':') + 1:]
-            data[key] = cls.deserialize_field(key, column_value)
+            key, deserialize = column_decoders[column_key]
+            data[key] = deserialize(column_value)
         return cls(**data)
 
+    @classmethod
+    def decode_rows(cls, rows, keys_only=False):
+        """
+        bulk version of init_from_row for a whole scan result
+        [(row_key, row_data), ...] => [instance or None, ...]
+        decoding goes field by field instead of row by row: all row keys are
+        split / unpacked at once by the key codec, every column is converted
+        with one map() and the slots of all instances are filled with map()
+        over the slot descriptors, so there is no python level loop per row
+        keys_only: only decode the row keys, like init_from_scan_row
+        """
+        rows = rows if isinstance(rows, list) else list(rows)
+        get_row_key, get_row_data = operator.itemgetter(0), operator.itemgetter(1)
+        if not keys_only and not all(map(get_row_data, rows)):
+            # missing rows (e.g. from get_many) are None like in init_from_row
+            instances = iter(cls.decode_rows([row for row in rows if row[1]]))
+            return [next(instances) if row_data else None for row_key, row_data in rows]
+        if not rows:
+            return []
+
+        num_rows = len(rows)
+        instances = list(map(object.__new__, itertools.repeat(cls, num_rows)))
+        values_by_key = dict(zip(
+            cls.Meta.row_key,
+            cls._key_codec.decode_many(list(map(get_row_key, rows))),
+        ))
+        if not keys_only:
+            all_row_data = list(map(get_row_data, rows))
+            for key, column_key, field in cls._column_fields:
+                values_by_key[key] = cls.decode_column(field, column_key.encode('utf-8'), all_row_data)
+
+        setters = cls._slot_setters
+        for key in cls._fields:
+            values = values_by_key.get(key)
+            if values is None:
+                values = itertools.repeat(None, num_rows)
+            # consume the map in C, setters return None
+            any(map(setters[key], instances, values))
+        return instances
+
+    @classmethod
+    def decode_column(cls, field, column_key, all_row_data):
+        # values of one column in every row, None where the row doesn't have it
+        try:
+            return field.deserialize_many(list(map(operator.itemgetter(column_key), all_row_data)))
+        except KeyError:
+            pass
+        present = [row_data[column_key] for row_data in all_row_data if column_key in row_data]
+        if not present:
+            return None
+        values = iter(field.deserialize_many(present))
+        return [
+            next(values) if column_key in row_data else None
+            for row_data in all_row_data
+        ]
+
     @classmethod
     def serialize_field(cls, field, value):
-        value = str(value)
-        if isinstance(field, IntegerField):
-            # int are fixed as 16 digits, left padding with 0
-            value = str(value)
-            while len(value) < 16:
-                value = '0' + value
-        if field.reverse:
-            value = value[::-1]
-        return value
+        return field.serialize(value)
 
     @classmethod
     def deserialize_field(cls, key, value):
-        field = cls.get_field_hash()[key]
-        if field.reverse:
-            value = value[::-1]
-        if field.field_type in [IntegerField.field_type, TimestampField.field_type]:
-            return int(value)
-        return value
+        return cls._fields[key].deserialize(value)
 
     @classmethod
     def serialize_row_key(cls, data, is_prefix=False):
         """
-        serialize dict to bytes (not str)
+        serialize dict to bytes (not str), with Meta.key_encoding = 'string'
         {key1: val1} => b"val1"
         {key1: val1, key2: val2} => b"val1:val2"
         {key1: val1, key2: val2, key3: val3} => b"val1:val2:val3"
         """
-        field_hash = cls.get_field_hash()
-        values = []
-        for key, field in field_hash.items():
-            if field.column_family:
-                continue
-            value = data.get(key)
-            if value is None:
-                if not is_prefix:
-                    raise BadRowKeyError(f"{key} is missing in row key")
-                break
-            value = cls.serialize_field(field, value)
-            if ':' in value:
-                raise BadRowKeyError(f"{key} should not contain ':' in value: {value}")
-            values.append(value)
-        return bytes(':'.join(values), encoding='utf-8')
+        return cls._key_codec.encode(data, is_prefix)
 
     @classmethod
     def deserialize_row_key(cls, row_key):
         """
-        "val1" => {'key1': val1, 'key2': None, 'key3': None}
-        "val1:val2" => {'key1': val1, 'key2': val2, 'key3': None}
+        "val1" => {'key1': val1}
+        "val1:val2" => {'key1': val1, 'key2': val2}
         "val1:val2:val3" => {'key1': val1, 'key2': val2, 'key3': val3}
         """
-        data = {}
-        if isinstance(row_key, bytes):
-            # bytes to str
-            row_key = row_key.decode('utf-8')
+        return cls._key_codec.decode(row_key)
 
-        # val1:val2 => val1:val2:  each find(':') can find a val
-        row_key = row_key + ':'
-        for key in cls.Meta.row_key:
-            index = row_key.find(':')
-            if index == -1:
-                break
-            data[key] = cls.deserialize_field(key, row_key[:index])
-            row_key = row_key[index + 1:]
-        return data
+    @classmethod
+    def salt_row_key(cls, row_key):
+        # logical row key => row key stored in hbase
+        if not cls._salt_buckets:
+            return row_key
+        return bytes([zlib.crc32(row_key) % cls._salt_buckets]) + row_key
+
+    @classmethod
+    def unsalt_row_key(cls, row_key):
+        # row key stored in hbase => logical row key
+        if not cls._salt_buckets:
+            return row_key
+        return row_key[1:]
 
     @classmethod
     def serialize_row_data(cls, data):
         row_data = {}
-        field_hash = cls.get_field_hash()
-        for key, field in field_hash.items():
-            if not field.column_family:
-                continue
-            column_key = '{}:{}'.format(field.column_family, key)
+        for key, column_key, field in cls._column_fields:
             column_value = data.get(key)
             if column_value is None:
                 continue
-            row_data[column_key] = cls.serialize_field(field, column_value)
+            row_data[column_key] = field.serialize(column_value)
         return row_data
 
-    def save(self):
-        row_data = self.serialize_row_data(self.__dict__)
+    def save(self, is_new=False):
+        data = self.to_dict()
+        row_data = self.serialize_row_data(data)
         # if row_data is empty，(no column key values), hbase will just ignore
         # raise exception to remind and prevent empty value
         if len(row_data) == 0:
             raise EmptyColumnError()
-        table = self.get_table()
-        table.put(self.row_key, row_data)
+        row_key = self.serialize_row_key(data)
+        previous_data = None
+        if self._indexes and not is_new:
+            # index entries of the previous values must be removed
+            previous = self.get(**data)
+            previous_data = previous.to_dict() if previous is not None else None
+        self.put_row(
+            self.get_table_name(),
+            self.salt_row_key(row_key),
+            row_data,
+            callback=self.get_invalidate_callback(row_key),
+        )
+        self.update_indexes(row_key, row_data, data, previous_data)
+
+    @classmethod
+    def put_row(cls, table_name, row_key, row_data, callback=None):
+        # callback runs once the put is sent, after the batch flush inside a batch
+        batch = HBaseBatch.current()
+        if batch is not None:
+            batch.put(table_name, row_key, row_data, callback)
+            return
+        HBaseClient.execute(lambda conn: conn.table(table_name).put(row_key, row_data))
+        if callback is not None:
+            callback()
+
+    @classmethod
+    def delete_row(cls, table_name, row_key, callback=None):
+        batch = HBaseBatch.current()
+        if batch is not None:
+            batch.delete(table_name, row_key, callback)
+            return
+        HBaseClient.execute(lambda conn: conn.table(table_name).delete(row_key))
+        if callback is not None:
+            callback()
+
+    @classmethod
+    def get_invalidate_callback(cls, row_key):
+        if cls._row_cache is None:
+            return None
+        return lambda: cls._row_cache.delete(row_key)
+
+    @classmethod
+    def fetch_rows(cls, row_keys):
+        """
+        logical row keys => {row_key: row_data}, row_data is {} for a missing row
+        read through Meta.cache if the model has one
+        """
+        rows = {}
+        if cls._row_cache is not None:
+            rows = cls._row_cache.get_many(row_keys)
+        missing_row_keys = [row_key for row_key in row_keys if row_key not in rows]
+        if not missing_row_keys:
+            return rows
+        salted_row_keys = [cls.salt_row_key(row_key) for row_key in missing_row_keys]
+        if len(salted_row_keys) == 1:
+            salted_row_key = salted_row_keys[0]
+            row_data = cls.execute(lambda table: table.row(salted_row_key))
+            fetched = {missing_row_keys[0]: row_data}
+        else:
+            row_data_by_key = dict(cls.execute(lambda table: table.rows(salted_row_keys)))
+            fetched = {
+                row_key: row_data_by_key.get(salted_row_key, {})
+                for row_key, salted_row_key in zip(missing_row_keys, salted_row_keys)
+            }
+        if cls._row_cache is not None:
+            cls._row_cache.set_many(fetched)
+        rows.update(fetched)
+        return rows
+
+    @classmethod
+    def cache_stats(cls):
+        # {'hits': 10, 'misses': 2, 'hit_rate': 0.83} of this process, None without Meta.cache
+        if cls._row_cache is None:
+            return None
+        return cls._row_cache.stats()
+
+    @classmethod
+    def serialize_index_key(cls, index_fields, codec, data):
+        if data is None or any(data.get(key) is None for key in index_fields):
+            return None
+        return codec.encode(data)
+
+    @classmethod
+    def update_indexes(cls, row_key, row_data, data, previous_data):
+        for index_fields, codec in cls._indexes.values():
+            table_name = cls.get_index_table_name(index_fields)
+            index_key = cls.serialize_index_key(index_fields, codec, data)
+            previous_index_key = cls.serialize_index_key(index_fields, codec, previous_data)
+            if previous_index_key is not None and previous_index_key != index_key:
+                cls.delete_row(table_name, previous_index_key)
+            if index_key is not None:
+                cls.put_row(table_name, index_key, {
+                    INDEX_ROW_KEY_COLUMN: row_key,
+                    **row_data,
+                })
 
     @classmethod
     def get(cls, **kwargs):
         row_key = cls.serialize_row_key(kwargs)
-        table = cls.get_table()
-        row_data = table.row(row_key)
+        row_data = cls.fetch_rows([row_key])[row_key]
+        return cls.init_from_row(row_key, row_data)
+
+    @classmethod
+    def get_by_index(cls, **kwargs):
+        """
+        Meta.indexes = [('from_user_id', 'to_user_id')]
+        get_by_index(from_user_id=1, to_user_id=2) => instance or None
+        one point get on the index table, no scan
+        """
+        index_fields, codec = cls.get_index(kwargs)
+        index_key = codec.encode(kwargs)
+        table_name = cls.get_index_table_name(index_fields)
+        row_data = HBaseClient.execute(lambda conn: conn.table(table_name).row(index_key))
+        return cls.init_from_index_row(row_data)
+
+    @classmethod
+    def get_many_by_index(cls, keys):
+        """
+        [{from_user_id: 1, to_user_id: 2}, ...] => [instance or None, ...]
+        one multi-get on the index table, every key must use the same index
+        """
+        if not keys:
+            return []
+        index_fields, codec = cls.get_index(keys[0])
+        for key in keys:
+            if frozenset(key) != frozenset(index_fields):
+                raise ValueError(f'Keys of get_many_by_index must all use the index on {index_fields}')
+        index_keys = [codec.encode(key) for key in keys]
+        table_name = cls.get_index_table_name(index_fields)
+        rows = dict(HBaseClient.execute(lambda conn: conn.table(table_name).rows(index_keys)))
+        return [cls.init_from_index_row(rows.get(index_key)) for index_key in index_keys]
+
+    @classmethod
+    def get_index(cls, key):
+        # (index_fields, codec) of the Meta.indexes entry made of the fields of key
+        if frozenset(key) not in cls._indexes:
+            raise ValueError(f'No index on {tuple(key)} in {cls.__name__} Meta.indexes')
+        return cls._indexes[frozenset(key)]
+
+    @classmethod
+    def init_from_index_row(cls, row_data):
+        if not row_data:
+            return None
+        row_data = dict(row_data)
+        row_key = row_data.pop(INDEX_ROW_KEY_COLUMN.encode('utf-8'))
         return cls.init_from_row(row_key, row_data)
 
+    @classmethod
+    def rebuild_indexes(cls, batch_size=None):
+        # fill the index tables from existing rows, e.g. after adding Meta.indexes
+        with cls.batch(batch_size=batch_size):
+            for instance in cls.filter_iter():
+                data = instance.to_dict()
+                row_key = cls.serialize_row_key(data)
+                cls.update_indexes(row_key, cls.serialize_row_data(data), data, None)
+
+    @classmethod
+    def get_many(cls, keys):
+        """
+        [{key1: val1, key2: val2}, ...] => [instance or None, ...]
+        all rows are fetched in one round trip, results keep the order of keys
+        """
+        row_keys = [cls.serialize_row_key(key) for key in keys]
+        if not row_keys:
+            return []
+        rows = cls.fetch_rows(row_keys)
+        return cls.decode_rows([(row_key, rows[row_key]) for row_key in row_keys])
+
     @classmethod
     def create(cls, **kwargs):
         instance = cls(**kwargs)
-        instance.save()
+        instance.save(is_new=True)
         return instance
 
+    @classmethod
+    def bulk_create(cls, instances, batch_size=None, transaction=False):
+        with cls.batch(batch_size=batch_size, transaction=transaction):
+            for instance in instances:
+                instance.save(is_new=True)
+        return instances
+
+    @classmethod
+    def batch(cls, batch_size=None, transaction=False):
+        """
+        with HBaseModel.batch():
+            HBaseFollower.create(...)
+            HBaseFollowing.create(...)
+        saves and deletes of any model inside the block are buffered and sent
+        in chunks of batch_size. inside another batch, e.g. bulk_create in a
+        with block, the outer batch is reused
+        """
+        return HBaseBatch(batch_size=batch_size, transaction=transaction)
+
     @classmethod
     def delete(cls, **kwargs):
         row_key = cls.serialize_row_key(kwargs)
-        table = cls.get_table()
-        return table.delete(row_key)
+        previous_data = None
+        if cls._indexes:
+            # index keys are built from column values, read them before deleting
+            instance = cls.get(**kwargs)
+            if instance is not None:
+                previous_data = instance.to_dict()
+        cls.delete_with_indexes(row_key, previous_data)
+
+    @classmethod
+    def delete_with_indexes(cls, row_key, previous_data):
+        if previous_data is not None:
+            cls.update_indexes(row_key, None, None, previous_data)
+        cls.delete_row(
+            cls.get_table_name(),
+            cls.salt_row_key(row_key),
+            callback=cls.get_invalidate_callback(row_key),
+        )
+
+    @classmethod
+    def bulk_delete(cls, instances, batch_size=None, transaction=False):
+        """
+        delete the rows of instances in chunks of batch_size, like bulk_create
+        index rows are found from the column values of the instances, so they
+        must be loaded with the indexed columns (not keys_only)
+        """
+        with cls.batch(batch_size=batch_size, transaction=transaction):
+            for instance in instances:
+                data = instance.to_dict()
+                cls.delete_with_indexes(cls.serialize_row_key(data), data if cls._indexes else None)
+        return len(instances)
+
+    @classmethod
+    def delete_prefix(cls, prefix, limit=None, batch_size=1000):
+        """
+        delete every row under prefix, e.g. delete_prefix((1, None)), one scan and
+        a batch of deletes per batch_size rows => number of rows deleted
+        """
+        instances = cls.filter_iter(
+            prefix=prefix,
+            limit=limit,
+            # without indexes the row keys are all we need
+            keys_only=not cls._indexes,
+            batch_size=batch_size,
+        )
+        deleted = 0
+        for chunk in iter(lambda: list(itertools.islice(instances, batch_size)), []):
+            deleted += cls.bulk_delete(chunk, batch_size=batch_size)
+        return deleted
+
+    @classmethod
+    def increment(cls, key, value=1, **kwargs):
+        """
+        HBaseUserStats.increment('follower_count', user_id=1) => new value
+        atomic in the region server, sent right away even inside a batch.
+        never retried, a transport error may come after the increment was
+        applied and a retry would count it twice. the error is raised instead
+        """
+        column_key = cls.get_counter_column_key(key)
+        row_key = cls.serialize_row_key(kwargs)
+        salted_row_key = cls.salt_row_key(row_key)
+        result = cls.execute(lambda table: table.counter_inc(salted_row_key, column_key, value), retries=0)
+        if cls._row_cache is not None:
+            cls._row_cache.delete(row_key)
+        return result
+
+    @classmethod
+    def set_counter(cls, key, value, **kwargs):
+        # overwrite a counter, e.g. when backfilling it, not atomic with increment.
+        # not retried either, a late retry could overwrite increments made since
+        column_key = cls.get_counter_column_key(key)
+        row_key = cls.serialize_row_key(kwargs)
+        salted_row_key = cls.salt_row_key(row_key)
+        cls.execute(lambda table: table.counter_set(salted_row_key, column_key, value), retries=0)
+        if cls._row_cache is not None:
+            cls._row_cache.delete(row_key)
+
+    @classmethod
+    def get_counter(cls, key, **kwargs):
+        # 0 if the counter was never incremented
+        column_key = cls.get_counter_column_key(key)
+        salted_row_key = cls.salt_row_key(cls.serialize_row_key(kwargs))
+        return cls.execute(lambda table: table.counter_get(salted_row_key, column_key))
+
+    @classmethod
+    def get_counter_column_key(cls, key):
+        if cls._fields[key].field_type != 'counter':
+            raise ValueError(f'{key} is not a CounterField')
+        return cls.get_column_key(key).encode('utf-8')
 
     @classmethod
     def get_table_name(cls):
@@ -170,33 +568,94 @@ class HBaseModel:
             return f'test_{cls.Meta.table_name}'
         return cls.Meta.table_name
 
+    @classmethod
+    def get_index_table_name(cls, index_fields):
+        return '{}_by_{}'.format(cls.get_table_name(), '_'.join(index_fields))
+
+    @classmethod
+    def get_column_families(cls):
+        # {table_name: {column_family: options}} of the model table and its index tables
+        options = dict(getattr(cls.Meta, 'column_family_options', {}))
+        ttl = getattr(cls.Meta, 'ttl', None)
+        if ttl is not None:
+            options['time_to_live'] = ttl
+        column_families = {
+            field.column_family: dict(options)
+            for key, column_key, field in cls._column_fields
+        }
+        tables = {cls.get_table_name(): column_families}
+        for index_fields, codec in cls._indexes.values():
+            tables[cls.get_index_table_name(index_fields)] = {
+                INDEX_COLUMN_FAMILY: dict(options),
+                **column_families,
+            }
+        return tables
+
+    @classmethod
+    def get_split_points(cls, num_regions):
+        """
+        {table_name: [split point, ...]} to pre-split the model table and its
+        index tables into num_regions regions
+        salted tables split at bucket boundaries first, then inside the buckets
+        """
+        tables = {}
+        if cls._salt_buckets:
+            buckets = cls._salt_buckets
+            if num_regions <= buckets:
+                points = [bytes([buckets * i // num_regions]) for i in range(1, num_regions)]
+            else:
+                try:
+                    bucket_points = cls._key_codec.split_points(num_regions // buckets)
+                except NotImplementedError:
+                    bucket_points = []
+                points = []
+                for bucket in range(buckets):
+                    salt = bytes([bucket])
+                    if bucket:
+                        points.append(salt)
+                    points.extend(salt + point for point in bucket_points)
+            tables[cls.get_table_name()] = points
+        else:
+            tables[cls.get_table_name()] = cls._key_codec.split_points(num_regions)
+        for index_fields, codec in cls._indexes.values():
+            tables[cls.get_index_table_name(index_fields)] = codec.split_points(num_regions)
+        return tables
+
     @classmethod
     def drop_table(cls):
         if not settings.TESTING:
             raise Exception('You can not drop table outside of unit tests')
-        conn = HBaseClient.get_connection()
-        conn.delete_table(cls.get_table_name(), True)
+        table_names = list(cls.get_column_families().keys())
+
+        def drop(conn):
+            for table_name in table_names:
+                conn.delete_table(table_name, True)
+
+        HBaseClient.execute(drop)
 
     # for testing only
     @classmethod
     def create_table(cls):
         if not settings.TESTING:
             raise Exception('You can not create table outside of unit tests')
-        conn = HBaseClient.get_connection()
-        tables = [table.decode('utf-8') for table in conn.tables()]
-        if cls.get_table_name() in tables:
-            return
-        column_families = {
-            field.column_family: dict()
-            for key, field in cls.get_field_hash().items()
-            if field.column_family is not None
-        }
-        conn.create_table(cls.get_table_name(), column_families)
+        tables_to_create = cls.get_column_families()
+
+        def create(conn):
+            tables = [table.decode('utf-8') for table in conn.tables()]
+            for table_name, column_families in tables_to_create.items():
+                if table_name in tables:
+                    continue
+                conn.create_table(table_name, column_families)
+
+        HBaseClient.execute(create)
 
     @classmethod
     def serialize_row_key_from_tuple(cls, row_key_tuple):
         if row_key_tuple is None:
             return None
+        if isinstance(row_key_tuple, bytes):
+            # already a serialized row key, e.g. from a pagination cursor
+            return row_key_tuple
         data = {
             key: value
             for key, value in zip(cls.Meta.row_key, row_key_tuple)
@@ -204,19 +663,295 @@ class HBaseModel:
         return cls.serialize_row_key(data, is_prefix=True)
 
     @classmethod
-    def filter(cls, start=None, stop=None, prefix=None, limit=None, reverse=False):
+    def get_scan_kwargs(cls, start=None, stop=None, prefix=None, limit=None, reverse=False,
+                        columns=None, keys_only=False, where=None, time_range=None):
         # serialize tuple to str
-        row_start = cls.serialize_row_key_from_tuple(start)
-        row_stop = cls.serialize_row_key_from_tuple(stop)
-        row_prefix = cls.serialize_row_key_from_tuple(prefix)
+        scan_kwargs = {
+            'row_start': cls.serialize_row_key_from_tuple(start),
+            'row_stop': cls.serialize_row_key_from_tuple(stop),
+            'row_prefix': cls.serialize_row_key_from_tuple(prefix),
+            'limit': limit,
+            'reverse': reverse,
+        }
+        if time_range is not None:
+            min_timestamp, max_timestamp = time_range
+            if max_timestamp is not None:
+                # thrift scanners only take an upper bound, cells written at or
+                # after it are skipped by the region servers
+                scan_kwargs['timestamp'] = max_timestamp
+            if min_timestamp is not None:
+                # the lower bound is checked by filter_time_range, rows dropped
+                # there must not count towards the limit
+                scan_kwargs['include_timestamp'] = True
+                scan_kwargs['limit'] = None
+        filters = []
+        if where:
+            # only rows matching the values are sent back by the region servers
+            filters.extend(cls.get_value_filter(key, value) for key, value in where.items())
+            if keys_only:
+                # KeyOnlyFilter would hide the values from SingleColumnValueFilter,
+                # fetch the compared columns only instead
+                columns = list(where.keys())
+            elif columns:
+                columns = list(columns) + [key for key in where if key not in columns]
+        elif keys_only:
+            # one empty cell per row, enough to rebuild the row key
+            filters.append('FirstKeyOnlyFilter() AND KeyOnlyFilter()')
+        if columns:
+            scan_kwargs['columns'] = [cls.get_column_key(key) for key in columns]
+        if filters:
+            scan_kwargs['filter'] = ' AND '.join(filters)
+        return scan_kwargs
+
+    @classmethod
+    def get_bucket_scan_kwargs(cls, scan_kwargs):
+        """
+        one scan per salt bucket, the row key range is the same inside every bucket
+        prefix b'0001' => b'\\x00' + b'0001', b'\\x01' + b'0001', ...
+        """
+        row_start = scan_kwargs['row_start']
+        row_stop = scan_kwargs['row_stop']
+        row_prefix = scan_kwargs['row_prefix']
+        reverse = scan_kwargs['reverse']
+        bucket_scan_kwargs = []
+        for bucket in range(cls._salt_buckets):
+            salt = bytes([bucket])
+            # first key of the next bucket, None for the last bucket (end of table)
+            next_salt = bytes([bucket + 1]) if bucket < 255 else None
+            kwargs = dict(scan_kwargs)
+            if row_prefix is not None:
+                kwargs['row_prefix'] = salt + row_prefix
+            elif reverse:
+                # reverse scans start from the larger key
+                kwargs['row_start'] = salt + row_start if row_start is not None else next_salt
+                kwargs['row_stop'] = salt + row_stop if row_stop is not None else salt
+            else:
+                kwargs['row_start'] = salt + row_start if row_start is not None else salt
+                kwargs['row_stop'] = salt + row_stop if row_stop is not None else next_salt
+            bucket_scan_kwargs.append(kwargs)
+        return bucket_scan_kwargs
 
-        # scan table
-        table = cls.get_table()
-        rows = table.scan(row_start, row_stop, row_prefix, limit=limit, reverse=reverse)
+    @classmethod
+    def filter_time_range(cls, rows, time_range, limit):
+        """
+        rows scanned with include_timestamp => rows without timestamps
+        cells written before time_range[0] are dropped, so are rows left empty
+        """
+        if time_range is None or time_range[0] is None:
+            return rows
+        min_timestamp = time_range[0]
+        rows = (
+            (row_key, {
+                column_key: value
+                for column_key, (value, timestamp) in row_data.items()
+                if timestamp >= min_timestamp
+            })
+            for row_key, row_data in rows
+        )
+        return itertools.islice(((row_key, row_data) for row_key, row_data in rows if row_data), limit)
+
+    @classmethod
+    def scan_rows(cls, table, scan_kwargs, time_range, limit):
+        """
+        => rows of one scan, without timestamps. the lower bound of time_range is
+        checked here, the scanner is read only until limit rows are kept instead
+        of pulling the whole range first
+        """
+        scanner = table.scan(**scan_kwargs)
+        try:
+            return list(cls.filter_time_range(scanner, time_range, limit))
+        finally:
+            # closes the server side scanner before the connection goes back to the pool
+            scanner.close()
+
+    @classmethod
+    def merge_bucket_rows(cls, bucket_rows, limit, reverse):
+        # rows of every bucket are sorted already, k-way merge them by logical row key
+        rows = heapq.merge(*bucket_rows, key=lambda row: row[0][1:], reverse=reverse)
+        for row_key, row_data in itertools.islice(rows, limit):
+            yield row_key[1:], row_data
+
+    @classmethod
+    def get_column_key(cls, key):
+        field = cls._fields[key]
+        if not field.column_family:
+            raise ValueError(f'{key} is not a column')
+        return '{}:{}'.format(field.column_family, key)
+
+    @classmethod
+    def get_value_filter(cls, key, value):
+        """
+        where={'to_user_id': 42} =>
+        "SingleColumnValueFilter('cf', 'to_user_id', =, 'binary:0000000000000042', true, true)"
+        rows missing the column are filtered out too
+        """
+        field = cls._fields[key]
+        if not field.column_family:
+            raise ValueError(f'{key} is not a column, use start / stop / prefix for row key fields')
+        value = field.serialize(value).replace("'", "''")
+        return "SingleColumnValueFilter('{}', '{}', =, 'binary:{}', true, true)".format(
+            field.column_family,
+            key,
+            value,
+        )
+
+    @classmethod
+    def init_from_scan_row(cls, row_key, row_data, keys_only=False):
+        if keys_only:
+            # column values are empty or partial, only the row key is reliable
+            return cls(**cls.deserialize_row_key(row_key))
+        return cls.init_from_row(row_key, row_data)
+
+    @classmethod
+    def filter(cls, start=None, stop=None, prefix=None, limit=None, reverse=False,
+               columns=None, keys_only=False, where=None, time_range=None):
+        """
+        start / stop / prefix: tuple of row key values, or serialized row key bytes
+        columns: only fetch these column fields, e.g. ['to_user_id']
+        keys_only: only fetch row keys, column fields of the instances are None
+        where: {column field: value}, compiled to SingleColumnValueFilter so the
+               filtering happens in the region servers
+        time_range: (min, max) cell timestamps in milliseconds, min inclusive and
+               max exclusive, either can be None. only cells written in the range
+               are returned, rows without such cells are skipped. max is checked
+               by the region servers, min on the client: cells older than min are
+               still sent and dropped here, the scan stops once limit rows are kept
+        """
+        scan_kwargs = cls.get_scan_kwargs(
+            start, stop, prefix, limit, reverse,
+            columns=columns,
+            keys_only=keys_only,
+            where=where,
+            time_range=time_range,
+        )
+
+        # scan table, the scanner must be drained before the connection goes
+        # back to the pool
+        if cls._salt_buckets:
+            # limit is pushed down to every bucket, at most limit rows come
+            # from each of them
+            table_name = cls.get_table_name()
+            bucket_rows = HBaseClient.execute_many([
+                lambda conn, kwargs=kwargs: cls.scan_rows(conn.table(table_name), kwargs, time_range, limit)
+                for kwargs in cls.get_bucket_scan_kwargs(scan_kwargs)
+            ])
+            rows = cls.merge_bucket_rows(bucket_rows, limit, reverse)
+        else:
+            rows = cls.execute(lambda table: cls.scan_rows(table, scan_kwargs, time_range, limit))
 
         # deserialize to instance list
-        results = []
-        for row_key, row_data in rows:
-            instance = cls.init_from_row(row_key, row_data)
-            results.append(instance)
-        return results
+        return cls.decode_rows(rows, keys_only)
+
+    @classmethod
+    def filter_iter(cls, start=None, stop=None, prefix=None, limit=None, reverse=False,
+                    columns=None, keys_only=False, where=None, time_range=None,
+                    batch_size=1000, scan_batching=None):
+        """
+        lazy version of filter, the scanner fetches batch_size rows per round trip
+        and instances are deserialized one round trip at a time
+        the pooled connection is held until the iterator is exhausted or closed,
+        break out of the loop (or use itertools.islice) to stop the scan early
+        """
+        scan_kwargs = cls.get_scan_kwargs(
+            start, stop, prefix, limit, reverse,
+            columns=columns,
+            keys_only=keys_only,
+            where=where,
+            time_range=time_range,
+        )
+        with cls.get_table() as table:
+            if cls._salt_buckets:
+                # one scanner per bucket on the same connection, merged lazily
+                bucket_rows = [
+                    table.scan(batch_size=batch_size, scan_batching=scan_batching, **kwargs)
+                    for kwargs in cls.get_bucket_scan_kwargs(scan_kwargs)
+                ]
+                rows = cls.merge_bucket_rows(bucket_rows, scan_kwargs['limit'], reverse)
+            else:
+                rows = table.scan(
+                    batch_size=batch_size,
+                    scan_batching=scan_batching,
+                    **scan_kwargs,
+                )
+            rows = cls.filter_time_range(rows, time_range, limit)
+            # decode the rows of each round trip in bulk
+            rows = iter(rows)
+            for chunk in iter(lambda: list(itertools.islice(rows, batch_size)), []):
+                yield from cls.decode_rows(chunk, keys_only)
+
+    # asyncio facade for ASGI code, every call runs on the async executor of
+    # HBaseClient so independent reads can be awaited together:
+    #   followers, stats = await asyncio.gather(
+    #       HBaseFollower.afilter_list(prefix=(user_id, None), limit=20),
+    #       HBaseUserStats.aget(user_id=user_id),
+    #   )
+
+    @classmethod
+    async def aget(cls, **kwargs):
+        return await HBaseClient.run_async(cls.get, **kwargs)
+
+    @classmethod
+    async def aget_many(cls, keys):
+        return await HBaseClient.run_async(cls.get_many, keys)
+
+    @classmethod
+    async def acreate(cls, **kwargs):
+        return await HBaseClient.run_async(cls.create, **kwargs)
+
+    async def asave(self, is_new=False):
+        return await HBaseClient.run_async(self.save, is_new=is_new)
+
+    @classmethod
+    async def adelete(cls, **kwargs):
+        return await HBaseClient.run_async(cls.delete, **kwargs)
+
+    @classmethod
+    async def aincrement(cls, key, value=1, **kwargs):
+        return await HBaseClient.run_async(cls.increment, key, value, **kwargs)
+
+    @classmethod
+    async def aget_counter(cls, key, **kwargs):
+        return await HBaseClient.run_async(cls.get_counter, key, **kwargs)
+
+    @classmethod
+    async def afilter_list(cls, **kwargs):
+        # same arguments as filter, one scan
+        return await HBaseClient.run_async(cls.filter, **kwargs)
+
+    @classmethod
+    async def afilter(cls, start=None, stop=None, prefix=None, limit=None, reverse=False,
+                      columns=None, keys_only=False, where=None, time_range=None, page_size=100):
+        """
+        async for instance in Model.afilter(prefix=(1, None)): ...
+        rows are fetched page_size at a time, each page is a scan starting right
+        after the row key of the previous page, so no connection or scanner is
+        held while the caller awaits something else
+        """
+        scan = {'start': start, 'stop': stop, 'prefix': prefix}
+        if prefix is not None:
+            prefix = cls.serialize_row_key_from_tuple(prefix)
+            # later pages scan a range, reverse scans stop at the prefix
+            stop = prefix if reverse else row_key_prefix_end(prefix)
+        returned = 0
+        while True:
+            page_limit = page_size if limit is None else min(page_size, limit - returned)
+            instances = await HBaseClient.run_async(
+                cls.filter,
+                limit=page_limit,
+                reverse=reverse,
+                columns=columns,
+                keys_only=keys_only,
+                where=where,
+                time_range=time_range,
+                **scan,
+            )
+            for instance in instances:
+                yield instance
+            returned += len(instances)
+            if len(instances) < page_limit or returned == limit:
+                return
+            last_row_key = instances[-1].row_key
+            scan = {
+                'start': row_key_before(last_row_key) if reverse else row_key_after(last_row_key),
+                'stop': stop,
+            }
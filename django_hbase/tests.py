@@ -0,0 +1,92 @@
+from django.test import SimpleTestCase
+from django_hbase.memory import MemoryConnectionPool
+
+
+class MemoryBackendTests(SimpleTestCase):
+
+    def setUp(self):
+        self.pool = MemoryConnectionPool(size=1)
+        with self.pool.connection() as conn:
+            conn.create_table('test_table', {'cf': dict()})
+            self.table = conn.table('test_table')
+
+    def put_rows(self, row_keys):
+        for row_key in row_keys:
+            self.table.put(row_key, {b'cf:value': row_key})
+
+    def scan_keys(self, **kwargs):
+        return [row_key for row_key, row_data in self.table.scan(**kwargs)]
+
+    def test_tables(self):
+        with self.pool.connection() as conn:
+            self.assertEqual(conn.tables(), [b'test_table'])
+            conn.delete_table('test_table', True)
+            self.assertEqual(conn.tables(), [])
+
+    def test_put_row_and_delete(self):
+        self.table.put(b'a', {b'cf:x': b'1', b'cf:y': b'2'})
+        self.assertEqual(self.table.row(b'a'), {b'cf:x': b'1', b'cf:y': b'2'})
+        self.assertEqual(self.table.row(b'a', columns=[b'cf:x']), {b'cf:x': b'1'})
+        self.assertEqual(self.table.row(b'b'), {})
+
+        self.table.put(b'a', {b'cf:x': b'3'})
+        self.assertEqual(self.table.row(b'a'), {b'cf:x': b'3', b'cf:y': b'2'})
+
+        self.table.delete(b'a', columns=[b'cf:y'])
+        self.assertEqual(self.table.row(b'a'), {b'cf:x': b'3'})
+        self.table.delete(b'a')
+        self.assertEqual(self.table.row(b'a'), {})
+        self.assertEqual(self.scan_keys(), [])
+
+    def test_rows(self):
+        self.put_rows([b'a', b'b', b'c'])
+        rows = self.table.rows([b'c', b'x', b'a'])
+        self.assertEqual(rows, [(b'c', {b'cf:value': b'c'}), (b'a', {b'cf:value': b'a'})])
+
+    def test_scan(self):
+        # bytes order, not insertion order
+        self.put_rows([b'b:2', b'a', b'b:1', b'b\xff', b'c', b'b'])
+        self.assertEqual(self.scan_keys(), [b'a', b'b', b'b:1', b'b:2', b'b\xff', b'c'])
+        self.assertEqual(self.scan_keys(row_start=b'b', row_stop=b'b:2'), [b'b', b'b:1'])
+        self.assertEqual(self.scan_keys(row_prefix=b'b:'), [b'b:1', b'b:2'])
+        self.assertEqual(self.scan_keys(row_prefix=b'b', limit=2), [b'b', b'b:1'])
+
+        # reverse: row_start is inclusive and after row_stop
+        self.assertEqual(self.scan_keys(reverse=True, limit=2), [b'c', b'b\xff'])
+        self.assertEqual(self.scan_keys(row_start=b'b:2', row_stop=b'a', reverse=True), [b'b:2', b'b:1', b'b'])
+        self.assertEqual(self.scan_keys(row_prefix=b'b:', reverse=True), [b'b:2', b'b:1'])
+
+    def test_scan_filter(self):
+        self.table.put(b'a', {b'cf:x': b'1', b'cf:y': b'2'})
+        self.table.put(b'b', {b'cf:x': b'2', b'cf:y': b'2'})
+        self.table.put(b'c', {b'cf:y': b'1'})
+
+        rows = list(self.table.scan(filter="SingleColumnValueFilter('cf', 'x', =, 'binary:2', true, true)"))
+        self.assertEqual(rows, [(b'b', {b'cf:x': b'2', b'cf:y': b'2'})])
+
+        rows = list(self.table.scan(filter='FirstKeyOnlyFilter() AND KeyOnlyFilter()'))
+        self.assertEqual(rows, [(b'a', {b'cf:x': b''}), (b'b', {b'cf:x': b''}), (b'c', {b'cf:y': b''})])
+
+        rows = list(self.table.scan(columns=[b'cf:x']))
+        self.assertEqual([row_key for row_key, row_data in rows], [b'a', b'b'])
+
+    def test_batch_and_counters(self):
+        with self.table.batch(transaction=True) as batch:
+            batch.put(b'a', {b'cf:value': b'a'})
+            batch.put(b'b', {b'cf:value': b'b'})
+            batch.delete(b'a')
+        self.assertEqual(self.scan_keys(), [b'b'])
+
+        try:
+            with self.table.batch(transaction=True) as batch:
+                batch.put(b'c', {b'cf:value': b'c'})
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(self.scan_keys(), [b'b'])
+
+        self.assertEqual(self.table.counter_get(b'x', b'cf:count'), 0)
+        self.assertEqual(self.table.counter_inc(b'x', b'cf:count'), 1)
+        self.assertEqual(self.table.counter_inc(b'x', b'cf:count', 5), 6)
+        self.assertEqual(self.table.counter_dec(b'x', b'cf:count'), 5)
+        self.assertEqual(self.table.counter_get(b'x', b'cf:count'), 5)
@@ -17,17 +17,20 @@ class BaseFriendshipSerializer(serializers.Serializer):
     def create(self, validated_data):
         pass
 
-    def following_user_id_set(self):
+    def has_followed_map(self):
+        # {user_id: has_followed} of every user on the page, one call per page
         if self.context['request'].user.is_anonymous:
             return {}
-        # cached in the current process
-        if hasattr(self, '_cached_following_user_id_set'):
-            return self._cached_following_user_id_set
-        user_id_set = FriendshipService.get_following_user_id_set(
+        if hasattr(self, '_cached_has_followed_map'):
+            return self._cached_has_followed_map
+        # with many=True this is the child of a ListSerializer holding the page
+        page = self.parent.instance if self.parent is not None else [self.instance]
+        has_followed_map = FriendshipService.has_followed_many(
             self.context['request'].user.id,
+            [self.get_user_id(obj) for obj in page],
         )
-        setattr(self, '_cached_following_user_id_set', user_id_set)
-        return user_id_set
+        setattr(self, '_cached_has_followed_map', has_followed_map)
+        return has_followed_map
 
     # must be implemented in subclasses
     def get_user_id(self, obj):
@@ -41,7 +44,7 @@ class BaseFriendshipSerializer(serializers.Serializer):
         return obj.created_at
 
     def get_has_followed(self, obj):
-        return self.get_user_id(obj) in self.following_user_id_set()
+        return self.has_followed_map().get(self.get_user_id(obj), False)
 
 
 class FollowerSerializer(BaseFriendshipSerializer):
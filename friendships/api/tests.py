@@ -1,5 +1,7 @@
 from friendships.api.paginations import FriendshipPagination
+from friendships.models import Friendship
 from friendships.services import FriendshipService
+from gatekeeper.models import GateKeeper
 from rest_framework.test import APIClient
 from testing.testcases import TestCase
 from utils.paginations import EndlessPagination
@@ -222,3 +224,59 @@ class FriendshipApiTests(TestCase):
         # friendship is in ascending order, results is in descending order
         for result, friendship in zip(results, friendships[::-1]):
             self.assertEqual(result['created_at'], friendship.created_at)
+
+    def test_cursor_pagination(self):
+        page_size = EndlessPagination.page_size
+        friendships = []
+        for i in range(page_size * 2 + 1):
+            following = self.create_user('t_user1_following{}'.format(i))
+            friendships.append(self.create_friendship(from_user=self.t_user1, to_user=following))
+
+        url = FOLLOWINGS_URL.format(self.t_user1.id)
+        results, pages = [], 0
+        response = self.anonymous_client.get(url)
+        results.extend(response.data['results'])
+        pages += 1
+        while response.data['has_next_page']:
+            self.assertIsNotNone(response.data['next_cursor'])
+            response = self.anonymous_client.get(url, {'cursor': response.data['next_cursor']})
+            self.assertEqual(response.status_code, 200)
+            results.extend(response.data['results'])
+            pages += 1
+        self.assertEqual(pages, 3)
+        self.assertIsNone(response.data['next_cursor'])
+        self.assertEqual(
+            [result['created_at'] for result in results],
+            [friendship.created_at for friendship in friendships[::-1]],
+        )
+
+        # cursors are signed, tampered ones are rejected
+        response = self.anonymous_client.get(url)
+        cursor = response.data['next_cursor']
+        response = self.anonymous_client.get(url, {'cursor': cursor[:-1]})
+        self.assertEqual(response.status_code, 404)
+        response = self.anonymous_client.get(url, {'cursor': 'abc'})
+        self.assertEqual(response.status_code, 404)
+
+        # a cursor of another user's list is rejected as well, on both stores
+        response = self.anonymous_client.get(FOLLOWINGS_URL.format(self.t_user2.id), {'cursor': cursor})
+        self.assertEqual(response.status_code, 404)
+        response = self.anonymous_client.get(FOLLOWERS_URL.format(self.t_user1.id), {'cursor': cursor})
+        self.assertEqual(response.status_code, 404)
+
+        # mysql rows, the hbase cursor gives their first page after the switch flips
+        GateKeeper.set_kv('switch_friendship_to_hbase', 'percent', 0)
+        for friendship in friendships:
+            Friendship.objects.create(from_user_id=self.t_user1.id, to_user_id=friendship.to_user_id)
+        first_page = self.anonymous_client.get(url).data
+        response = self.anonymous_client.get(url, {'cursor': cursor})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], first_page['results'])
+        mysql_cursor = first_page['next_cursor']
+        response = self.anonymous_client.get(FOLLOWINGS_URL.format(self.t_user2.id), {'cursor': mysql_cursor})
+        self.assertEqual(response.status_code, 404)
+        # and the mysql cursor the first hbase page once the switch is back on
+        GateKeeper.set_kv('switch_friendship_to_hbase', 'percent', 100)
+        response = self.anonymous_client.get(url, {'cursor': mysql_cursor})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['next_cursor'], cursor)
@@ -21,11 +21,12 @@ class FriendshipViewSet(viewsets.GenericViewSet):
     def followers(self, request, pk):
         # GET /api/friendships/pk/followers/
         paginator = self.paginator
+        paginator.list_key = f'followers:{pk}'
         if GateKeeper.is_switch_on('switch_friendship_to_hbase'):
             page = paginator.paginate_hbase(HBaseFollower, (pk,), request)
         else:
             friendships = Friendship.objects.filter(to_user_id=pk).order_by('-created_at')
-            page = paginator.paginate_queryset(friendships)
+            page = paginator.paginate_queryset(friendships, request)
         serializer = FollowerSerializer(page, many=True, context={'request': request})
         return paginator.get_paginated_response(serializer.data)
 
@@ -33,11 +34,12 @@ class FriendshipViewSet(viewsets.GenericViewSet):
     def followings(self, request, pk):
         # GET /api/friendships/pk/followings/
         paginator = self.paginator
+        paginator.list_key = f'followings:{pk}'
         if GateKeeper.is_switch_on('switch_friendship_to_hbase'):
             page = paginator.paginate_hbase(HBaseFollowing, (pk,), request)
         else:
             friendships = Friendship.objects.filter(from_user_id=pk).order_by('-created_at')
-            page = paginator.paginate_queryset(friendships)
+            page = paginator.paginate_queryset(friendships, request)
         serializer = FollowingSerializer(page, many=True, context={'request': request})
         return paginator.get_paginated_response(serializer.data)
 
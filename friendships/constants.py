@@ -0,0 +1,10 @@
+from django.conf import settings
+
+# rows of one direction deleted per chunk when a user is deleted
+CLEANUP_CHUNK_SIZE = 1000 if not settings.TESTING else 3
+# chunks per task run, then the task queues itself again so no worker is held for long
+CLEANUP_CHUNKS_PER_TASK = 50 if not settings.TESTING else 2
+# per user bloom filter of followed ids in redis, 8KB answers ~1% false
+# positives up to ~6800 followings with 7 hashes
+FOLLOWING_BLOOM_FILTER_BITS = 2 ** 16
+FOLLOWING_BLOOM_FILTER_HASHES = 7
@@ -8,6 +8,8 @@ class HBaseFollowing(models.HBaseModel):
      - A 关注的所有人按照关注时间排序
      - A 在某个时间段内关注的人有哪些
      - A 在某个时间点之后/之前关注的前 X 个人是谁
+    index (from_user_id, to_user_id) 支持点查：
+     - A 是否关注了 B
     """
     # row key
     from_user_id = models.IntegerField(reverse=True)
@@ -18,6 +20,12 @@ class HBaseFollowing(models.HBaseModel):
     class Meta:
         table_name = 'twitter_followings'
         row_key = ('from_user_id', 'created_at')
+        indexes = [('from_user_id', 'to_user_id')]
+        column_family_options = {
+            'bloom_filter_type': 'ROW',
+            'compression': 'GZ',
+            'block_cache_enabled': True,
+        }
 
 
 class HBaseFollower(models.HBaseModel):
@@ -37,3 +45,28 @@ class HBaseFollower(models.HBaseModel):
     class Meta:
         table_name = 'twitter_followers'
         row_key = ('to_user_id', 'created_at')
+        column_family_options = {
+            'bloom_filter_type': 'ROW',
+            'compression': 'GZ',
+            'block_cache_enabled': True,
+        }
+
+
+class HBaseUserStats(models.HBaseModel):
+    """
+    每个用户的关注数和粉丝数，follow / unfollow 时原子加减
+    查询计数只需要一次点查，不用 scan 整个 prefix
+    """
+    # row key
+    user_id = models.IntegerField(reverse=True)
+    # column key
+    following_count = models.CounterField(column_family='c')
+    follower_count = models.CounterField(column_family='c')
+
+    class Meta:
+        table_name = 'twitter_user_stats'
+        row_key = ('user_id',)
+        column_family_options = {
+            'bloom_filter_type': 'ROW',
+            'block_cache_enabled': True,
+        }
@@ -1,3 +1,14 @@
+def friendship_saved(sender, instance, **kwargs):
+    from friendships.services import FriendshipService
+    FriendshipService.invalidate_following_cache(instance.from_user_id, followed_user_ids=[instance.to_user_id])
+
+
 def friendship_changed(sender, instance, **kwargs):
     from friendships.services import FriendshipService
     FriendshipService.invalidate_following_cache(instance.from_user_id)
+
+
+def user_deleted(sender, instance, **kwargs):
+    # the mysql rows are kept with a null user, hbase rows are keyed by the user id
+    from friendships.tasks import delete_user_friendships_task
+    delete_user_friendships_task.delay(instance.id)
@@ -0,0 +1,265 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Count, Max, Min
+from django_hbase.client import HBaseClient
+from friendships.hbase_models import HBaseFollower, HBaseFollowing, HBaseUserStats
+from friendships.models import Friendship
+from utils.redis_client import RedisClient
+from utils.time_helpers import datetime_to_timestamp
+
+import django
+import time
+
+# hash of the run being resumed: min_id, max_id, range_size, copied
+CHECKPOINT_KEY = 'backfill_hbase_friendships'
+# set of the start ids of finished ranges
+DONE_RANGES_KEY = 'backfill_hbase_friendships:done'
+# set of the 'start:end' user id ranges of the check in progress, matching counts only
+CHECKED_RANGES_KEY = 'backfill_hbase_friendships:checked'
+
+
+def init_worker():
+    # forked workers must not reuse the sockets of the parent process
+    django.setup()
+    HBaseClient.pool = None
+    HBaseClient.executor = None
+    RedisClient.conn = None
+
+
+def backfill_range(start_id, end_id, batch_size, rows_per_second):
+    """
+    copy the friendships with start_id <= id < end_id into HBaseFollowing and
+    HBaseFollower. rows keep their created_at, so copying a range again rewrites
+    the same row keys => number of friendships copied
+    """
+    copied = 0
+    last_id = start_id - 1
+    started_at = time.time()
+    while True:
+        friendships = list(
+            Friendship.objects.filter(id__gt=last_id, id__lt=end_id)
+            .order_by('id')
+            .values_list('id', 'from_user_id', 'to_user_id', 'created_at')[:batch_size]
+        )
+        if not friendships:
+            break
+        last_id = friendships[-1][0]
+        # users deleted, their follows are gone on the hbase side too
+        follows = [
+            (from_user_id, to_user_id, datetime_to_timestamp(created_at))
+            for friendship_id, from_user_id, to_user_id, created_at in friendships
+            if from_user_id is not None and to_user_id is not None
+        ]
+        HBaseFollowing.bulk_create([
+            HBaseFollowing(from_user_id=from_user_id, to_user_id=to_user_id, created_at=created_at)
+            for from_user_id, to_user_id, created_at in follows
+        ], batch_size=batch_size)
+        HBaseFollower.bulk_create([
+            HBaseFollower(from_user_id=from_user_id, to_user_id=to_user_id, created_at=created_at)
+            for from_user_id, to_user_id, created_at in follows
+        ], batch_size=batch_size)
+        copied += len(follows)
+        throttle(copied, rows_per_second, started_at)
+    return copied
+
+
+def check_user_range(start_user_id, end_user_id, max_id, verify, set_counters, rows_per_second):
+    """
+    for the users with start_user_id <= id < end_user_id, compare the followings /
+    followers counts of the friendships with id <= max_id against keys only
+    prefix scans of the hbase tables, and write them into HBaseUserStats
+    => mismatch messages
+    """
+    mismatches = []
+    scanned = 0
+    started_at = time.time()
+    for key, model_class, count_key in [
+        ('from_user_id', HBaseFollowing, 'following_count'),
+        ('to_user_id', HBaseFollower, 'follower_count'),
+    ]:
+        counts = (
+            Friendship.objects.filter(id__lte=max_id, from_user_id__isnull=False, to_user_id__isnull=False)
+            .filter(**{f'{key}__gte': start_user_id, f'{key}__lt': end_user_id})
+            .values_list(key)
+            .annotate(count=Count('id'))
+            .order_by(key)
+        )
+        for user_id, count in counts.iterator():
+            if set_counters:
+                HBaseUserStats.set_counter(count_key, count, user_id=user_id)
+            if not verify:
+                continue
+            hbase_count = sum(1 for _ in model_class.filter_iter(prefix=(user_id, None), keys_only=True))
+            if hbase_count != count:
+                mismatches.append(f'user {user_id} {count_key}: {count} in mysql, {hbase_count} in hbase')
+            scanned += hbase_count
+            throttle(scanned, rows_per_second, started_at)
+    return mismatches
+
+
+def throttle(rows, rows_per_second, started_at):
+    # sleep until this worker is back under its share of the rate
+    if not rows_per_second:
+        return
+    ahead = rows / rows_per_second - (time.time() - started_at)
+    if ahead > 0:
+        time.sleep(ahead)
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy mysql friendships into HBaseFollowing / HBaseFollower before turning on '
+        'switch_friendship_to_hbase. The id space is split into ranges copied on a '
+        'process pool, finished ranges are checkpointed in redis so an interrupted run '
+        'resumes where it stopped. Ends by comparing the followings / followers count '
+        'of every user in both stores and writing them into HBaseUserStats, on the same '
+        'pool over user id ranges, checkpointed until the check is complete.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='processes, 0 copies in this process')
+        parser.add_argument('--range-size', type=int, default=100000, help='friendship ids per range')
+        parser.add_argument('--batch-size', type=int, default=1000, help='rows per query and hbase batch')
+        parser.add_argument('--users-per-range', type=int, default=10000, help='user ids per range checked')
+        parser.add_argument(
+            '--rows-per-second',
+            type=int,
+            default=10000,
+            help='total rows copied or scanned per second of all workers, 0 is unlimited',
+        )
+        parser.add_argument('--restart', action='store_true', help='forget the checkpoint of a previous run')
+        parser.add_argument('--skip-verify', action='store_true')
+        parser.add_argument('--verify-only', action='store_true')
+        parser.add_argument(
+            '--skip-counters',
+            action='store_true',
+            help='do not write the mysql counts into HBaseUserStats',
+        )
+
+    def handle(self, *args, **options):
+        if min(options['range_size'], options['batch_size'], options['users_per_range']) < 1:
+            raise CommandError('--range-size, --batch-size and --users-per-range should be at least 1')
+        if options['workers'] < 0:
+            raise CommandError('--workers should be at least 0')
+        conn = RedisClient.get_connection()
+        if options['restart']:
+            conn.delete(CHECKPOINT_KEY, DONE_RANGES_KEY, CHECKED_RANGES_KEY)
+        min_id, max_id = self.load_checkpoint(conn, options['range_size'])
+
+        if not options['verify_only']:
+            self.backfill(conn, min_id, max_id, options)
+        if options['skip_verify'] and options['skip_counters']:
+            return
+        mismatches = self.check_users(conn, max_id, options)
+        if options['skip_verify']:
+            return
+        if mismatches:
+            raise CommandError(f'{mismatches} users have different counts in mysql and hbase')
+        self.stdout.write(self.style.SUCCESS('Counts of every user match'))
+
+    def load_checkpoint(self, conn, range_size):
+        # friendships created after the first run are left to a new run with --restart
+        checkpoint = conn.hgetall(CHECKPOINT_KEY)
+        if checkpoint:
+            if int(checkpoint[b'range_size']) != range_size:
+                raise CommandError(
+                    'The checkpoint uses --range-size {}, pass it again or --restart'.format(
+                        int(checkpoint[b'range_size']),
+                    ),
+                )
+            self.stdout.write('Resuming, {} friendships copied so far'.format(int(checkpoint[b'copied'])))
+            return int(checkpoint[b'min_id']), int(checkpoint[b'max_id'])
+
+        ids = Friendship.objects.aggregate(min_id=Min('id'), max_id=Max('id'))
+        min_id, max_id = ids['min_id'] or 0, ids['max_id'] or -1
+        conn.hset(CHECKPOINT_KEY, mapping={
+            'min_id': min_id,
+            'max_id': max_id,
+            'range_size': range_size,
+            'copied': 0,
+        })
+        return min_id, max_id
+
+    def backfill(self, conn, min_id, max_id, options):
+        range_size = options['range_size']
+        done = {int(start_id) for start_id in conn.smembers(DONE_RANGES_KEY)}
+        start_ids = range(min_id, max_id + 1, range_size)
+        ranges = [
+            (start_id, min(start_id + range_size, max_id + 1))
+            for start_id in start_ids
+            if start_id not in done
+        ]
+        self.stdout.write(f'{len(ranges)} of {len(start_ids)} ranges to copy, ids {min_id} to {max_id}')
+
+        args = (options['batch_size'], self.get_worker_rate(options))
+        for (start_id, end_id), copied in self.run(backfill_range, ranges, args, options['workers']):
+            self.finish_range(conn, start_id, end_id, copied)
+
+    def get_worker_rate(self, options):
+        # every worker gets its share of the rate
+        return options['rows_per_second'] / max(options['workers'], 1)
+
+    def run(self, func, ranges, args, workers):
+        # yield (range, func(*range, *args)) of every range as they finish, 0 workers runs them here
+        if workers == 0:
+            for start_id, end_id in ranges:
+                yield (start_id, end_id), func(start_id, end_id, *args)
+            return
+
+        # forked workers would share the sockets of these connections
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+            futures = {
+                executor.submit(func, start_id, end_id, *args): (start_id, end_id)
+                for start_id, end_id in ranges
+            }
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+    def finish_range(self, conn, start_id, end_id, copied):
+        pipeline = conn.pipeline()
+        pipeline.sadd(DONE_RANGES_KEY, start_id)
+        pipeline.hincrby(CHECKPOINT_KEY, 'copied', copied)
+        pipeline.scard(DONE_RANGES_KEY)
+        num_done = pipeline.execute()[-1]
+        self.stdout.write(f'ids [{start_id}, {end_id}) {copied} friendships copied, {num_done} ranges done')
+
+    def check_users(self, conn, max_id, options):
+        """
+        verify and / or set the counters of every user of the copied id range,
+        => number of mismatches. ranges without mismatches are checkpointed so an
+        interrupted check resumes, the checkpoint is dropped once every range is done
+        """
+        verify = not options['skip_verify']
+        users = Friendship.objects.filter(id__lte=max_id).aggregate(
+            Min('from_user_id'), Max('from_user_id'), Min('to_user_id'), Max('to_user_id'),
+        )
+        user_ids = [user_id for user_id in users.values() if user_id is not None]
+        if not user_ids:
+            return 0
+        # aligned on users_per_range, the same ranges whatever the smallest user id is now
+        min_user_id, max_user_id = min(user_ids), max(user_ids)
+        users_per_range = options['users_per_range']
+        start_ids = range(min_user_id // users_per_range * users_per_range, max_user_id + 1, users_per_range)
+        checked = {member.decode() for member in conn.smembers(CHECKED_RANGES_KEY)} if verify else set()
+        ranges = [
+            (start_id, start_id + users_per_range)
+            for start_id in start_ids
+            if f'{start_id}:{start_id + users_per_range}' not in checked
+        ]
+        self.stdout.write(
+            f'{len(ranges)} of {len(start_ids)} user ranges to check, users {min_user_id} to {max_user_id}',
+        )
+
+        mismatches = 0
+        args = (max_id, verify, not options['skip_counters'], self.get_worker_rate(options))
+        for (start_id, end_id), messages in self.run(check_user_range, ranges, args, options['workers']):
+            for message in messages:
+                self.stderr.write(message)
+            mismatches += len(messages)
+            if verify and not messages:
+                conn.sadd(CHECKED_RANGES_KEY, f'{start_id}:{end_id}')
+        if verify:
+            conn.delete(CHECKED_RANGES_KEY)
+        return mismatches
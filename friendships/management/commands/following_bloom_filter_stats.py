@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from friendships.services import FriendshipService
+
+METRIC_PREFIX = 'following_bloom_filter'
+
+
+class Command(BaseCommand):
+    help = (
+        'Print the counters of the following bloom filters of every process as '
+        '"<metric> <value>" lines, for a metrics collector to scrape, e.g. the '
+        'node exporter textfile collector from a cron job. --user-id adds the '
+        'fill and estimated false positive rate of the filters of those users.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-id', type=int, action='append', default=[])
+
+    def handle(self, *args, **options):
+        for name, value in FriendshipService.following_bloom_filter.stats().items():
+            self.stdout.write(f'{METRIC_PREFIX}_{name} {value}')
+        for user_id in options['user_id']:
+            info = FriendshipService.get_following_bloom_filter_info(user_id)
+            if info is None:
+                continue
+            for name, value in info.items():
+                if value is not None:
+                    self.stdout.write(f'{METRIC_PREFIX}_{name}{{user_id="{user_id}"}} {value}')
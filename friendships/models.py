@@ -1,7 +1,7 @@
 from django.contrib.auth.models import User
 from django.db import models
-from django.db.models.signals import post_save, pre_delete
-from friendships.listeners import friendship_changed
+from django.db.models.signals import post_delete, post_save
+from friendships.listeners import friendship_changed, friendship_saved, user_deleted
 from utils.memcached_helper import MemcachedHelper
 
 
@@ -44,5 +44,7 @@ class Friendship(models.Model):
 
 
 # hook up with listeners to invalidate cache
-pre_delete.connect(friendship_changed, sender=Friendship)
-post_save.connect(friendship_changed, sender=Friendship)
+# after the delete, a reload in between would cache the deleted friendship again
+post_delete.connect(friendship_changed, sender=Friendship)
+post_save.connect(friendship_saved, sender=Friendship)
+post_delete.connect(user_deleted, sender=User)
@@ -1,16 +1,29 @@
+from array import array
+from collections import Counter
 from django.core.cache import caches
-from friendships.hbase_models import HBaseFollowing, HBaseFollower
+from django.db.models import Q
+from django_hbase.models import HBaseModel
+from django_hbase.models.codecs import row_key_after, row_key_prefix_end
+from friendships.constants import FOLLOWING_BLOOM_FILTER_BITS, FOLLOWING_BLOOM_FILTER_HASHES
+from friendships.hbase_models import HBaseFollowing, HBaseFollower, HBaseUserStats
 from friendships.models import Friendship
 from gatekeeper.models import GateKeeper
 from twitter import settings
-from twitter.cache import FOLLOWINGS_PATTERN
+from twitter.cache import FOLLOWINGS_BLOOM_PATTERN, FOLLOWINGS_BLOOM_STATS_KEY, FOLLOWINGS_PATTERN
+from utils.bloom_filter import RedisBloomFilter
 
+import itertools
 import time
 
 cache = caches['testing'] if settings.TESTING else caches['default']
 
 
 class FriendshipService(object):
+    following_bloom_filter = RedisBloomFilter(
+        FOLLOWING_BLOOM_FILTER_BITS,
+        FOLLOWING_BLOOM_FILTER_HASHES,
+        stats_key=FOLLOWINGS_BLOOM_STATS_KEY,
+    )
 
     @classmethod
     def get_follower(cls, user):
@@ -21,37 +34,172 @@ class FriendshipService(object):
 
     @classmethod
     def get_follower_ids(cls, to_user_id):
-        friendships = Friendship.objects.filter(to_user_id=to_user_id)
-        return [friendship.from_user_id for friendship in friendships]
+        return [
+            follower_id
+            for batch_ids in cls.iter_follower_id_batches(to_user_id)
+            for follower_id in batch_ids
+        ]
+
+    @classmethod
+    def iter_follower_id_batches(cls, to_user_id, batch_size=1000):
+        """
+        yields lists of up to batch_size follower ids, oldest follow first,
+        from the store the gatekeeper selects. only one batch is in memory at
+        a time, so a user with millions of followers can be streamed
+        """
+        if GateKeeper.is_switch_on('switch_friendship_to_hbase'):
+            followers = HBaseFollower.filter_iter(
+                prefix=(to_user_id, None),
+                columns=['from_user_id'],
+                batch_size=batch_size,
+            )
+            follower_ids = (follower.from_user_id for follower in followers)
+            yield from iter(lambda: list(itertools.islice(follower_ids, batch_size)), [])
+            return
+
+        # keyset pagination on the (to_user_id, created_at) index, id breaks
+        # ties of follows created in the same microsecond
+        queryset = Friendship.objects.filter(
+            to_user_id=to_user_id,
+            from_user_id__isnull=False,
+        ).order_by('created_at', 'id')
+        position = None
+        while True:
+            page = queryset
+            if position is not None:
+                created_at, friendship_id = position
+                page = page.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=friendship_id))
+            rows = list(page.values_list('created_at', 'id', 'from_user_id')[:batch_size])
+            if not rows:
+                return
+            yield [from_user_id for created_at, friendship_id, from_user_id in rows]
+            if len(rows) < batch_size:
+                return
+            position = rows[-1][:2]
 
     @classmethod
     def get_follow_instance(cls, from_user_id, to_user_id):
-        followings = HBaseFollowing.filter(prefix=(from_user_id, None))
-        for follow in followings:
-            if follow.to_user_id == to_user_id:
-                return follow
-        return None
+        # point get on the (from_user_id, to_user_id) index table
+        return HBaseFollowing.get_by_index(from_user_id=from_user_id, to_user_id=to_user_id)
 
     @classmethod
     def has_followed(cls, from_user_id, to_user_id):
-        if from_user_id == to_user_id:
-            return False
+        return cls.has_followed_many(from_user_id, [to_user_id])[to_user_id]
+
+    @classmethod
+    def has_followed_many(cls, from_user_id, to_user_ids):
+        """
+        {to_user_id: has_followed} of a page of users, e.g. the users of a
+        followers page. most answers are no, the bloom filter of from_user_id
+        gives those without touching mysql or hbase. maybe answers are checked
+        in the cached following set, or with one query / one index multi-get.
+        without a filter every answer is checked that way, the filter is built
+        in a task: loading the whole following set is too slow for a request
+        """
+        to_user_ids = list(set(to_user_ids) - {from_user_id})
+        result = {from_user_id: False}
+        if not to_user_ids:
+            return result
+
+        key = FOLLOWINGS_BLOOM_PATTERN.format(user_id=from_user_id)
+        maybe_followed = cls.following_bloom_filter.might_contain_many(key, to_user_ids)
+        if maybe_followed is None:
+            followed_ids = cls.load_followed_ids(from_user_id, to_user_ids)
+            if cls.following_bloom_filter.claim_rebuild(key):
+                from friendships.tasks import rebuild_following_bloom_filter_task
+                rebuild_following_bloom_filter_task.delay(from_user_id)
+        else:
+            candidate_ids = [to_user_id for to_user_id in to_user_ids if maybe_followed[to_user_id]]
+            followed_ids = cls.load_followed_ids(from_user_id, candidate_ids)
+            cls.following_bloom_filter.record_false_positives(len(candidate_ids) - len(followed_ids))
+
+        for to_user_id in to_user_ids:
+            result[to_user_id] = to_user_id in followed_ids
+        return result
+
+    @classmethod
+    def load_followed_ids(cls, from_user_id, to_user_ids):
+        # the ones of to_user_ids followed by from_user_id
+        if not to_user_ids:
+            return set()
+        packed = cache.get(cls.get_following_cache_key(from_user_id))
+        if packed is not None:
+            return set(cls.unpack_user_ids(packed)) & set(to_user_ids)
 
         if not GateKeeper.is_switch_on('switch_friendship_to_hbase'):
-            return Friendship.objects.filter(
+            return set(Friendship.objects.filter(
                 from_user_id=from_user_id,
-                to_user_id=to_user_id,
-            ).exists()
+                to_user_id__in=to_user_ids,
+            ).values_list('to_user_id', flat=True))
 
-        instance = cls.get_follow_instance(from_user_id, to_user_id)
-        return instance is not None
+        instances = HBaseFollowing.get_many_by_index([
+            {'from_user_id': from_user_id, 'to_user_id': to_user_id}
+            for to_user_id in to_user_ids
+        ])
+        return {instance.to_user_id for instance in instances if instance is not None}
+
+    @classmethod
+    def rebuild_following_bloom_filter(cls, from_user_id):
+        # => True if built. a follow landing after the generation is read fails the rebuild
+        key = FOLLOWINGS_BLOOM_PATTERN.format(user_id=from_user_id)
+        try:
+            generation = cls.following_bloom_filter.get_generation(key)
+            followed_ids = cls.get_following_user_id_set(from_user_id, generation)
+            return cls.following_bloom_filter.rebuild(key, followed_ids, generation)
+        finally:
+            cls.following_bloom_filter.release_rebuild(key)
+
+    @classmethod
+    def get_following_bloom_filter_info(cls, from_user_id):
+        # {'size_bytes', 'bits_set', 'estimated_items', 'false_positive_rate'} or None
+        return cls.following_bloom_filter.info(FOLLOWINGS_BLOOM_PATTERN.format(user_id=from_user_id))
+
+    @classmethod
+    def get_following_generation(cls, from_user_id):
+        return cls.following_bloom_filter.get_generation(FOLLOWINGS_BLOOM_PATTERN.format(user_id=from_user_id))
+
+    @classmethod
+    def get_following_cache_key(cls, from_user_id, generation=None):
+        if generation is None:
+            generation = cls.get_following_generation(from_user_id)
+        return FOLLOWINGS_PATTERN.format(user_id=from_user_id, generation=generation)
 
     @classmethod
-    def get_following_user_id_set(cls, from_user_id):
+    def get_following_user_id_set(cls, from_user_id, generation=None):
+        # generation: read before the load, a follow landing during the load
+        # bumps it and the loaded set goes under a key nobody reads any more
+        key = cls.get_following_cache_key(from_user_id, generation)
+        # read from cache first
+        packed = cache.get(key)
+        # cache hit, b'' is a user following nobody
+        if packed is not None:
+            return set(cls.unpack_user_ids(packed))
+
+        # cache miss, load from db
+        user_id_set = cls.load_following_user_id_set(from_user_id)
+        cache.set(key, cls.pack_user_ids(user_id_set))
+        return user_id_set
+
+    @classmethod
+    def pack_user_ids(cls, user_ids):
+        # sorted 8 bytes per id, a fraction of a pickled set of ints
+        return array('Q', sorted(user_ids)).tobytes()
+
+    @classmethod
+    def unpack_user_ids(cls, packed):
+        user_ids = array('Q')
+        user_ids.frombytes(packed)
+        return user_ids
+
+    @classmethod
+    def load_following_user_id_set(cls, from_user_id):
         if not GateKeeper.is_switch_on('switch_friendship_to_hbase'):
             friendships = Friendship.objects.filter(from_user_id=from_user_id)
         else:
-            friendships = HBaseFollowing.filter(prefix=(from_user_id, None))
+            friendships = HBaseFollowing.filter_iter(
+                prefix=(from_user_id, None),
+                columns=['to_user_id'],
+            )
         user_id_set = set([
             fs.to_user_id
             for fs in friendships
@@ -63,9 +211,15 @@ class FriendshipService(object):
     # MESI for invalidation and Dragon for update
     # https://github.com/Andrewzhang217/simulator
     @classmethod
-    def invalidate_following_cache(cls, from_user_id):
-        key = FOLLOWINGS_PATTERN.format(user_id=from_user_id)
-        cache.delete(key)
+    def invalidate_following_cache(cls, from_user_id, followed_user_ids=()):
+        # followed_user_ids: users just followed, their bits go into the bloom filter
+        # both bump the generation, which moves the key of the cached following set
+        bloom_key = FOLLOWINGS_BLOOM_PATTERN.format(user_id=from_user_id)
+        if followed_user_ids:
+            cls.following_bloom_filter.add(bloom_key, followed_user_ids)
+        else:
+            # unfollowed bits stay set, they only cost false positives checked in the store
+            cls.following_bloom_filter.touch(bloom_key)
 
         # call this method in friendships api would invalidate cache when db is
         # modified by api call, but admin modification would not trigger this
@@ -90,11 +244,16 @@ class FriendshipService(object):
             to_user_id=to_user_id,
             created_at=now,
         )
-        return HBaseFollowing.create(
+        following = HBaseFollowing.create(
             from_user_id=from_user_id,
             to_user_id=to_user_id,
             created_at=now,
         )
+        # mysql rows invalidate through the friendship_saved listener
+        cls.invalidate_following_cache(from_user_id, followed_user_ids=[to_user_id])
+        HBaseUserStats.increment('following_count', user_id=from_user_id)
+        HBaseUserStats.increment('follower_count', user_id=to_user_id)
+        return following
 
     @classmethod
     def unfollow(cls, from_user_id, to_user_id):
@@ -112,13 +271,74 @@ class FriendshipService(object):
         if instance is None:
             return 0
 
-        HBaseFollowing.delete(from_user_id=from_user_id, created_at=instance.created_at)
-        HBaseFollower.delete(to_user_id=to_user_id, created_at=instance.created_at)
+        # the index row gives every column, no read before the deletes
+        with HBaseModel.batch():
+            HBaseFollowing.bulk_delete([instance])
+            HBaseFollower.bulk_delete([cls.get_mirror_instance(HBaseFollower, instance)])
+        cls.invalidate_following_cache(from_user_id)
+        HBaseUserStats.increment('following_count', -1, user_id=from_user_id)
+        HBaseUserStats.increment('follower_count', -1, user_id=to_user_id)
         return 1
 
     @classmethod
     def get_following_count(cls, from_user_id):
         if not GateKeeper.is_switch_on('switch_friendship_to_hbase'):
             return Friendship.objects.filter(from_user_id=from_user_id).count()
-        followings = HBaseFollowing.filter(prefix=(from_user_id, None))
-        return len(followings)
+        return HBaseUserStats.get_counter('following_count', user_id=from_user_id)
+
+    @classmethod
+    def get_follower_count(cls, to_user_id):
+        if not GateKeeper.is_switch_on('switch_friendship_to_hbase'):
+            return Friendship.objects.filter(to_user_id=to_user_id).count()
+        return HBaseUserStats.get_counter('follower_count', user_id=to_user_id)
+
+    @classmethod
+    def get_mirror_instance(cls, model_class, instance):
+        # HBaseFollowing <=> HBaseFollower row of the same follow
+        return model_class(
+            from_user_id=instance.from_user_id,
+            to_user_id=instance.to_user_id,
+            created_at=instance.created_at,
+        )
+
+    @classmethod
+    def delete_user_friendships_chunk(cls, user_id, direction, start=None, limit=1000):
+        """
+        direction: 'followings' or 'followers' of a deleted user
+        deletes up to limit rows after row key start together with their mirror
+        rows in the other table, and takes the follow out of the other user's count
+        => (number deleted, row key to continue after or None if nothing is left)
+        """
+        if direction == 'followings':
+            model_class, mirror_class = HBaseFollowing, HBaseFollower
+            other_key, count_key = 'to_user_id', 'follower_count'
+        else:
+            model_class, mirror_class = HBaseFollower, HBaseFollowing
+            other_key, count_key = 'from_user_id', 'following_count'
+
+        if start is None:
+            instances = model_class.filter(prefix=(user_id, None), limit=limit)
+        else:
+            # start after the last deleted row, no need to skip its tombstones again
+            prefix = model_class.serialize_row_key_from_tuple((user_id, None))
+            instances = model_class.filter(
+                start=row_key_after(start),
+                stop=row_key_prefix_end(prefix),
+                limit=limit,
+            )
+        if not instances:
+            return 0, None
+
+        with HBaseModel.batch():
+            model_class.bulk_delete(instances)
+            mirror_class.bulk_delete([
+                cls.get_mirror_instance(mirror_class, instance)
+                for instance in instances
+            ])
+        for other_user_id, count in Counter(getattr(instance, other_key) for instance in instances).items():
+            HBaseUserStats.increment(count_key, -count, user_id=other_user_id)
+            if direction == 'followers':
+                cls.invalidate_following_cache(other_user_id)
+
+        has_more = len(instances) == limit
+        return len(instances), instances[-1].row_key if has_more else None
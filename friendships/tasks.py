@@ -0,0 +1,61 @@
+from celery import shared_task
+from friendships.constants import CLEANUP_CHUNK_SIZE, CLEANUP_CHUNKS_PER_TASK
+from friendships.hbase_models import HBaseUserStats
+from friendships.services import FriendshipService
+from twitter.cache import FRIENDSHIP_CLEANUP_PATTERN
+from twitter import settings
+from utils.redis_client import RedisClient
+from utils.time_constants import ONE_HOUR
+
+# hbase row keys are never empty
+CLEANUP_DONE = b''
+
+
+@shared_task(routing_key='default', time_limit=ONE_HOUR)
+def delete_user_friendships_task(user_id):
+    """
+    removes both directions of a deleted user's follow graph from hbase, so the
+    followers of that user stop scanning over rows of someone who is gone.
+    runs CLEANUP_CHUNKS_PER_TASK chunks then queues itself again, the last
+    deleted row key of each step is checkpointed in redis so a new or retried
+    task continues from there
+    """
+    conn = RedisClient.get_connection()
+    key = FRIENDSHIP_CLEANUP_PATTERN.format(user_id=user_id)
+    checkpoint = conn.hgetall(key)
+
+    chunks = 0
+    for direction in ['followings', 'followers']:
+        start = checkpoint.get(direction.encode('utf-8'))
+        while start != CLEANUP_DONE:
+            if chunks == CLEANUP_CHUNKS_PER_TASK:
+                delete_user_friendships_task.delay(user_id)
+                return '{} chunks deleted, continued in a new task'.format(chunks)
+            deleted, last_row_key = FriendshipService.delete_user_friendships_chunk(
+                user_id,
+                direction,
+                start=start,
+                limit=CLEANUP_CHUNK_SIZE,
+            )
+            chunks += 1
+            start = last_row_key if last_row_key is not None else CLEANUP_DONE
+            pipeline = conn.pipeline()
+            pipeline.hset(key, direction, start)
+            pipeline.hincrby(key, 'deleted', deleted)
+            pipeline.expire(key, settings.REDIS_KEY_EXPIRE_TIME)
+            pipeline.execute()
+
+    # no follow left to count
+    HBaseUserStats.delete(user_id=user_id)
+    FriendshipService.invalidate_following_cache(user_id)
+    deleted = int(conn.hget(key, 'deleted') or 0)
+    conn.delete(key)
+    return '{} friendships of user {} deleted'.format(deleted, user_id)
+
+
+@shared_task(routing_key='default', time_limit=ONE_HOUR)
+def rebuild_following_bloom_filter_task(from_user_id):
+    # loads the whole following set of from_user_id, kept off the request path
+    if FriendshipService.rebuild_following_bloom_filter(from_user_id):
+        return 'bloom filter of user {} rebuilt'.format(from_user_id)
+    return 'followings of user {} changed during the rebuild, dropped'.format(from_user_id)
@@ -1,10 +1,82 @@
-from django_hbase.models import EmptyColumnError, BadRowKeyError
-from friendships.hbase_models import HBaseFollowing, HBaseFollower
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django_hbase.batch import HBaseBatch
+from django_hbase.client import HBaseClient
+from django_hbase.models import EmptyColumnError, BadRowKeyError, HBaseModel
+from django_hbase.models.codecs import BinaryKeyCodec
+from friendships.hbase_models import HBaseFollowing, HBaseFollower, HBaseUserStats
 from friendships.models import Friendship
-from friendships.services import FriendshipService
+from friendships.services import FriendshipService, cache
+from gatekeeper.models import GateKeeper
 from testing.testcases import TestCase
+from thriftpy2.transport import TTransportException
+from utils.redis_client import RedisClient
+from utils.time_helpers import datetime_to_timestamp
 
+import asyncio
+import contextlib
+import io
+import itertools
+import threading
 import time
+import unittest.mock
+
+
+class SaltedHBaseFollower(HBaseFollower):
+
+    class Meta:
+        table_name = 'twitter_salted_followers'
+        row_key = ('to_user_id', 'created_at')
+        salt_buckets = 4
+
+
+class CachedHBaseFollower(HBaseFollower):
+
+    class Meta:
+        table_name = 'twitter_cached_followers'
+        row_key = ('to_user_id', 'created_at')
+        cache = {'ttl': 60, 'negative_ttl': 10}
+
+
+class ExpiringHBaseFollower(HBaseFollower):
+
+    class Meta:
+        table_name = 'twitter_expiring_followers'
+        row_key = ('to_user_id', 'created_at')
+        ttl = 3600
+
+
+class BinaryHBaseFollowing(HBaseFollowing):
+
+    class Meta:
+        table_name = 'twitter_followings_binary'
+        row_key = ('from_user_id', 'created_at')
+        key_encoding = 'binary'
+        indexes = [('from_user_id', 'to_user_id')]
+        column_family_options = HBaseFollowing.Meta.column_family_options
+
+
+class FollowDuringBloomRebuildService(FriendshipService):
+    late_follow = None
+
+    @classmethod
+    def get_following_user_id_set(cls, from_user_id, generation=None):
+        user_id_set = super().get_following_user_id_set(from_user_id, generation)
+        # lands after the following set is read, before the bloom filter is written
+        FriendshipService.follow(*cls.late_follow)
+        return user_id_set
+
+
+class FollowDuringFollowingLoadService(FriendshipService):
+    late_follow = None
+
+    @classmethod
+    def load_following_user_id_set(cls, from_user_id):
+        user_id_set = super().load_following_user_id_set(from_user_id)
+        # lands after the following set is loaded, before it is cached
+        FriendshipService.follow(*cls.late_follow)
+        return user_id_set
 
 
 class FriendshipServiceTests(TestCase):
@@ -32,6 +104,301 @@ class FriendshipServiceTests(TestCase):
         user_id_set = FriendshipService.get_following_user_id_set(self.user1.id)
         self.assertSetEqual(user_id_set, {user3.id, user4.id})
 
+    def test_follow_counts(self):
+        user3 = self.create_user('user3')
+        self.assertEqual(FriendshipService.get_following_count(self.user1.id), 0)
+        self.assertEqual(FriendshipService.get_follower_count(self.user2.id), 0)
+
+        FriendshipService.follow(self.user1.id, self.user2.id)
+        FriendshipService.follow(self.user1.id, user3.id)
+        FriendshipService.follow(user3.id, self.user2.id)
+        self.assertEqual(FriendshipService.get_following_count(self.user1.id), 2)
+        self.assertEqual(FriendshipService.get_follower_count(self.user2.id), 2)
+        self.assertEqual(FriendshipService.get_follower_count(user3.id), 1)
+
+        FriendshipService.unfollow(self.user1.id, self.user2.id)
+        # not followed, counts stay the same
+        FriendshipService.unfollow(self.user2.id, self.user1.id)
+        self.assertEqual(FriendshipService.get_following_count(self.user1.id), 1)
+        self.assertEqual(FriendshipService.get_follower_count(self.user2.id), 1)
+        self.assertEqual(FriendshipService.get_follower_count(self.user1.id), 0)
+
+    def test_following_user_id_set_cache(self):
+        user3 = self.create_user('user3')
+        key = lambda: FriendshipService.get_following_cache_key(self.user1.id)
+        self.assertEqual(FriendshipService.get_following_user_id_set(self.user1.id), set())
+        self.assertEqual(cache.get(key()), b'')
+
+        FriendshipService.follow(self.user1.id, user3.id)
+        FriendshipService.follow(self.user1.id, self.user2.id)
+        self.assertEqual(cache.get(key()), None)
+        self.assertEqual(FriendshipService.get_following_user_id_set(self.user1.id), {self.user2.id, user3.id})
+        self.assertEqual(
+            list(FriendshipService.unpack_user_ids(cache.get(key()))),
+            sorted([self.user2.id, user3.id]),
+        )
+        # served from the cache, hbase is not read again
+        cache.set(key(), FriendshipService.pack_user_ids([42]))
+        self.assertEqual(FriendshipService.get_following_user_id_set(self.user1.id), {42})
+
+        FriendshipService.unfollow(self.user1.id, self.user2.id)
+        self.assertEqual(cache.get(key()), None)
+        self.assertEqual(FriendshipService.get_following_user_id_set(self.user1.id), {user3.id})
+        FriendshipService.unfollow(self.user1.id, user3.id)
+        self.assertEqual(FriendshipService.get_following_user_id_set(self.user1.id), set())
+
+        # mysql rows invalidate through the listener
+        GateKeeper.set_kv('switch_friendship_to_hbase', 'percent', 0)
+        FriendshipService.follow(self.user1.id, user3.id)
+        self.assertEqual(cache.get(key()), None)
+        self.assertEqual(FriendshipService.get_following_user_id_set(self.user1.id), {user3.id})
+        FriendshipService.unfollow(self.user1.id, user3.id)
+        self.assertEqual(FriendshipService.get_following_user_id_set(self.user1.id), set())
+
+        # a follow landing between the load and the cache fill leaves the stale
+        # set under the previous generation, it is never served
+        GateKeeper.set_kv('switch_friendship_to_hbase', 'percent', 100)
+        FriendshipService.follow(self.user1.id, user3.id)
+        FollowDuringFollowingLoadService.late_follow = (self.user1.id, self.user2.id)
+        self.assertEqual(FollowDuringFollowingLoadService.get_following_user_id_set(self.user1.id), {user3.id})
+        self.assertEqual(cache.get(key()), None)
+        self.assertEqual(FriendshipService.get_following_user_id_set(self.user1.id), {self.user2.id, user3.id})
+        self.assertEqual(FriendshipService.has_followed(self.user1.id, self.user2.id), True)
+
+    def test_has_followed_many(self):
+        users = [self.create_user(f'user{i}') for i in range(3, 6)]
+        user_ids = [user.id for user in users]
+        for hbase_percent in [100, 0]:
+            GateKeeper.set_kv('switch_friendship_to_hbase', 'percent', hbase_percent)
+            FriendshipService.follow(self.user1.id, users[0].id)
+            FriendshipService.follow(self.user1.id, users[2].id)
+            FriendshipService.follow(self.user2.id, users[1].id)
+            expected = {
+                self.user1.id: False,
+                users[0].id: True,
+                users[1].id: False,
+                users[2].id: True,
+            }
+            self.assertEqual(FriendshipService.has_followed_many(self.user1.id, user_ids + [self.user1.id]), expected)
+            # same answer from the cached following set
+            FriendshipService.get_following_user_id_set(self.user1.id)
+            self.assertEqual(FriendshipService.has_followed_many(self.user1.id, user_ids), expected)
+            self.assertEqual(FriendshipService.has_followed_many(self.user2.id, user_ids)[users[1].id], True)
+            self.assertEqual(FriendshipService.has_followed_many(self.user1.id, []), {self.user1.id: False})
+            for user in users:
+                FriendshipService.unfollow(self.user1.id, user.id)
+                FriendshipService.unfollow(self.user2.id, user.id)
+
+    def test_following_bloom_filter(self):
+        user3, user4, user5 = [self.create_user(f'user{i}') for i in range(3, 6)]
+        FriendshipService.follow(self.user1.id, self.user2.id)
+        self.assertEqual(FriendshipService.get_following_bloom_filter_info(self.user1.id), None)
+        # the first check answers from the store and builds the filter in a task
+        self.assertEqual(FriendshipService.has_followed(self.user1.id, self.user2.id), True)
+        info = FriendshipService.get_following_bloom_filter_info(self.user1.id)
+        self.assertEqual(info['size_bytes'], 8192)
+        self.assertIn(info['bits_set'], range(1, 8))
+
+        # follows set their bits in the built filter, the next check is one index get, no scan
+        FriendshipService.follow(self.user1.id, user3.id)
+        self.assertGreater(FriendshipService.get_following_bloom_filter_info(self.user1.id)['bits_set'], info['bits_set'])
+        with unittest.mock.patch.object(HBaseFollowing, 'filter_iter') as filter_iter:
+            self.assertEqual(FriendshipService.has_followed(self.user1.id, user3.id), True)
+        filter_iter.assert_not_called()
+
+        # unfollows keep the filter, the stale bits are a false positive checked in the store
+        FriendshipService.following_bloom_filter.reset_stats()
+        FriendshipService.unfollow(self.user1.id, user3.id)
+        self.assertNotEqual(FriendshipService.get_following_bloom_filter_info(self.user1.id), None)
+        self.assertEqual(FriendshipService.has_followed(self.user1.id, user3.id), False)
+        self.assertEqual(FriendshipService.following_bloom_filter.stats()['false_positives'], 1)
+
+        # definite negatives touch neither hbase nor mysql
+        HBaseFollowing.delete_prefix((self.user1.id, None))
+        GateKeeper.set_kv('switch_friendship_to_hbase', 'percent', 0)
+        FriendshipService.invalidate_following_cache(self.user1.id)
+        FriendshipService.following_bloom_filter.reset_stats()
+        with self.assertNumQueries(0):
+            self.assertEqual(FriendshipService.has_followed(self.user1.id, user4.id), False)
+        self.assertEqual(FriendshipService.following_bloom_filter.stats()['negatives'], 1)
+        # maybe answers go to the store, which no longer has the hbase row
+        with self.assertNumQueries(1):
+            self.assertEqual(FriendshipService.has_followed(self.user1.id, self.user2.id), False)
+        stats = FriendshipService.following_bloom_filter.stats()
+        self.assertEqual((stats['checks'], stats['false_positives']), (2, 1))
+        GateKeeper.set_kv('switch_friendship_to_hbase', 'percent', 100)
+
+        # without a filter, checks are index gets while the rebuild is pending
+        bloom_key = f'followings_bloom:{self.user1.id}'
+        RedisClient.get_connection().delete(bloom_key)
+        FriendshipService.follow(self.user1.id, user4.id)
+        self.assertEqual(FriendshipService.following_bloom_filter.claim_rebuild(bloom_key), True)
+        with unittest.mock.patch.object(HBaseFollowing, 'filter_iter') as filter_iter:
+            self.assertEqual(FriendshipService.has_followed_many(self.user1.id, [user4.id, user5.id]), {
+                self.user1.id: False,
+                user4.id: True,
+                user5.id: False,
+            })
+        filter_iter.assert_not_called()
+        self.assertEqual(FriendshipService.get_following_bloom_filter_info(self.user1.id), None)
+        self.assertEqual(FriendshipService.rebuild_following_bloom_filter(self.user1.id), True)
+        self.assertEqual(FriendshipService.has_followed(self.user1.id, user4.id), True)
+
+        # a follow racing the rebuild drops the stale filter instead of leaving a false negative
+        RedisClient.get_connection().delete(bloom_key)
+        FollowDuringBloomRebuildService.late_follow = (self.user1.id, user5.id)
+        self.assertEqual(FollowDuringBloomRebuildService.rebuild_following_bloom_filter(self.user1.id), False)
+        self.assertEqual(FriendshipService.get_following_bloom_filter_info(self.user1.id), None)
+        self.assertEqual(FriendshipService.has_followed(self.user1.id, user5.id), True)
+
+        # counters and filter info exported for a metrics collector
+        out = io.StringIO()
+        call_command('following_bloom_filter_stats', user_id=[self.user1.id, self.user2.id], stdout=out)
+        metrics = dict(line.rsplit(' ', 1) for line in out.getvalue().splitlines())
+        self.assertEqual(metrics['following_bloom_filter_false_positives'], '1')
+        self.assertEqual(metrics['following_bloom_filter_size_bytes'], '8192')
+        self.assertIn(f'following_bloom_filter_bits_set{{user_id="{self.user1.id}"}}', metrics)
+        self.assertNotIn(f'following_bloom_filter_bits_set{{user_id="{self.user2.id}"}}', metrics)
+
+    def test_iter_follower_id_batches(self):
+        users = [self.create_user(f'user{i}') for i in range(3, 8)]
+        for hbase_percent in [100, 0]:
+            GateKeeper.set_kv('switch_friendship_to_hbase', 'percent', hbase_percent)
+            for user in users:
+                FriendshipService.follow(user.id, self.user1.id)
+            batches = list(FriendshipService.iter_follower_id_batches(self.user1.id, batch_size=2))
+            self.assertEqual(batches, [
+                [users[0].id, users[1].id],
+                [users[2].id, users[3].id],
+                [users[4].id],
+            ])
+            self.assertEqual(
+                list(FriendshipService.iter_follower_id_batches(self.user1.id, batch_size=5)),
+                [[user.id for user in users]],
+            )
+            self.assertEqual(list(FriendshipService.iter_follower_id_batches(self.user2.id)), [])
+            self.assertEqual(FriendshipService.get_follower_ids(self.user1.id), [user.id for user in users])
+
+        # follows created in the same microsecond are neither skipped nor repeated
+        Friendship.objects.filter(to_user_id=self.user1.id).update(created_at=Friendship.objects.first().created_at)
+        batches = list(FriendshipService.iter_follower_id_batches(self.user1.id, batch_size=2))
+        self.assertEqual(sorted(sum(batches, [])), sorted(user.id for user in users))
+
+    def test_backfill_hbase_friendships(self):
+        users = [self.create_user(f'user{i}') for i in range(3, 6)]
+        for user in users:
+            Friendship.objects.create(from_user=self.user1, to_user=user)
+            Friendship.objects.create(from_user=user, to_user=self.user2)
+        Friendship.objects.create(from_user=self.user2, to_user=self.user1)
+
+        out = io.StringIO()
+        call_command(
+            'backfill_hbase_friendships', '--workers', '0', '--range-size', '3', '--batch-size', '2',
+            '--rows-per-second', '0',
+            stdout=out,
+        )
+        self.assertIn('3 of 3 ranges to copy', out.getvalue())
+        self.assertIn('Counts of every user match', out.getvalue())
+        friendship = Friendship.objects.get(from_user=self.user1, to_user=users[0])
+        instance = HBaseFollowing.get_by_index(from_user_id=self.user1.id, to_user_id=users[0].id)
+        self.assertEqual(instance.created_at, datetime_to_timestamp(friendship.created_at))
+        self.assertEqual(
+            [follower.from_user_id for follower in HBaseFollower.filter(prefix=(self.user2.id, None))],
+            [user.id for user in users],
+        )
+        self.assertEqual(FriendshipService.get_following_count(self.user1.id), 3)
+        self.assertEqual(FriendshipService.get_follower_count(self.user2.id), 3)
+        # counters are written by the default run
+        self.assertEqual(FriendshipService.get_follower_count(self.user1.id), 1)
+
+        # an interrupted check resumes after the user ranges it finished
+        user_ids = [self.user1.id, self.user2.id] + [user.id for user in users]
+        start_ids = range(min(user_ids) // 2 * 2, max(user_ids) + 1, 2)
+        checked_range = f'{start_ids[0]}:{start_ids[0] + 2}'
+        RedisClient.get_connection().sadd('backfill_hbase_friendships:checked', checked_range)
+        out = io.StringIO()
+        call_command(
+            'backfill_hbase_friendships', '--workers', '0', '--range-size', '3', '--users-per-range', '2',
+            '--verify-only',
+            stdout=out,
+        )
+        self.assertIn(f'{len(start_ids) - 1} of {len(start_ids)} user ranges to check', out.getvalue())
+        self.assertEqual(RedisClient.get_connection().exists('backfill_hbase_friendships:checked'), 0)
+
+        # finished ranges are not copied again
+        out = io.StringIO()
+        call_command('backfill_hbase_friendships', '--workers', '0', '--range-size', '3', stdout=out)
+        self.assertIn('0 of 3 ranges to copy', out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command(
+                'backfill_hbase_friendships', '--workers', '0', '--range-size', '5', '--verify-only',
+                stdout=out,
+            )
+
+        HBaseFollowing.bulk_delete([instance])
+        err = io.StringIO()
+        with self.assertRaises(CommandError):
+            call_command(
+                'backfill_hbase_friendships', '--workers', '0', '--range-size', '3', '--verify-only',
+                stdout=io.StringIO(),
+                stderr=err,
+            )
+        self.assertEqual(err.getvalue().strip(), f'user {self.user1.id} following_count: 3 in mysql, 2 in hbase')
+
+        # --restart copies every range again
+        out = io.StringIO()
+        call_command('backfill_hbase_friendships', '--workers', '0', '--restart', stdout=out)
+        self.assertIn('1 of 1 ranges to copy', out.getvalue())
+        self.assertIn('Counts of every user match', out.getvalue())
+
+    def test_delete_user_friendships(self):
+        users = [self.create_user(f'user{i}') for i in range(3, 8)]
+        # user1 follows 4 users and is followed by 5, more than 2 chunks of 3 each
+        for user in users[:4]:
+            FriendshipService.follow(self.user1.id, user.id)
+        for user in [self.user2] + users:
+            FriendshipService.follow(user.id, self.user1.id)
+        FriendshipService.follow(self.user2.id, users[0].id)
+        self.assertEqual(FriendshipService.get_follower_count(users[0].id), 2)
+        self.assertEqual(FriendshipService.has_followed(self.user2.id, self.user1.id), True)
+
+        user_id = self.user1.id
+        self.user1.delete()
+        self.assertEqual(HBaseFollowing.filter(prefix=(user_id, None)), [])
+        self.assertEqual(HBaseFollower.filter(prefix=(user_id, None)), [])
+        for user in [self.user2] + users:
+            self.assertEqual(FriendshipService.has_followed(user.id, user_id), False)
+            self.assertEqual(FriendshipService.has_followed(user_id, user.id), False)
+            self.assertEqual(FriendshipService.get_following_count(user.id), 1 if user == self.user2 else 0)
+        self.assertEqual(FriendshipService.get_follower_count(users[0].id), 1)
+        self.assertEqual(
+            [follower.from_user_id for follower in HBaseFollower.filter(prefix=(users[0].id, None))],
+            [self.user2.id],
+        )
+        self.assertEqual(HBaseUserStats.get(user_id=user_id), None)
+        self.assertEqual(RedisClient.get_connection().exists(f'friendship_cleanup:{user_id}'), 0)
+
+    def test_friendship_deletes_flush_once(self):
+        users = [self.create_user(f'user{i}') for i in range(3, 6)]
+        for user in users:
+            FriendshipService.follow(self.user1.id, user.id)
+            FriendshipService.follow(user.id, self.user1.id)
+
+        # the rows of both tables go out in one flush of the outer batch
+        with unittest.mock.patch.object(HBaseBatch, 'flush', autospec=True, side_effect=HBaseBatch.flush) as flush:
+            self.assertEqual(FriendshipService.unfollow(self.user1.id, users[0].id), 1)
+        self.assertEqual(flush.call_count, 1)
+        self.assertEqual(FriendshipService.has_followed(self.user1.id, users[0].id), False)
+        self.assertEqual(HBaseFollower.filter(prefix=(users[0].id, None)), [])
+
+        with unittest.mock.patch.object(HBaseBatch, 'flush', autospec=True, side_effect=HBaseBatch.flush) as flush:
+            deleted, start = FriendshipService.delete_user_friendships_chunk(self.user1.id, 'followers')
+        self.assertEqual((deleted, start), (3, None))
+        self.assertEqual(flush.call_count, 1)
+        self.assertEqual(HBaseFollower.filter(prefix=(self.user1.id, None)), [])
+        for user in users:
+            self.assertEqual(HBaseFollowing.filter(prefix=(user.id, None)), [])
+
 
 class HBaseTests(TestCase):
 
@@ -138,3 +505,702 @@ class HBaseTests(TestCase):
         self.assertEqual(len(results), 2)
         self.assertEqual(results[0].to_user_id, 3)
         self.assertEqual(results[1].to_user_id, 2)
+
+    def test_concurrent_access(self):
+        ts = self.ts_now
+
+        def follow(to_user_id):
+            HBaseFollowing.create(from_user_id=1, to_user_id=to_user_id, created_at=ts + to_user_id)
+
+        # every thread checks out its own connection from the pool
+        threads = [threading.Thread(target=follow, args=(i,)) for i in range(1, 11)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        followings = HBaseFollowing.filter(prefix=(1, None))
+        self.assertEqual(len(followings), 10)
+        self.assertEqual([f.to_user_id for f in followings], list(range(1, 11)))
+
+    def test_bulk_create(self):
+        ts = self.ts_now
+        followings = [
+            HBaseFollowing(from_user_id=1, to_user_id=i, created_at=ts + i)
+            for i in range(1, 6)
+        ]
+        HBaseFollowing.bulk_create(followings, batch_size=2)
+        results = HBaseFollowing.filter(prefix=(1, None))
+        self.assertEqual([f.to_user_id for f in results], [1, 2, 3, 4, 5])
+
+    def test_batch(self):
+        ts = self.ts_now
+        with HBaseModel.batch():
+            HBaseFollowing.create(from_user_id=1, to_user_id=2, created_at=ts)
+            HBaseFollower.create(from_user_id=1, to_user_id=2, created_at=ts)
+            # nothing is sent before the block ends
+            self.assertEqual(HBaseFollowing.get(from_user_id=1, created_at=ts), None)
+        self.assertNotEqual(HBaseFollowing.get(from_user_id=1, created_at=ts), None)
+        self.assertNotEqual(HBaseFollower.get(to_user_id=2, created_at=ts), None)
+
+        # transaction drops buffered mutations if the block raises
+        try:
+            with HBaseModel.batch(transaction=True):
+                HBaseFollowing.delete(from_user_id=1, created_at=ts)
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertNotEqual(HBaseFollowing.get(from_user_id=1, created_at=ts), None)
+
+        with HBaseModel.batch():
+            HBaseFollowing.delete(from_user_id=1, created_at=ts)
+        self.assertEqual(HBaseFollowing.get(from_user_id=1, created_at=ts), None)
+
+        # nested batches and bulk_create join the outer transaction
+        try:
+            with HBaseModel.batch(transaction=True):
+                HBaseFollowing.bulk_create([
+                    HBaseFollowing(from_user_id=1, to_user_id=i, created_at=ts + i)
+                    for i in range(3)
+                ], batch_size=1)
+                with HBaseModel.batch():
+                    HBaseFollower.create(from_user_id=1, to_user_id=2, created_at=ts + 1)
+                self.assertEqual(HBaseFollowing.filter(prefix=(1, None)), [])
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(HBaseFollowing.filter(prefix=(1, None)), [])
+        self.assertEqual(HBaseFollowing.get_by_index(from_user_id=1, to_user_id=0), None)
+        self.assertEqual(HBaseFollower.get(to_user_id=2, created_at=ts + 1), None)
+
+    def test_get_many(self):
+        ts = self.ts_now
+        HBaseFollowing.create(from_user_id=1, to_user_id=2, created_at=ts)
+        HBaseFollowing.create(from_user_id=3, to_user_id=4, created_at=ts)
+
+        instances = HBaseFollowing.get_many([
+            {'from_user_id': 3, 'created_at': ts},
+            {'from_user_id': 1, 'created_at': ts + 1},
+            {'from_user_id': 1, 'created_at': ts},
+        ])
+        self.assertEqual(len(instances), 3)
+        self.assertEqual(instances[0].to_user_id, 4)
+        self.assertEqual(instances[1], None)
+        self.assertEqual(instances[2].to_user_id, 2)
+        self.assertEqual(HBaseFollowing.get_many([]), [])
+
+    def test_filter_iter(self):
+        ts = self.ts_now
+        for i in range(1, 6):
+            HBaseFollowing.create(from_user_id=1, to_user_id=i, created_at=ts + i)
+
+        iterator = HBaseFollowing.filter_iter(prefix=(1, None), batch_size=2)
+        self.assertEqual([f.to_user_id for f in iterator], [1, 2, 3, 4, 5])
+
+        # stop early, the rest of the rows are not fetched
+        iterator = HBaseFollowing.filter_iter(prefix=(1, None), batch_size=2, reverse=True)
+        results = list(itertools.islice(iterator, 3))
+        self.assertEqual([f.to_user_id for f in results], [5, 4, 3])
+        iterator.close()
+
+        results = HBaseFollowing.filter_iter(prefix=(1, None), limit=2)
+        self.assertEqual([f.to_user_id for f in results], [1, 2])
+
+    def test_field_metadata(self):
+        self.assertEqual(
+            [key for key, field in HBaseFollowing._row_key_fields],
+            ['from_user_id', 'created_at'],
+        )
+        self.assertEqual(list(HBaseFollowing._column_decoders.keys()), [b'cf:to_user_id'])
+        following = HBaseFollowing(from_user_id=1, to_user_id=2, created_at=3)
+        self.assertEqual(following.to_dict(), {'from_user_id': 1, 'created_at': 3, 'to_user_id': 2})
+        # fields are slots, instances have no __dict__
+        self.assertFalse(hasattr(following, '__dict__'))
+
+    def test_binary_key_encoding(self):
+        codec = BinaryKeyCodec(HBaseFollowing._row_key_fields)
+        row_key = codec.encode({'from_user_id': 1, 'created_at': 2})
+        # 8 bytes per field, reverse=True field is packed little-endian
+        self.assertEqual(row_key, b'\x01' + b'\x00' * 7 + b'\x00' * 7 + b'\x02')
+        self.assertEqual(codec.decode(row_key), {'from_user_id': 1, 'created_at': 2})
+        self.assertEqual(codec.encode({'from_user_id': 1}, is_prefix=True), b'\x01' + b'\x00' * 7)
+
+        # byte order keeps the created_at order for range scans
+        ts = self.ts_now
+        keys = [codec.encode({'from_user_id': 1, 'created_at': ts + delta}) for delta in [0, 1, 255, 256]]
+        self.assertEqual(keys, sorted(keys))
+
+        try:
+            codec.encode({'from_user_id': 1})
+            exception_raised = False
+        except BadRowKeyError as e:
+            exception_raised = True
+            self.assertEqual(str(e), 'created_at is missing in row key')
+        self.assertEqual(exception_raised, True)
+
+    def test_filter_server_side(self):
+        ts = self.ts_now
+        for i in range(1, 6):
+            HBaseFollowing.create(from_user_id=1, to_user_id=i, created_at=ts + i)
+
+        results = HBaseFollowing.filter(prefix=(1, None), where={'to_user_id': 3})
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0].to_user_id, 3)
+        self.assertEqual(results[0].created_at, ts + 3)
+        self.assertEqual(HBaseFollowing.filter(prefix=(1, None), where={'to_user_id': 6}), [])
+
+        # only row keys are returned
+        results = HBaseFollowing.filter(prefix=(1, None), keys_only=True)
+        self.assertEqual(len(results), 5)
+        self.assertEqual(results[0].created_at, ts + 1)
+        self.assertEqual(results[0].to_user_id, None)
+
+        results = HBaseFollowing.filter(prefix=(1, None), columns=['to_user_id'], limit=2)
+        self.assertEqual([f.to_user_id for f in results], [1, 2])
+
+        self.assertEqual(
+            HBaseFollowing.get_value_filter('to_user_id', 42),
+            "SingleColumnValueFilter('cf', 'to_user_id', =, 'binary:0000000000000042', true, true)",
+        )
+
+    def test_rewrite_keys(self):
+        ts = self.ts_now
+        for i in range(3):
+            HBaseFollowing.create(from_user_id=1, to_user_id=i + 2, created_at=ts + i)
+        try:
+            out = io.StringIO()
+            call_command('hbase_rewrite_keys', 'friendships.hbase_models.HBaseFollowing', stdout=out)
+            self.assertIn('3 rows rewritten', out.getvalue())
+            self.assertEqual(
+                [following.to_user_id for following in BinaryHBaseFollowing.filter(prefix=(1, None))],
+                [2, 3, 4],
+            )
+            # index rows are keyed and point to the rows in the new encoding
+            following = BinaryHBaseFollowing.get_by_index(from_user_id=1, to_user_id=3)
+            self.assertEqual(following.created_at, ts + 1)
+            self.assertEqual(BinaryHBaseFollowing.get_by_index(from_user_id=1, to_user_id=5), None)
+            # column family options are kept
+            for table_name in BinaryHBaseFollowing.get_column_families():
+                source_table_name = table_name.replace('_binary', '')
+                self.assertEqual(
+                    HBaseClient.execute(lambda conn: conn.table(table_name).families()),
+                    HBaseClient.execute(lambda conn: conn.table(source_table_name).families()),
+                )
+        finally:
+            BinaryHBaseFollowing.drop_table()
+
+    def test_get_by_index(self):
+        ts = self.ts_now
+        HBaseFollowing.create(from_user_id=1, to_user_id=2, created_at=ts)
+        HBaseFollowing.create(from_user_id=1, to_user_id=3, created_at=ts + 1)
+
+        instance = HBaseFollowing.get_by_index(from_user_id=1, to_user_id=3)
+        self.assertEqual(instance.created_at, ts + 1)
+        self.assertEqual(instance.to_user_id, 3)
+        self.assertEqual(HBaseFollowing.get_by_index(from_user_id=1, to_user_id=4), None)
+
+        # index follows updates of the column value
+        following = HBaseFollowing.get(from_user_id=1, created_at=ts)
+        following.to_user_id = 4
+        following.save()
+        self.assertEqual(HBaseFollowing.get_by_index(from_user_id=1, to_user_id=2), None)
+        self.assertEqual(HBaseFollowing.get_by_index(from_user_id=1, to_user_id=4).created_at, ts)
+
+        HBaseFollowing.delete(from_user_id=1, created_at=ts)
+        self.assertEqual(HBaseFollowing.get_by_index(from_user_id=1, to_user_id=4), None)
+
+        try:
+            HBaseFollowing.get_by_index(to_user_id=4)
+            exception_raised = False
+        except ValueError:
+            exception_raised = True
+        self.assertEqual(exception_raised, True)
+
+    def test_salt_buckets(self):
+        SaltedHBaseFollower.create_table()
+        try:
+            self._test_salt_buckets()
+        finally:
+            SaltedHBaseFollower.drop_table()
+
+    def _test_salt_buckets(self):
+        ts = self.ts_now
+        followers = SaltedHBaseFollower.bulk_create([
+            SaltedHBaseFollower(to_user_id=1, created_at=ts + i, from_user_id=i)
+            for i in range(20)
+        ])
+        SaltedHBaseFollower.create(to_user_id=2, created_at=ts, from_user_id=100)
+
+        # writes of one user are spread over the buckets, row_key stays logical
+        row_key = followers[0].row_key
+        self.assertEqual(row_key, HBaseFollower(to_user_id=1, created_at=ts).row_key)
+        salted_row_key = SaltedHBaseFollower.salt_row_key(row_key)
+        self.assertEqual(salted_row_key[1:], row_key)
+        self.assertEqual(SaltedHBaseFollower.unsalt_row_key(salted_row_key), row_key)
+        buckets = {
+            SaltedHBaseFollower.salt_row_key(follower.row_key)[0]
+            for follower in followers
+        }
+        self.assertEqual(buckets, {0, 1, 2, 3})
+
+        self.assertEqual(SaltedHBaseFollower.get(to_user_id=1, created_at=ts + 3).from_user_id, 3)
+        instances = SaltedHBaseFollower.get_many([
+            {'to_user_id': 1, 'created_at': ts + 5},
+            {'to_user_id': 1, 'created_at': ts - 1},
+        ])
+        self.assertEqual(instances[0].from_user_id, 5)
+        self.assertEqual(instances[1], None)
+
+        # scans of every bucket are merged in row key order
+        instances = SaltedHBaseFollower.filter(prefix=(1, None))
+        self.assertEqual([instance.from_user_id for instance in instances], list(range(20)))
+        instances = SaltedHBaseFollower.filter(prefix=(1, None), limit=5, reverse=True)
+        self.assertEqual([instance.from_user_id for instance in instances], [19, 18, 17, 16, 15])
+        instances = SaltedHBaseFollower.filter(start=(1, ts + 5), stop=(1, ts + 8))
+        self.assertEqual([instance.from_user_id for instance in instances], [5, 6, 7])
+        instances = SaltedHBaseFollower.filter(start=(1, ts + 8), stop=(1, ts + 5), reverse=True)
+        self.assertEqual([instance.from_user_id for instance in instances], [8, 7, 6])
+        instances = SaltedHBaseFollower.filter(start=(1, ts + 18), limit=3)
+        self.assertEqual([instance.from_user_id for instance in instances], [18, 19, 100])
+        instances = SaltedHBaseFollower.filter(reverse=True, limit=2)
+        self.assertEqual([instance.from_user_id for instance in instances], [100, 19])
+        instances = SaltedHBaseFollower.filter(prefix=(1, None), where={'from_user_id': 7})
+        self.assertEqual([instance.created_at for instance in instances], [ts + 7])
+
+        instances = SaltedHBaseFollower.filter_iter(prefix=(1, None), reverse=True)
+        self.assertEqual([instance.from_user_id for instance in instances], list(range(19, -1, -1)))
+        instances = SaltedHBaseFollower.filter_iter(limit=3, keys_only=True)
+        self.assertEqual([instance.created_at for instance in instances], [ts, ts + 1, ts + 2])
+
+        SaltedHBaseFollower.delete(to_user_id=1, created_at=ts)
+        self.assertEqual(SaltedHBaseFollower.get(to_user_id=1, created_at=ts), None)
+        self.assertEqual(len(SaltedHBaseFollower.filter(prefix=(1, None))), 19)
+
+    def test_split_points(self):
+        self.assertEqual(HBaseFollower.get_split_points(4), {
+            'test_twitter_followers': [b'2', b'5', b'7'],
+        })
+        self.assertEqual(HBaseFollower.get_split_points(20)['test_twitter_followers'][:3], [b'05', b'10', b'15'])
+        codec = BinaryKeyCodec(HBaseFollower._row_key_fields)
+        self.assertEqual(codec.split_points(4), [b'\x40', b'\x80', b'\xc0'])
+        # salt buckets first, then the key space inside each bucket
+        self.assertEqual(SaltedHBaseFollower.get_split_points(2)['test_twitter_salted_followers'], [b'\x02'])
+        points = SaltedHBaseFollower.get_split_points(8)['test_twitter_salted_followers']
+        self.assertEqual(points, [b'\x005', b'\x01', b'\x015', b'\x02', b'\x025', b'\x03', b'\x035'])
+
+    def test_provision(self):
+        out = io.StringIO()
+        call_command('hbase_provision', stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'All tables are up to date')
+
+        HBaseFollower.drop_table()
+        out = io.StringIO()
+        call_command('hbase_provision', '--dry-run', '--regions', '4', stdout=out)
+        self.assertEqual(out.getvalue().strip(), (
+            "create 'test_twitter_followers', {NAME => 'cf', BLOOMFILTER => 'ROW', "
+            "COMPRESSION => 'GZ', BLOCKCACHE => 'true'}, SPLITS => [\"2\", \"5\", \"7\"]"
+        ))
+        # the shell does not know the prefix of the thrift connections
+        out = io.StringIO()
+        with self.settings(HBASE_TABLE_PREFIX='tw', HBASE_TABLE_PREFIX_SEPARATOR='-'):
+            call_command('hbase_provision', '--dry-run', '--regions', '4', stdout=out)
+        self.assertTrue(out.getvalue().startswith("create 'tw-test_twitter_followers', {NAME => 'cf'"))
+
+        out = io.StringIO()
+        call_command('hbase_provision', stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'test_twitter_followers created')
+        HBaseFollower.create(to_user_id=1, created_at=self.ts_now, from_user_id=2)
+        self.assertEqual(len(HBaseFollower.filter(prefix=(1, None))), 1)
+
+    def test_row_cache(self):
+        CachedHBaseFollower.create_table()
+        try:
+            self._test_row_cache()
+        finally:
+            CachedHBaseFollower.drop_table()
+
+    def _test_row_cache(self):
+        ts = self.ts_now
+        CachedHBaseFollower._row_cache.reset_stats()
+        CachedHBaseFollower.create(to_user_id=1, created_at=ts, from_user_id=2)
+
+        self.assertEqual(CachedHBaseFollower.get(to_user_id=1, created_at=ts).from_user_id, 2)
+        self.assertEqual(CachedHBaseFollower.get(to_user_id=1, created_at=ts).from_user_id, 2)
+        self.assertEqual(CachedHBaseFollower.cache_stats(), {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+        self.assertEqual(HBaseFollower.cache_stats(), None)
+
+        # save invalidates the cached row
+        follower = CachedHBaseFollower.get(to_user_id=1, created_at=ts)
+        follower.from_user_id = 3
+        follower.save()
+        self.assertEqual(CachedHBaseFollower.get(to_user_id=1, created_at=ts).from_user_id, 3)
+
+        # missing rows are cached too, rows written behind the model stay hidden
+        self.assertEqual(CachedHBaseFollower.get(to_user_id=1, created_at=ts + 1), None)
+        row_key = CachedHBaseFollower(to_user_id=1, created_at=ts + 1).row_key
+        CachedHBaseFollower.execute(lambda table: table.put(row_key, {b'cf:from_user_id': b'4'}))
+        self.assertEqual(CachedHBaseFollower.get(to_user_id=1, created_at=ts + 1), None)
+        CachedHBaseFollower._row_cache.delete(row_key)
+        self.assertEqual(CachedHBaseFollower.get(to_user_id=1, created_at=ts + 1).from_user_id, 4)
+
+        # get_many only fetches the rows missing in the cache
+        CachedHBaseFollower._row_cache.reset_stats()
+        instances = CachedHBaseFollower.get_many([
+            {'to_user_id': 1, 'created_at': ts},
+            {'to_user_id': 1, 'created_at': ts + 2},
+            {'to_user_id': 1, 'created_at': ts + 1},
+        ])
+        self.assertEqual([instance and instance.from_user_id for instance in instances], [3, None, 4])
+        self.assertEqual(CachedHBaseFollower.cache_stats()['hits'], 2)
+
+        # inside a batch the row is invalidated once the batch is sent
+        with CachedHBaseFollower.batch():
+            CachedHBaseFollower.create(to_user_id=1, created_at=ts + 2, from_user_id=5)
+            CachedHBaseFollower.delete(to_user_id=1, created_at=ts)
+            self.assertEqual(CachedHBaseFollower.get(to_user_id=1, created_at=ts + 2), None)
+        self.assertEqual(CachedHBaseFollower.get(to_user_id=1, created_at=ts + 2).from_user_id, 5)
+        self.assertEqual(CachedHBaseFollower.get(to_user_id=1, created_at=ts), None)
+
+    def test_counters(self):
+        self.assertEqual(HBaseUserStats.get_counter('follower_count', user_id=1), 0)
+        self.assertEqual(HBaseUserStats.get(user_id=1), None)
+        self.assertEqual(HBaseUserStats.increment('follower_count', user_id=1), 1)
+        self.assertEqual(HBaseUserStats.increment('follower_count', 5, user_id=1), 6)
+        self.assertEqual(HBaseUserStats.increment('following_count', -1, user_id=1), -1)
+        self.assertEqual(HBaseUserStats.get_counter('follower_count', user_id=1), 6)
+        self.assertEqual(HBaseUserStats.get_counter('follower_count', user_id=2), 0)
+
+        # both counters in one point get
+        stats = HBaseUserStats.get(user_id=1)
+        self.assertEqual((stats.follower_count, stats.following_count), (6, -1))
+
+        # concurrent increments are not lost
+        threads = [
+            threading.Thread(target=HBaseUserStats.increment, args=('follower_count',), kwargs={'user_id': 2})
+            for _ in range(10)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(HBaseUserStats.get_counter('follower_count', user_id=2), 10)
+
+        # the increment is applied but the response is lost, it is not sent again
+        connection = HBaseClient.connection
+
+        @contextlib.contextmanager
+        def connection_lost_after_call():
+            with connection() as conn:
+                yield conn
+            raise TTransportException()
+
+        with unittest.mock.patch.object(HBaseClient, 'connection', connection_lost_after_call):
+            with self.assertRaises(TTransportException):
+                HBaseUserStats.increment('follower_count', user_id=2)
+        self.assertEqual(HBaseUserStats.get_counter('follower_count', user_id=2), 11)
+
+        try:
+            HBaseUserStats.increment('user_id', user_id=1)
+            exception_raised = False
+        except ValueError:
+            exception_raised = True
+        self.assertEqual(exception_raised, True)
+
+    def test_async(self):
+        ts = self.ts_now
+
+        async def run():
+            await asyncio.gather(*[
+                HBaseFollower.acreate(to_user_id=1, created_at=ts + i, from_user_id=i)
+                for i in range(25)
+            ])
+            follower, stats = await asyncio.gather(
+                HBaseFollower.aget(to_user_id=1, created_at=ts + 3),
+                HBaseUserStats.aincrement('follower_count', 25, user_id=1),
+            )
+            self.assertEqual(follower.from_user_id, 3)
+            self.assertEqual(stats, 25)
+            self.assertEqual(await HBaseUserStats.aget_counter('follower_count', user_id=1), 25)
+
+            instances = await HBaseFollower.aget_many([
+                {'to_user_id': 1, 'created_at': ts},
+                {'to_user_id': 1, 'created_at': ts - 1},
+            ])
+            self.assertEqual([instance and instance.from_user_id for instance in instances], [0, None])
+
+            follower.from_user_id = 100
+            await follower.asave()
+            await HBaseFollower.adelete(to_user_id=1, created_at=ts + 24)
+            self.assertEqual((await HBaseFollower.aget(to_user_id=1, created_at=ts + 3)).from_user_id, 100)
+
+            # pages of 10 rows, 24 rows left
+            ids = [instance.created_at - ts async for instance in HBaseFollower.afilter(
+                prefix=(1, None),
+                page_size=10,
+            )]
+            self.assertEqual(ids, list(range(24)))
+            ids = [instance.created_at - ts async for instance in HBaseFollower.afilter(
+                prefix=(1, None),
+                reverse=True,
+                limit=15,
+                page_size=10,
+            )]
+            self.assertEqual(ids, list(range(23, 8, -1)))
+            ids = [instance.created_at - ts async for instance in HBaseFollower.afilter(
+                start=(1, ts + 5),
+                stop=(1, ts + 17),
+                keys_only=True,
+                page_size=4,
+            )]
+            self.assertEqual(ids, list(range(5, 17)))
+
+        asyncio.run(run())
+
+    def test_decode_rows(self):
+        ts = self.ts_now
+        rows = [
+            (
+                HBaseFollowing(from_user_id=123, created_at=ts + i).row_key,
+                {b'cf:to_user_id': str(i).encode('utf-8')},
+            )
+            for i in range(3)
+        ]
+        rows.append((HBaseFollowing(from_user_id=123, created_at=ts + 3).row_key, {}))
+        instances = HBaseFollowing.decode_rows(rows)
+        self.assertEqual(instances[3], None)
+        self.assertEqual(
+            [instance.to_dict() for instance in instances[:3]],
+            [HBaseFollowing.init_from_row(row_key, row_data).to_dict() for row_key, row_data in rows[:3]],
+        )
+        self.assertEqual(instances[2].to_dict(), {'from_user_id': 123, 'created_at': ts + 2, 'to_user_id': 2})
+
+        instances = HBaseFollowing.decode_rows(rows, keys_only=True)
+        self.assertEqual([instance.created_at for instance in instances], [ts, ts + 1, ts + 2, ts + 3])
+        self.assertEqual(instances[0].to_user_id, None)
+        self.assertEqual(HBaseFollowing.decode_rows([]), [])
+
+        # binary keys, counter columns and rows missing a column
+        codec = BinaryKeyCodec(HBaseFollowing._row_key_fields)
+        row_keys = [
+            codec.encode({'from_user_id': 1, 'created_at': 2}),
+            codec.encode({'from_user_id': 3, 'created_at': 4}),
+        ]
+        self.assertEqual(codec.decode_many(row_keys), [[1, 3], [2, 4]])
+        HBaseUserStats.increment('follower_count', 3, user_id=1)
+        HBaseUserStats.increment('following_count', user_id=2)
+        stats = HBaseUserStats.filter()
+        self.assertEqual(
+            [(instance.user_id, instance.follower_count, instance.following_count) for instance in stats],
+            [(1, 3, None), (2, None, 1)],
+        )
+
+    def test_ttl_and_time_range(self):
+        self.assertEqual(
+            ExpiringHBaseFollower.get_column_families(),
+            {'test_twitter_expiring_followers': {'cf': {'time_to_live': 3600}}},
+        )
+        self.assertEqual(HBaseFollower.get_column_families()['test_twitter_followers']['cf'].get('time_to_live'), None)
+        out = io.StringIO()
+        call_command(
+            'hbase_provision', '--dry-run', '--regions', '2',
+            '--model', 'friendships.tests.ExpiringHBaseFollower',
+            stdout=out,
+        )
+        self.assertEqual(out.getvalue().strip(), (
+            "create 'test_twitter_expiring_followers', {NAME => 'cf', TTL => 3600}, SPLITS => [\"5\"]"
+        ))
+        ExpiringHBaseFollower.create_table()
+        SaltedHBaseFollower.create_table()
+        try:
+            self._test_ttl_and_time_range()
+        finally:
+            ExpiringHBaseFollower.drop_table()
+            SaltedHBaseFollower.drop_table()
+
+    def _test_ttl_and_time_range(self):
+        # cells past the ttl are not returned any more
+        now = int(time.time() * 1000)
+        ts = self.ts_now
+        table = ExpiringHBaseFollower.get_table_name()
+        for i, age in enumerate([7200, 1800, 60]):
+            instance = ExpiringHBaseFollower(to_user_id=1, created_at=ts + i, from_user_id=i)
+            HBaseClient.execute(lambda conn: conn.table(table).put(
+                instance.row_key,
+                {b'cf:from_user_id': str(i).encode('utf-8')},
+                timestamp=now - age * 1000,
+            ))
+        followers = ExpiringHBaseFollower.filter(prefix=(1, None))
+        self.assertEqual([follower.from_user_id for follower in followers], [1, 2])
+
+        # only cells written in [min, max) are scanned
+        followers = ExpiringHBaseFollower.filter(prefix=(1, None), time_range=(now - 600 * 1000, None))
+        self.assertEqual([follower.from_user_id for follower in followers], [2])
+        followers = ExpiringHBaseFollower.filter(prefix=(1, None), time_range=(None, now - 600 * 1000))
+        self.assertEqual([follower.from_user_id for follower in followers], [1])
+        followers = ExpiringHBaseFollower.filter(
+            prefix=(1, None),
+            time_range=(now - 3600 * 1000, now),
+            limit=1,
+            reverse=True,
+        )
+        self.assertEqual([follower.from_user_id for follower in followers], [2])
+        # rows dropped by the lower bound don't count towards the limit
+        followers = ExpiringHBaseFollower.filter(
+            prefix=(1, None),
+            time_range=(now - 600 * 1000, None),
+            limit=1,
+            keys_only=True,
+        )
+        self.assertEqual([follower.created_at for follower in followers], [ts + 2])
+        followers = ExpiringHBaseFollower.filter_iter(prefix=(1, None), time_range=(now - 600 * 1000, None))
+        self.assertEqual([follower.from_user_id for follower in followers], [2])
+
+        # salted tables check the range in every bucket
+        for i in range(3):
+            SaltedHBaseFollower.create(to_user_id=2, created_at=ts + i, from_user_id=i)
+        now = int(time.time() * 1000)
+        self.assertEqual(len(SaltedHBaseFollower.filter(prefix=(2, None), time_range=(now - 60 * 1000, None))), 3)
+        self.assertEqual(SaltedHBaseFollower.filter(prefix=(2, None), time_range=(now + 1000, None)), [])
+
+    def test_time_range_scan_stops_early(self):
+        fetched = []
+
+        class Table:
+            def scan(self, **kwargs):
+                # rows written at 0, 1, 2, ... ms, the region servers can not skip the old ones
+                for i in range(100):
+                    fetched.append(i)
+                    yield str(i).encode('utf-8'), {b'cf:from_user_id': (b'1', i)}
+
+        rows = HBaseFollower.scan_rows(Table(), {}, (10, None), 2)
+        self.assertEqual(rows, [(b'10', {b'cf:from_user_id': b'1'}), (b'11', {b'cf:from_user_id': b'1'})])
+        # the scan stops at the limit instead of reading the other 88 rows
+        self.assertEqual(len(fetched), 12)
+
+    def test_connection_settings(self):
+        with self.settings(HBASE_TRANSPORT='framed', HBASE_PROTOCOL='compact', HBASE_TIMEOUT=2000):
+            kwargs = HBaseClient.get_connection_kwargs(table_prefix='wire')
+        self.assertEqual(kwargs['transport'], 'framed')
+        self.assertEqual(kwargs['protocol'], 'compact')
+        self.assertEqual(kwargs['timeout'], 2000)
+        self.assertEqual(kwargs['table_prefix'], 'wire')
+        self.assertEqual(kwargs['table_prefix_separator'], '_')
+
+        # tables of a prefixed pool are named <prefix>_<table_name>
+        pool = HBaseClient.new_pool(table_prefix='wire')
+        with pool.connection() as conn:
+            conn.create_table('followers', {'cf': {}})
+            conn.table('followers').put(b'1', {b'cf:a': b'1'})
+            self.assertEqual(conn.tables(), [b'followers'])
+            self.assertEqual(list(conn.table('wire_followers', use_prefix=False).scan()), [(b'1', {b'cf:a': b'1'})])
+
+    def test_check_health(self):
+        class Connection:
+            reconnects = 0
+
+            def close(self):
+                pass
+
+            def _refresh_thrift_client(self):
+                pass
+
+            def open(self):
+                self.reconnects += 1
+
+        conn = Connection()
+        with self.settings(HBASE_CONNECTION_MAX_IDLE=30):
+            # never used, nothing to reconnect
+            HBaseClient.check_health(conn)
+            self.assertEqual(conn.reconnects, 0)
+            # idle for too long, reconnected once and fresh for the next checkouts
+            conn.last_used_at = time.time() - 60
+            HBaseClient.check_health(conn)
+            HBaseClient.check_health(conn)
+            self.assertEqual(conn.reconnects, 1)
+
+    def test_nested_connection(self):
+        with unittest.mock.patch.object(HBaseClient, 'check_health') as check_health:
+            with HBaseClient.connection() as conn:
+                # used at checkout, a long scan of the outer block can not look idle
+                self.assertAlmostEqual(conn.last_used_at, time.time(), delta=1)
+                # e.g. an HBaseBatch flushing inside filter_iter, the outer scanner
+                # is still open on the same connection and must not be reconnected
+                with HBaseClient.connection():
+                    pass
+                self.assertEqual(check_health.call_count, 1)
+            with HBaseClient.connection():
+                pass
+            self.assertEqual(check_health.call_count, 2)
+
+    def test_execute_retry(self):
+        calls = []
+
+        def lost_once(conn):
+            # the pool replaces the tainted connection, the call is sent again on the fresh one
+            calls.append(conn)
+            if len(calls) == 1:
+                raise TTransportException()
+            return 'done'
+
+        self.assertEqual(HBaseClient.execute(lost_once), 'done')
+        self.assertEqual(len(calls), 2)
+
+        connection = HBaseClient.connection
+        checkouts = []
+
+        @contextlib.contextmanager
+        def connection_lost():
+            checkouts.append(1)
+            with connection() as conn:
+                yield conn
+            raise TTransportException()
+
+        # out of retries, the error goes to the caller
+        with unittest.mock.patch.object(HBaseClient, 'connection', connection_lost):
+            with self.assertRaises(TTransportException):
+                HBaseClient.execute(lambda conn: 'done')
+        self.assertEqual(len(checkouts), settings.HBASE_MAX_RETRIES + 1)
+
+    def test_bulk_delete(self):
+        ts = self.ts_now
+        followings = HBaseFollowing.bulk_create([
+            HBaseFollowing(from_user_id=1, created_at=ts + i, to_user_id=i)
+            for i in range(5)
+        ])
+        self.assertEqual(HBaseFollowing.bulk_delete(followings[:2]), 2)
+        self.assertEqual([following.to_user_id for following in HBaseFollowing.filter(prefix=(1, None))], [2, 3, 4])
+        # index rows go with the rows
+        self.assertEqual(HBaseFollowing.get_by_index(from_user_id=1, to_user_id=0), None)
+        self.assertEqual(HBaseFollowing.get_by_index(from_user_id=1, to_user_id=2).created_at, ts + 2)
+
+        HBaseFollowing.create(from_user_id=2, created_at=ts, to_user_id=1)
+        self.assertEqual(HBaseFollowing.delete_prefix((1, None), batch_size=2), 3)
+        self.assertEqual(HBaseFollowing.filter(prefix=(1, None)), [])
+        self.assertEqual(HBaseFollowing.get_by_index(from_user_id=1, to_user_id=4), None)
+        self.assertEqual(len(HBaseFollowing.filter(prefix=(2, None))), 1)
+
+        # tables without indexes only scan the row keys
+        HBaseFollower.bulk_create([
+            HBaseFollower(to_user_id=1, created_at=ts + i, from_user_id=i)
+            for i in range(3)
+        ])
+        self.assertEqual(HBaseFollower.delete_prefix((1, None), limit=2), 2)
+        self.assertEqual([follower.from_user_id for follower in HBaseFollower.filter(prefix=(1, None))], [2])
+
+    def test_get_many_by_index(self):
+        ts = self.ts_now
+        HBaseFollowing.create(from_user_id=1, created_at=ts, to_user_id=2)
+        HBaseFollowing.create(from_user_id=1, created_at=ts + 1, to_user_id=3)
+        instances = HBaseFollowing.get_many_by_index([
+            {'from_user_id': 1, 'to_user_id': 3},
+            {'from_user_id': 1, 'to_user_id': 4},
+            {'from_user_id': 1, 'to_user_id': 2},
+        ])
+        self.assertEqual(instances[0].created_at, ts + 1)
+        self.assertEqual(instances[1], None)
+        self.assertEqual(instances[2].to_dict(), {'from_user_id': 1, 'created_at': ts, 'to_user_id': 2})
+        self.assertEqual(HBaseFollowing.get_many_by_index([]), [])
+        with self.assertRaises(ValueError):
+            HBaseFollowing.get_many_by_index([{'from_user_id': 1, 'to_user_id': 2}, {'from_user_id': 1}])
+        with self.assertRaises(ValueError):
+            HBaseFollower.get_many_by_index([{'from_user_id': 1, 'to_user_id': 2}])
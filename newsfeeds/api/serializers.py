@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from newsfeeds.models import NewsFeed
 from tweets.api.serializers import TweetSerializer
+from utils.time_helpers import timestamp_to_datetime
 
 
 class NewsFeedSerializer(serializers.ModelSerializer):
@@ -9,3 +10,18 @@ class NewsFeedSerializer(serializers.ModelSerializer):
     class Meta:
         model = NewsFeed
         fields = ('id', 'created_at', 'tweet')
+
+
+class TimestampDateTimeField(serializers.DateTimeField):
+    # microseconds since epoch of an hbase row key, rendered like a model DateTimeField
+
+    def to_representation(self, value):
+        return super(TimestampDateTimeField, self).to_representation(timestamp_to_datetime(value))
+
+
+class HBaseNewsFeedSerializer(serializers.Serializer):
+    # same fields as NewsFeedSerializer. hbase newsfeeds have no id, the row key
+    # timestamp is unique in the newsfeed of a user and stands in for it
+    id = serializers.IntegerField(source='created_at')
+    created_at = TimestampDateTimeField()
+    tweet = TweetSerializer(source='cached_tweet')
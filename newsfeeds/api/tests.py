@@ -1,5 +1,9 @@
 from django.conf import settings
+from django.core import signing
+from django.test import override_settings
 from friendships.models import Friendship
+from gatekeeper.models import GateKeeper
+from newsfeeds.hbase_models import HBaseNewsFeed
 from newsfeeds.models import NewsFeed
 from newsfeeds.services import NewsFeedService
 from rest_framework.test import APIClient
@@ -210,3 +214,129 @@ class NewsFeedApiTests(TestCase):
         # cache expired
         self.clear_cache()
         _test_newsfeeds_after_new_feed_pushed()
+
+    @override_settings(REDIS_LIST_LENGTH_LIMIT=100)
+    def test_cursor_pagination(self):
+        page_size = EndlessPagination.page_size
+        tweets = [self.create_tweet(self.user2, 'feed{}'.format(i)) for i in range(page_size * 2 + 1)]
+        # fanout bulk creates the newsfeeds, the ones pushed to an existing cache have no id
+        for tweet in tweets:
+            NewsFeedService.batch_create([self.user1.id], tweet.id)
+        cached_newsfeeds = NewsFeedService.get_cached_newsfeeds(self.user1.id)
+        self.assertEqual(len(cached_newsfeeds), len(tweets))
+        self.assertIsNone(cached_newsfeeds[0].id)
+        tweet_ids = [tweet.id for tweet in tweets[::-1]]
+
+        def _paginate_with_cursor():
+            response = self.user1_client.get(NEWSFEEDS_URL)
+            results, pages = response.data['results'], 1
+            while response.data['has_next_page']:
+                response = self.user1_client.get(NEWSFEEDS_URL, {'cursor': response.data['next_cursor']})
+                self.assertEqual(response.status_code, 200)
+                results.extend(response.data['results'])
+                pages += 1
+            self.assertEqual(pages, 3)
+            self.assertIsNone(response.data['next_cursor'])
+            self.assertEqual([result['tweet']['id'] for result in results], tweet_ids)
+
+        # cursors can not be placed among cached newsfeeds without id, pages come from mysql
+        _paginate_with_cursor()
+        cursor = self.user1_client.get(NEWSFEEDS_URL).data['next_cursor']
+
+        # reloaded from mysql, pages are cut from the cached list alone
+        self.clear_cache()
+        cached_newsfeeds = NewsFeedService.get_cached_newsfeeds(self.user1.id)
+        self.assertNotIn(None, {newsfeed.id for newsfeed in cached_newsfeeds})
+        # a cursor handed out before the reload still points to the same position
+        response = self.user1_client.get(NEWSFEEDS_URL, {'cursor': cursor})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [result['tweet']['id'] for result in response.data['results']],
+            tweet_ids[page_size:page_size * 2],
+        )
+        NewsFeed.objects.filter(user=self.user1).delete()
+        _paginate_with_cursor()
+
+        # cursors built from objects without id are rejected
+        payload = signing.loads(cursor, salt=EndlessPagination.cursor_salt)
+        cursor = EndlessPagination().encode_cursor(dict(payload, id=None))
+        response = self.user1_client.get(NEWSFEEDS_URL, {'cursor': cursor})
+        self.assertEqual(response.status_code, 404)
+
+        # so are cursors of the newsfeeds of another user
+        cursor = self.user1_client.get(NEWSFEEDS_URL).data['next_cursor']
+        response = self.user2_client.get(NEWSFEEDS_URL, {'cursor': cursor})
+        self.assertEqual(response.status_code, 404)
+
+    def test_hbase_list(self):
+        GateKeeper.set_kv('switch_newsfeed_to_hbase', 'percent', 100)
+        page_size = EndlessPagination.page_size
+        tweets = [self.create_tweet(self.user2, 'feed{}'.format(i)) for i in range(page_size + 3)]
+        for tweet in tweets:
+            NewsFeedService.batch_create([self.user1.id], tweet.id)
+        # only written to hbase
+        self.assertEqual(NewsFeed.objects.count(), 0)
+
+        response = self.user1_client.get(NEWSFEEDS_URL)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['has_next_page'], True)
+        results = response.data['results']
+        tweet_ids = [tweet.id for tweet in tweets[::-1]]
+        self.assertEqual([result['tweet']['id'] for result in results], tweet_ids[:page_size])
+
+        response = self.user1_client.get(NEWSFEEDS_URL, {'cursor': response.data['next_cursor']})
+        self.assertEqual(response.data['has_next_page'], False)
+        self.assertEqual([result['tweet']['id'] for result in response.data['results']], tweet_ids[page_size:])
+
+        # the cursor of the other store after the switch flips gives the first page again
+        hbase_cursor = self.user1_client.get(NEWSFEEDS_URL).data['next_cursor']
+        GateKeeper.set_kv('switch_newsfeed_to_hbase', 'percent', 0)
+        response = self.user1_client.get(NEWSFEEDS_URL, {'cursor': hbase_cursor})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], self.user1_client.get(NEWSFEEDS_URL).data['results'])
+        paginator = EndlessPagination()
+        paginator.list_key = f'newsfeeds:{self.user1.id}'
+        mysql_cursor = paginator.encode_cursor({'created_at': results[-1]['created_at'], 'id': 1})
+        GateKeeper.set_kv('switch_newsfeed_to_hbase', 'percent', 100)
+        response = self.user1_client.get(NEWSFEEDS_URL, {'cursor': mysql_cursor})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['tweet']['id'] for result in response.data['results']], tweet_ids[:page_size])
+        # but never the page of another user
+        response = self.user2_client.get(NEWSFEEDS_URL, {'cursor': hbase_cursor})
+        self.assertEqual(response.status_code, 404)
+
+        # pull new feeds
+        latest = results[0]['created_at']
+        response = self.user1_client.get(NEWSFEEDS_URL, {'created_at__gt': latest})
+        self.assertEqual(len(response.data['results']), 0)
+        new_tweet = self.create_tweet(self.user2)
+        NewsFeedService.batch_create([self.user1.id], new_tweet.id)
+        response = self.user1_client.get(NEWSFEEDS_URL, {'created_at__gt': latest})
+        self.assertEqual([result['tweet']['id'] for result in response.data['results']], [new_tweet.id])
+        self.assertEqual(len(HBaseNewsFeed.filter(prefix=(self.user1.id, None))), page_size + 4)
+
+        # created_at__lt takes the created_at of a result, like the mysql path
+        response = self.user1_client.get(NEWSFEEDS_URL, {'created_at__lt': results[-1]['created_at']})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['tweet']['id'] for result in response.data['results']], tweet_ids[page_size:])
+
+        # bad pagination params are a 400 on both paths
+        for switch in [100, 0]:
+            GateKeeper.set_kv('switch_newsfeed_to_hbase', 'percent', switch)
+            for param in ['created_at__gt', 'created_at__lt']:
+                for value in ['abc', '2020-13-01', '1' * 20]:
+                    response = self.user1_client.get(NEWSFEEDS_URL, {param: value})
+                    self.assertEqual(response.status_code, 400)
+
+    def test_hbase_list_format(self):
+        # same fields and types as the mysql path, both stores written with the same created_at
+        GateKeeper.set_kv('switch_newsfeed_dual_write', 'percent', 100)
+        tweet = self.create_tweet(self.user2)
+        NewsFeedService.batch_create([self.user1.id], tweet.id)
+        mysql_result = self.user1_client.get(NEWSFEEDS_URL).data['results'][0]
+        GateKeeper.set_kv('switch_newsfeed_to_hbase', 'percent', 100)
+        hbase_result = self.user1_client.get(NEWSFEEDS_URL).data['results'][0]
+        self.assertEqual(hbase_result.keys(), mysql_result.keys())
+        self.assertEqual(hbase_result['created_at'], mysql_result['created_at'])
+        self.assertEqual(hbase_result['tweet'], mysql_result['tweet'])
+        self.assertIsInstance(hbase_result['id'], int)
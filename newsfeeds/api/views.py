@@ -1,4 +1,5 @@
-from newsfeeds.api.serializers import NewsFeedSerializer
+from newsfeeds.api.serializers import HBaseNewsFeedSerializer, NewsFeedSerializer
+from newsfeeds.hbase_models import HBaseNewsFeed
 from newsfeeds.models import NewsFeed
 from newsfeeds.services import NewsFeedService
 from rest_framework import viewsets
@@ -14,6 +15,13 @@ class NewsFeedViewSet(viewsets.GenericViewSet):
         return NewsFeed.objects.filter(user=self.request.user)
 
     def list(self, request):
+        # cursors of this list are rejected on the list of someone else
+        self.paginator.list_key = f'newsfeeds:{request.user.id}'
+        if NewsFeedService.is_reading_hbase():
+            page = self.paginator.paginate_hbase(HBaseNewsFeed, (request.user.id,), request)
+            serializer = HBaseNewsFeedSerializer(page, context={'request': request}, many=True)
+            return self.get_paginated_response(serializer.data)
+
         cached_newsfeeds = NewsFeedService.get_cached_newsfeeds(request.user.id)
         page = self.paginator.paginate_cached_list(cached_newsfeeds, request)
         if page is None:
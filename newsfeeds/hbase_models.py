@@ -0,0 +1,30 @@
+from django_hbase import models
+from tweets.models import Tweet
+from utils.memcached_helper import MemcachedHelper
+
+
+class HBaseNewsFeed(models.HBaseModel):
+    """
+    存储 user_id 能看到的 tweet，row_key 按照 user_id + created_at 排序
+    可以支持查询：
+     - A 的 newsfeed 按照时间倒序分页
+     - A 在某个时间点之后的新 newsfeed
+    """
+    # row key
+    user_id = models.IntegerField(reverse=True)
+    created_at = models.TimestampField()
+    # column key
+    tweet_id = models.IntegerField(column_family='cf')
+
+    class Meta:
+        table_name = 'twitter_newsfeeds'
+        row_key = ('user_id', 'created_at')
+        column_family_options = {
+            'bloom_filter_type': 'ROW',
+            'compression': 'GZ',
+            'block_cache_enabled': True,
+        }
+
+    @property
+    def cached_tweet(self):
+        return MemcachedHelper.get_object_through_cache(Tweet, self.tweet_id)
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from newsfeeds.hbase_models import HBaseNewsFeed
+from newsfeeds.models import NewsFeed
+from utils.time_helpers import datetime_to_timestamp
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy mysql newsfeeds into HBaseNewsFeed. Run it after turning on '
+        'switch_newsfeed_dual_write and before switch_newsfeed_to_hbase. '
+        'Rows keep their created_at so running it again rewrites the same row keys.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--start-id', type=int, default=0, help='resume after this newsfeed id')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = options['start_id']
+        count = 0
+        while True:
+            # keyset pagination on id, OFFSET gets slower on every page
+            newsfeeds = list(
+                NewsFeed.objects.filter(id__gt=last_id)
+                .order_by('id')
+                .values_list('id', 'user_id', 'tweet_id', 'created_at')[:batch_size]
+            )
+            if not newsfeeds:
+                break
+            HBaseNewsFeed.bulk_create([
+                HBaseNewsFeed(
+                    user_id=user_id,
+                    created_at=datetime_to_timestamp(created_at),
+                    tweet_id=tweet_id,
+                )
+                for newsfeed_id, user_id, tweet_id, created_at in newsfeeds
+                # user or tweet deleted, nothing to show
+                if user_id is not None and tweet_id is not None
+            ], batch_size=batch_size)
+            last_id = newsfeeds[-1][0]
+            count += len(newsfeeds)
+            self.stdout.write(f'{count} newsfeeds copied, last id {last_id}')
+
+        self.stdout.write(self.style.SUCCESS(f'{count} newsfeeds copied to {HBaseNewsFeed.get_table_name()}'))
@@ -1,7 +1,12 @@
+from gatekeeper.models import GateKeeper
+from newsfeeds.hbase_models import HBaseNewsFeed
 from newsfeeds.models import NewsFeed
 from newsfeeds.tasks import fanout_newsfeeds_main_task
 from twitter.cache import USER_NEWSFEEDS_PATTERN
 from utils.redis_helper import RedisHelper
+from utils.time_helpers import datetime_to_timestamp
+
+import time
 
 
 class NewsFeedService(object):
@@ -10,6 +15,45 @@ class NewsFeedService(object):
     def fanout_to_followers(cls, tweet):
         fanout_newsfeeds_main_task.delay(tweet.id, tweet.user_id)
 
+    @classmethod
+    def is_reading_hbase(cls):
+        return GateKeeper.is_switch_on('switch_newsfeed_to_hbase')
+
+    @classmethod
+    def is_writing_mysql(cls):
+        # keep writing mysql while reads are moving to hbase, so we can switch back
+        return not cls.is_reading_hbase() or GateKeeper.is_switch_on('switch_newsfeed_dual_write')
+
+    @classmethod
+    def is_writing_hbase(cls):
+        return cls.is_reading_hbase() or GateKeeper.is_switch_on('switch_newsfeed_dual_write')
+
+    @classmethod
+    def batch_create(cls, user_ids, tweet_id):
+        timestamps = None
+        if cls.is_writing_mysql():
+            # bulk create to combine into only 1 INSERT query
+            newsfeeds = [
+                NewsFeed(user_id=user_id, tweet_id=tweet_id)  # no save no SQL operations
+                for user_id in user_ids
+            ]
+            NewsFeed.objects.bulk_create(newsfeeds)
+            # bulk create does NOT trigger post_save signal
+            # manually push into cache
+            for newsfeed in newsfeeds:
+                cls.push_newsfeed_to_cache(newsfeed)
+            # same created_at in both stores, backfill and dual write produce the same row keys
+            timestamps = [datetime_to_timestamp(newsfeed.created_at) for newsfeed in newsfeeds]
+
+        if cls.is_writing_hbase():
+            if timestamps is None:
+                timestamps = [int(time.time() * 1000000)] * len(user_ids)
+            HBaseNewsFeed.bulk_create([
+                HBaseNewsFeed(user_id=user_id, created_at=created_at, tweet_id=tweet_id)
+                for user_id, created_at in zip(user_ids, timestamps)
+            ])
+        return len(user_ids)
+
     @classmethod
     def get_cached_newsfeeds(cls, user_id):
         # Lazy evaluation
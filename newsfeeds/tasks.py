@@ -1,8 +1,6 @@
 from celery import shared_task
 from friendships.services import FriendshipService
 from newsfeeds.constants import FANOUT_BATCH_SIZE
-from newsfeeds.models import NewsFeed
-from tweets.models import Tweet
 from utils.time_constants import ONE_HOUR
 
 
@@ -15,34 +13,28 @@ def fanout_newsfeeds_batch_task(tweet_id, follower_ids):
     # for follower in FriendshipService.get_follower(tweet.user):
     #     NewsFeed.objects.create(user=follower, tweet=tweet)
 
-    # bulk create to combine into only 1 INSERT query
-    newsfeeds = [
-        NewsFeed(user_id=follower_id, tweet_id=tweet_id)  # no save no SQL operations
-        for follower_id in follower_ids
-    ]
-    NewsFeed.objects.bulk_create(newsfeeds)
+    # one INSERT query in mysql and / or batched puts in hbase
+    created = NewsFeedService.batch_create(follower_ids, tweet_id)
 
-    # bulk create does NOT trigger post_save signal
-    # manually push into cache
-    for newsfeed in newsfeeds:
-        NewsFeedService.push_newsfeed_to_cache(newsfeed)
-
-    return "{} newsfeeds created".format(len(newsfeeds))
+    return "{} newsfeeds created".format(created)
 
 
 @shared_task(routing_key='default', time_limit=ONE_HOUR)
 def fanout_newsfeeds_main_task(tweet_id, tweet_user_id):
+    from newsfeeds.services import NewsFeedService
+
     # fanout to user himself first
-    NewsFeed.objects.create(user_id=tweet_user_id, tweet_id=tweet_id)
+    NewsFeedService.batch_create([tweet_user_id], tweet_id)
 
-    follower_ids = FriendshipService.get_follower_ids(tweet_user_id)
-    index = 0
-    while index < len(follower_ids):
-        batch_ids = follower_ids[index: index + FANOUT_BATCH_SIZE]
+    # batches are dispatched as they are read, the follower list is never
+    # loaded as a whole
+    follower_count, batch_count = 0, 0
+    for batch_ids in FriendshipService.iter_follower_id_batches(tweet_user_id, FANOUT_BATCH_SIZE):
         fanout_newsfeeds_batch_task.delay(tweet_id, batch_ids)
-        index += FANOUT_BATCH_SIZE
+        follower_count += len(batch_ids)
+        batch_count += 1
 
     return '{} newsfeeds going to fanout, {} batches created.'.format(
-        len(follower_ids),
-        (len(follower_ids) - 1) // FANOUT_BATCH_SIZE + 1,
+        follower_count,
+        batch_count,
     )
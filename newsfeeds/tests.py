@@ -1,9 +1,15 @@
+from django.core.management import call_command
+from gatekeeper.models import GateKeeper
+from newsfeeds.hbase_models import HBaseNewsFeed
 from newsfeeds.models import NewsFeed
 from newsfeeds.services import NewsFeedService
 from newsfeeds.tasks import fanout_newsfeeds_main_task
 from testing.testcases import TestCase
 from twitter.cache import USER_NEWSFEEDS_PATTERN
 from utils.redis_client import RedisClient
+from utils.time_helpers import datetime_to_timestamp
+
+import io
 
 
 class NewsFeedServiceTests(TestCase):
@@ -87,3 +93,47 @@ class NewsFeedTaskTests(TestCase):
         self.assertEqual(len(cached_list), 3)
         cached_list = NewsFeedService.get_cached_newsfeeds(self.user2.id)
         self.assertEqual(len(cached_list), 3)
+
+    def test_fanout_dual_write(self):
+        # followers from mysql, hbase follower lists are covered in friendships
+        GateKeeper.set_kv('switch_friendship_to_hbase', 'percent', 0)
+        GateKeeper.set_kv('switch_newsfeed_dual_write', 'percent', 100)
+        self.create_friendship(self.user2, self.user1)
+        tweet1 = self.create_tweet(self.user1, 'tweet 1')
+        fanout_newsfeeds_main_task(tweet1.id, self.user1.id)
+
+        # same rows in both stores
+        self.assertEqual(NewsFeed.objects.count(), 2)
+        for newsfeed in NewsFeed.objects.all():
+            instance = HBaseNewsFeed.get(
+                user_id=newsfeed.user_id,
+                created_at=datetime_to_timestamp(newsfeed.created_at),
+            )
+            self.assertEqual(instance.tweet_id, tweet1.id)
+
+        # reads moved to hbase, mysql is no longer written
+        GateKeeper.set_kv('switch_newsfeed_dual_write', 'percent', 0)
+        GateKeeper.set_kv('switch_newsfeed_to_hbase', 'percent', 100)
+        tweet2 = self.create_tweet(self.user1, 'tweet 2')
+        fanout_newsfeeds_main_task(tweet2.id, self.user1.id)
+        self.assertEqual(NewsFeed.objects.count(), 2)
+        newsfeeds = HBaseNewsFeed.filter(prefix=(self.user2.id, None), reverse=True)
+        self.assertEqual([newsfeed.tweet_id for newsfeed in newsfeeds], [tweet2.id, tweet1.id])
+
+    def test_backfill(self):
+        newsfeeds = [
+            self.create_newsfeed(self.user1, self.create_tweet(self.user2))
+            for _ in range(5)
+        ]
+        out = io.StringIO()
+        call_command('backfill_hbase_newsfeeds', '--batch-size', '2', stdout=out)
+        self.assertIn('5 newsfeeds copied', out.getvalue())
+        instances = HBaseNewsFeed.filter(prefix=(self.user1.id, None))
+        self.assertEqual(
+            [(instance.created_at, instance.tweet_id) for instance in instances],
+            [(datetime_to_timestamp(newsfeed.created_at), newsfeed.tweet_id) for newsfeed in newsfeeds],
+        )
+
+        # resumable and idempotent
+        call_command('backfill_hbase_newsfeeds', '--start-id', str(newsfeeds[2].id), stdout=out)
+        self.assertEqual(len(HBaseNewsFeed.filter(prefix=(self.user1.id, None))), 5)
@@ -181,6 +181,13 @@ class TweetApiTests(TestCase):
         self.assertEqual(response.data['results'][1]['id'], tweets[1].id)
         self.assertEqual(response.data['results'][page_size - 1]['id'], tweets[page_size - 1].id)
 
+        # the cursor of the tweets of user1 is rejected on the tweets of user2
+        cursor = response.data['next_cursor']
+        response = self.user1_client.get(TWEET_LIST_API, {'user_id': self.user2.id, 'cursor': cursor})
+        self.assertEqual(response.status_code, 404)
+        response = self.user1_client.get(TWEET_LIST_API, {'user_id': self.user1.id, 'cursor': cursor})
+        self.assertEqual(response.data['results'][0]['id'], tweets[page_size].id)
+
         # pull the second page
         response = self.user1_client.get(TWEET_LIST_API, {
             'created_at__lt': tweets[page_size - 1].created_at,
@@ -38,6 +38,7 @@ class TweetViewSet(viewsets.GenericViewSet):
         # order by created_at desc
         # this SQL query uses composite index (user, created_at)
         user_id = request.query_params['user_id']
+        self.paginator.list_key = f'tweets:{user_id}'
         # tweets = Tweet.objects.filter(user_id=user_id).order_by('-created_at')
         # now can try to get cached tweets in redis
         cached_tweets = TweetService.get_cached_tweets(user_id)
@@ -1,5 +1,7 @@
 # memcached
-FOLLOWINGS_PATTERN = 'followings:{user_id}'
+# the generation of the following bloom filter, bumped by every follow / unfollow,
+# a set loaded before a change can only be cached under the old key
+FOLLOWINGS_PATTERN = 'followings:{user_id}:{generation}'
 # FOLLOWERS_PATTERN is not cached because usually followers data are too big, millions
 # also often get stale due to frequent follow/unfollow
 USER_PROFILE_PATTERN = 'userprofile:{user_id}'
@@ -7,3 +9,8 @@ USER_PROFILE_PATTERN = 'userprofile:{user_id}'
 # redis
 USER_TWEETS_PATTERN = 'user_tweets:{user_id}'
 USER_NEWSFEEDS_PATTERN = 'user_newsfeeds:{user_id}'
+FOLLOWINGS_BLOOM_PATTERN = 'followings_bloom:{user_id}'
+# hash of the counters of every process, see RedisBloomFilter.stats
+FOLLOWINGS_BLOOM_STATS_KEY = 'followings_bloom_stats'
+# hash of cleanup step => last deleted row key, see delete_user_friendships_task
+FRIENDSHIP_CLEANUP_PATTERN = 'friendship_cleanup:{user_id}'
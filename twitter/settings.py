@@ -51,6 +51,7 @@ INSTALLED_APPS = [
     'comments',
     'likes',
     'inbox',
+    'django_hbase',
 ]
 
 REST_FRAMEWORK = {
@@ -108,6 +109,25 @@ DATABASES = {
 
 # HBase Database
 HBASE_HOST = '127.0.0.1'
+HBASE_PORT = 9090
+# thrift wire format, must match the thrift server (hbase thrift start -f / -c)
+HBASE_TRANSPORT = 'buffered'  # or 'framed'
+HBASE_PROTOCOL = 'binary'  # or 'compact'
+HBASE_TIMEOUT = None  # in milliseconds, socket timeout of every thrift call, None waits forever
+# passed to happybase.Connection, connections of happybase.ConnectionPool always open on first use
+HBASE_AUTOCONNECT = True
+HBASE_TABLE_PREFIX = None  # e.g. 'twitter', tables are then named twitter_<table_name> in hbase
+HBASE_TABLE_PREFIX_SEPARATOR = '_'
+# set to 'django_hbase.memory.MemoryConnectionPool' in local_settings.py to run
+# unit tests and benchmarks with an in-process table store, no hbase needed
+HBASE_CONNECTION_POOL = 'happybase.ConnectionPool'
+# every gunicorn / celery thread checks out its own thrift connection
+HBASE_POOL_SIZE = 10
+HBASE_POOL_TIMEOUT = 5  # in seconds, wait for a free connection
+HBASE_CONNECTION_MAX_IDLE = 30  # in seconds, reconnect after idle, thrift server drops idle sockets
+HBASE_MAX_RETRIES = 1  # retry on a fresh connection after a thrift transport error
+HBASE_BATCH_SIZE = 1000  # max mutations per table sent in one batch
+HBASE_SCAN_WORKERS = 4  # threads scanning the buckets of salted tables, each holds a pooled connection
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
@@ -0,0 +1,209 @@
+from django.conf import settings
+from utils.redis_client import RedisClient
+
+import hashlib
+import math
+import redis
+import struct
+import threading
+import time
+
+# KEYS: filter, generation. ARGV: expire time, bit positions
+# bumps the generation and sets the bits of a filter that is already built,
+# a missing filter stays missing so it is never answered partially
+ADD_SCRIPT = """
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+for i = 2, #ARGV do
+    redis.call('SETBIT', KEYS[1], ARGV[i], 1)
+end
+return 1
+"""
+
+
+class RedisBloomFilter:
+    """
+    bloom filters of num_bits bits in redis strings, one per key, read with
+    GETBIT in a single pipeline. a miss on any of the num_hashes bits means the
+    item was never added, a hit means it probably was
+
+    a missing filter is built whole by rebuild, add only sets bits of a filter
+    that exists: SETBIT on a missing key would create a partial filter that
+    answers false negatives. items are never removed, their stale bits only
+    cost false positives
+
+    every add or touch bumps a generation counter next to the filter. a rebuild
+    passes the generation read before loading its items and is dropped if a
+    change landed in between, its items may miss the change
+
+    checks, negatives, false positives and rebuilds are counted in this process
+    and flushed to the stats_key hash every stats_flush_interval seconds, stats()
+    gives the totals of every process
+    """
+
+    def __init__(self, num_bits, num_hashes, stats_key='bloom_filter_stats', stats_flush_interval=10):
+        if num_bits % 8:
+            raise ValueError('num_bits should be a multiple of 8')
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.stats_key = stats_key
+        self.stats_flush_interval = stats_flush_interval
+        self.lock = threading.Lock()
+        self.pending_stats = {}
+        self.stats_flushed_at = time.time()
+
+    def get_positions(self, item):
+        # double hashing, h1 + i * h2 for i in range(num_hashes)
+        h1, h2 = struct.unpack('<QQ', hashlib.blake2b(str(item).encode('utf-8'), digest_size=16).digest())
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def might_contain_many(self, key, items):
+        """
+        => {item: False if definitely not added, True if maybe}
+        None if the filter of key is not built
+        """
+        conn = RedisClient.get_connection()
+        pipeline = conn.pipeline(transaction=False)
+        pipeline.exists(key)
+        for item in items:
+            for position in self.get_positions(item):
+                pipeline.getbit(key, position)
+        exists, *bits = pipeline.execute()
+        if not exists:
+            return None
+
+        result = {}
+        for index, item in enumerate(items):
+            result[item] = all(bits[index * self.num_hashes:(index + 1) * self.num_hashes])
+        self.count(checks=len(result), negatives=sum(1 for value in result.values() if not value))
+        return result
+
+    def get_generation_key(self, key):
+        return f'{key}:generation'
+
+    def get_generation(self, key):
+        # read before loading the items of a rebuild
+        generation = RedisClient.get_connection().get(self.get_generation_key(key))
+        return int(generation or 0)
+
+    def rebuild(self, key, items, generation):
+        """
+        => True if the filter is written, False if key changed since generation
+        was read. the check and the write are one WATCH / MULTI transaction, a
+        change can not slip in between
+        """
+        # bit i is bit 7 - i % 8 of byte i // 8, same order as GETBIT
+        bitmap = bytearray(self.num_bits // 8)
+        for item in items:
+            for position in self.get_positions(item):
+                bitmap[position >> 3] |= 0x80 >> (position & 7)
+
+        generation_key = self.get_generation_key(key)
+        conn = RedisClient.get_connection()
+        with conn.pipeline() as pipeline:
+            try:
+                pipeline.watch(generation_key)
+                if int(pipeline.get(generation_key) or 0) != generation:
+                    return False
+                pipeline.multi()
+                pipeline.set(key, bytes(bitmap), ex=settings.REDIS_KEY_EXPIRE_TIME)
+                pipeline.execute()
+            except redis.WatchError:
+                return False
+        self.count(rebuilds=1)
+        return True
+
+    def add(self, key, items):
+        # => True if the bits went into a built filter, one script so a rebuild can't interleave
+        # EVALSHA, the script is loaded once per redis server
+        add_script = RedisClient.get_connection().register_script(ADD_SCRIPT)
+        positions = [position for item in items for position in self.get_positions(item)]
+        return bool(add_script(
+            keys=[key, self.get_generation_key(key)],
+            args=[settings.REDIS_KEY_EXPIRE_TIME, *positions],
+        ))
+
+    def touch(self, key):
+        # the items changed without new ones, e.g. removals: only rebuilds in flight are dropped
+        generation_key = self.get_generation_key(key)
+        pipeline = RedisClient.get_connection().pipeline()
+        pipeline.incr(generation_key)
+        pipeline.expire(generation_key, settings.REDIS_KEY_EXPIRE_TIME)
+        pipeline.execute()
+
+    def claim_rebuild(self, key, timeout=60):
+        # True for the one caller that should schedule the rebuild of key
+        return bool(RedisClient.get_connection().set(f'{key}:rebuilding', 1, nx=True, ex=timeout))
+
+    def release_rebuild(self, key):
+        RedisClient.get_connection().delete(f'{key}:rebuilding')
+
+    def record_false_positives(self, count):
+        # maybe answers the authoritative store said no to
+        self.count(false_positives=count)
+
+    def count(self, **deltas):
+        with self.lock:
+            for name, delta in deltas.items():
+                self.pending_stats[name] = self.pending_stats.get(name, 0) + delta
+            if time.time() - self.stats_flushed_at < self.stats_flush_interval:
+                return
+        self.flush_stats()
+
+    def flush_stats(self):
+        with self.lock:
+            pending_stats, self.pending_stats = self.pending_stats, {}
+            self.stats_flushed_at = time.time()
+        pending_stats = {name: delta for name, delta in pending_stats.items() if delta}
+        if not pending_stats:
+            return
+        pipeline = RedisClient.get_connection().pipeline(transaction=False)
+        for name, delta in pending_stats.items():
+            pipeline.hincrby(self.stats_key, name, delta)
+        pipeline.execute()
+
+    def info(self, key):
+        # size and estimated false positive rate of one filter, None if not built
+        conn = RedisClient.get_connection()
+        pipeline = conn.pipeline(transaction=False)
+        pipeline.exists(key)
+        pipeline.bitcount(key)
+        exists, bits_set = pipeline.execute()
+        if not exists:
+            return None
+        fill_ratio = bits_set / self.num_bits
+        return {
+            'size_bytes': self.num_bits // 8,
+            'bits_set': bits_set,
+            'estimated_items': int(-self.num_bits / self.num_hashes * math.log(1 - fill_ratio))
+            if fill_ratio < 1 else None,
+            'false_positive_rate': fill_ratio ** self.num_hashes,
+        }
+
+    def stats(self):
+        # counters of every process, the ones of this process are flushed first
+        self.flush_stats()
+        counters = RedisClient.get_connection().hgetall(self.stats_key)
+        checks, negatives, false_positives, rebuilds = [
+            int(counters.get(name, 0))
+            for name in [b'checks', b'negatives', b'false_positives', b'rebuilds']
+        ]
+        # every false positive was a real negative too
+        real_negatives = negatives + false_positives
+        return {
+            'size_bytes': self.num_bits // 8,
+            'checks': checks,
+            'negatives': negatives,
+            'negative_rate': negatives / checks if checks else 0.0,
+            'false_positives': false_positives,
+            'false_positive_rate': false_positives / real_negatives if real_negatives else 0.0,
+            'rebuilds': rebuilds,
+        }
+
+    def reset_stats(self):
+        with self.lock:
+            self.pending_stats = {}
+        RedisClient.get_connection().delete(self.stats_key)
@@ -1,23 +1,132 @@
 from dateutil import parser
 from django.conf import settings
+from django.core import signing
+from django.db.models import Q
+from django_hbase.models.codecs import row_key_after, row_key_before
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.pagination import BasePagination
 from rest_framework.response import Response
 from utils.time_constants import MAX_TIMESTAMP
+from utils.time_helpers import datetime_to_timestamp, timestamp_to_datetime
+
+import base64
+import pytz
 
 
 class EndlessPagination(BasePagination):
     page_size = 20  # if not settings.TESTING else 10
+    cursor_query_param = 'cursor'
+    cursor_salt = 'utils.paginations.EndlessPagination'
+    invalid_cursor_message = 'Invalid cursor'
 
     def __init__(self):
         super(EndlessPagination, self).__init__()
         self.has_next_page = False
+        self.next_cursor = None
+        # identity of the paginated list, e.g. 'followers:42', set by the view
+        # before paginating. it is signed into the cursors handed out
+        self.list_key = None
 
     def to_html(self):
         pass
 
+    def encode_cursor(self, payload):
+        # signed, clients can not forge a cursor pointing to someone else's rows
+        if self.list_key is not None:
+            payload = dict(payload, list=self.list_key)
+        return signing.dumps(payload, salt=self.cursor_salt, compress=True)
+
+    def decode_cursor(self, request, fields):
+        """
+        => payload of the cursor param, None if there is none or if it has other
+        fields than the ones of this store: mysql / redis cursors are placed by
+        created_at and id, hbase ones by row key. when switch_friendship_to_hbase
+        or switch_newsfeed_to_hbase flips, a client mid-scroll gets the first page
+        again. a cursor of another list is a 404
+        """
+        if self.cursor_query_param not in request.query_params:
+            return None
+        try:
+            payload = signing.loads(request.query_params[self.cursor_query_param], salt=self.cursor_salt)
+        except signing.BadSignature:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(payload, dict):
+            raise NotFound(self.invalid_cursor_message)
+        # cursors handed out before lists were bound into them have no list
+        if self.list_key is not None and 'list' not in payload:
+            return None
+        if payload.pop('list', None) != self.list_key:
+            raise NotFound(self.invalid_cursor_message)
+        if set(payload) != set(fields):
+            return None
+        return payload
+
+    def encode_object_cursor(self, obj):
+        # (created_at, id) breaks ties of objects created in the same microsecond
+        return self.encode_cursor({'created_at': obj.created_at.isoformat(), 'id': obj.id})
+
+    def decode_object_cursor(self, request):
+        # => (created_at, id) or None
+        payload = self.decode_cursor(request, ['created_at', 'id'])
+        if payload is None:
+            return None
+        try:
+            created_at, obj_id = parser.isoparse(payload['created_at']), payload['id']
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(obj_id, int):
+            raise NotFound(self.invalid_cursor_message)
+        return created_at, obj_id
+
+    def encode_row_key_cursor(self, row_key):
+        return self.encode_cursor({'row_key': base64.urlsafe_b64encode(row_key).decode('ascii')})
+
+    def decode_row_key_cursor(self, request):
+        # => row key or None
+        payload = self.decode_cursor(request, ['row_key'])
+        if payload is None:
+            return None
+        try:
+            return base64.urlsafe_b64decode(payload['row_key'])
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def parse_created_at(self, request, param):
+        """
+        created_at__gt / created_at__lt => aware datetime, iso format like the
+        created_at of mysql models or microseconds since epoch like the row keys
+        of hbase models. anything else is a 400
+        """
+        value = request.query_params[param]
+        try:
+            if value.isdigit():
+                return timestamp_to_datetime(int(value))
+            created_at = parser.isoparse(value)
+        except (ValueError, OverflowError):
+            raise ValidationError({param: 'Invalid datetime'})
+        if created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=pytz.utc)
+        return created_at
+
+    def parse_hbase_timestamp(self, request, param):
+        # the created_at of a row key, within what the row key can hold
+        timestamp = datetime_to_timestamp(self.parse_created_at(request, param))
+        if not 0 <= timestamp <= MAX_TIMESTAMP:
+            raise ValidationError({param: 'Invalid datetime'})
+        return timestamp
+
+    def set_next_page(self, has_next_page, next_cursor=None):
+        self.has_next_page = has_next_page
+        self.next_cursor = next_cursor if has_next_page else None
+
     def paginate_ordered_list(self, reverse_ordered_list, request):
+        """
+        None if the page can not be cut from reverse_ordered_list: objects pushed
+        after a bulk_create are cached without id, a cursor can neither be placed
+        among them nor built from them
+        """
         if 'created_at__gt' in request.query_params:
-            created_at__gt = parser.isoparse(request.query_params['created_at__gt'])
+            created_at__gt = self.parse_created_at(request, 'created_at__gt')
             objects = []
             for obj in reverse_ordered_list:
                 if obj.created_at > created_at__gt:
@@ -25,39 +134,63 @@ class EndlessPagination(BasePagination):
                 else:
                     # reverse_ordered_list 后面的都小了
                     break
-            self.has_next_page = False
+            self.set_next_page(False)
             return objects
 
         index = 0
-        if 'created_at__lt' in request.query_params:
-            created_at__lt = parser.isoparse(request.query_params['created_at__lt'])
+        position = self.decode_object_cursor(request)
+        if position is not None:
+            if any(obj.id is None for obj in reverse_ordered_list):
+                return None
+            for index, obj in enumerate(reverse_ordered_list):
+                if (obj.created_at, obj.id) < position:
+                    break
+            else:
+                # no object is after the cursor
+                reverse_ordered_list = []
+        elif 'created_at__lt' in request.query_params:
+            created_at__lt = self.parse_created_at(request, 'created_at__lt')
             for index, obj in enumerate(reverse_ordered_list):
                 if obj.created_at < created_at__lt:
                     break
             else:
                 # no object has created_at < created_at__lt
                 reverse_ordered_list = []
-        self.has_next_page = len(reverse_ordered_list) > index + self.page_size
-        return reverse_ordered_list[index: index + self.page_size]
+        objects = reverse_ordered_list[index: index + self.page_size]
+        has_next_page = len(reverse_ordered_list) > index + self.page_size
+        if has_next_page and objects[-1].id is None:
+            return None
+        self.set_next_page(has_next_page, has_next_page and self.encode_object_cursor(objects[-1]))
+        return objects
 
     def paginate_queryset(self, queryset, request, view=None):
         if 'created_at__gt' in request.query_params:
-            created_at__gt = request.query_params['created_at__gt']
+            created_at__gt = self.parse_created_at(request, 'created_at__gt')
             queryset = queryset.filter(created_at__gt=created_at__gt)
-            self.has_next_page = False
-            return queryset.order_by('-created_at')
+            self.set_next_page(False)
+            return queryset.order_by('-created_at', '-id')
 
-        if 'created_at__lt' in request.query_params:
-            created_at__lt = request.query_params['created_at__lt']
+        position = self.decode_object_cursor(request)
+        if position is not None:
+            created_at, obj_id = position
+            queryset = queryset.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=obj_id)
+            )
+        elif 'created_at__lt' in request.query_params:
+            created_at__lt = self.parse_created_at(request, 'created_at__lt')
             queryset = queryset.filter(created_at__lt=created_at__lt)
 
         # no query param, default return 1st page
-        queryset = queryset.order_by('-created_at')[:self.page_size + 1]
-        self.has_next_page = len(queryset) > self.page_size
-        return queryset[:self.page_size]
+        queryset = queryset.order_by('-created_at', '-id')[:self.page_size + 1]
+        has_next_page = len(queryset) > self.page_size
+        objects = queryset[:self.page_size]
+        self.set_next_page(has_next_page, has_next_page and self.encode_object_cursor(objects[-1]))
+        return objects
 
     def paginate_cached_list(self, cached_list, request):
         paginated_list = self.paginate_ordered_list(cached_list, request)
+        if paginated_list is None:
+            return None
         # swipe up, paginated_list has latest data
         if 'created_at__gt' in request.query_params:
             return paginated_list
@@ -73,6 +206,7 @@ class EndlessPagination(BasePagination):
     def get_paginated_response(self, data):
         return Response({
             'has_next_page': self.has_next_page,
+            'next_cursor': self.next_cursor,
             'results': data
         })
 
@@ -80,41 +214,55 @@ class EndlessPagination(BasePagination):
         if 'created_at__gt' in request.query_params:
             # created_at__gt is for Scroll DOWN, pull latest data
 
-            created_at__gt = request.query_params['created_at__gt']
-            start = (*row_key_prefix, created_at__gt)
+            # hbase scans are inclusive, start right after created_at__gt
+            created_at__gt = self.parse_hbase_timestamp(request, 'created_at__gt')
+            start = hb_model.serialize_row_key_from_tuple((*row_key_prefix, created_at__gt))
             stop = (*row_key_prefix, MAX_TIMESTAMP)
-            objects = hb_model.filter(start=start, stop=stop)
-            if len(objects) and objects[0].created_at == int(created_at__gt):
-                # [1, 2, 3, 4] => [4, 3, 2]
-                objects = objects[:0:-1]
-            else:
-                objects = objects[::-1]
-            self.has_next_page = False
+            objects = hb_model.filter(start=row_key_after(start), stop=stop)
+            # [1, 2, 3] => [3, 2, 1]
+            objects = objects[::-1]
+            self.set_next_page(False)
             return objects
 
+        prefix = hb_model.serialize_row_key_from_tuple((*row_key_prefix, None))
+        row_key = self.decode_row_key_cursor(request)
+        if row_key is not None:
+            # the cursor is the exact row key of the last row of the previous page,
+            # start right below it so nothing is skipped or repeated on ties
+            if not row_key.startswith(prefix) or row_key == prefix:
+                raise NotFound(self.invalid_cursor_message)
+            # if reverse=True, start > stop
+            objects = hb_model.filter(
+                start=row_key_before(row_key),
+                stop=prefix,
+                limit=self.page_size + 1,
+                reverse=True,
+            )
+            return self.trim_hbase_page(objects)
+
         if 'created_at__lt' in request.query_params:
             # created_at__lt is for Scroll UP, next page below
-            # hbase only supports <= instead of <, so page_size + 2
-            created_at__lt = request.query_params['created_at__lt']
-            start = (*row_key_prefix, created_at__lt)
-            stop = (*row_key_prefix, None)
-            # if reverse=True, start > stop
-            objects = hb_model.filter(start=start, stop=stop, limit=self.page_size + 2, reverse=True)
-            if len(objects) and objects[0].created_at == int(created_at__lt):
-                objects = objects[1:]
-            if len(objects) > self.page_size:
-                self.has_next_page = True
-                objects = objects[:-1]
-            else:
-                self.has_next_page = False
-            return objects
+            # start right below the row key of created_at__lt so it is skipped,
+            # no need to fetch page_size + 2 and trim
+            created_at__lt = self.parse_hbase_timestamp(request, 'created_at__lt')
+            start = hb_model.serialize_row_key_from_tuple((*row_key_prefix, created_at__lt))
+            objects = hb_model.filter(
+                start=row_key_before(start),
+                stop=prefix,
+                limit=self.page_size + 1,
+                reverse=True,
+            )
+            return self.trim_hbase_page(objects)
 
         # no param，default latest page
-        prefix = (*row_key_prefix, None)
         objects = hb_model.filter(prefix=prefix, limit=self.page_size + 1, reverse=True)
-        if len(objects) > self.page_size:
-            self.has_next_page = True
-            objects = objects[:-1]
-        else:
-            self.has_next_page = False
+        return self.trim_hbase_page(objects)
+
+    def trim_hbase_page(self, objects):
+        has_next_page = len(objects) > self.page_size
+        objects = objects[:self.page_size]
+        self.set_next_page(
+            has_next_page,
+            has_next_page and self.encode_row_key_cursor(objects[-1].row_key),
+        )
         return objects
@@ -1,4 +1,5 @@
 from testing.testcases import TestCase
+from utils.bloom_filter import RedisBloomFilter
 from utils.redis_client import RedisClient
 
 
@@ -17,3 +18,62 @@ class UtilsTests(TestCase):
         RedisClient.clear()
         cached_list = conn.lrange('redis_key', 0, -1)
         self.assertEqual(cached_list, [])
+
+    def test_redis_bloom_filter(self):
+        bloom_filter = RedisBloomFilter(num_bits=1024, num_hashes=4)
+        self.assertEqual(bloom_filter.might_contain_many('bloom', [1, 2]), None)
+        self.assertEqual(bloom_filter.info('bloom'), None)
+
+        self.assertEqual(bloom_filter.rebuild('bloom', range(0, 100, 2), bloom_filter.get_generation('bloom')), True)
+        conn = RedisClient.get_connection()
+        # same bit order as SETBIT
+        for position in bloom_filter.get_positions(2):
+            self.assertEqual(conn.getbit('bloom', position), 1)
+        result = bloom_filter.might_contain_many('bloom', list(range(100)))
+        # no false negatives
+        self.assertTrue(all(result[item] for item in range(0, 100, 2)))
+        false_positives = sum(1 for item in range(1, 100, 2) if result[item])
+        self.assertLess(false_positives, 10)
+
+        info = bloom_filter.info('bloom')
+        self.assertEqual(info['size_bytes'], 128)
+        self.assertLess(abs(info['estimated_items'] - 50), 10)
+        self.assertLess(info['false_positive_rate'], 0.1)
+
+        bloom_filter.record_false_positives(false_positives)
+        stats = bloom_filter.stats()
+        self.assertEqual(stats['checks'], 100)
+        self.assertEqual(stats['negatives'], 50 - false_positives)
+        self.assertEqual(stats['false_positive_rate'], false_positives / 50)
+        self.assertEqual(stats['rebuilds'], 1)
+
+        # items are added to a built filter only
+        self.assertEqual(bloom_filter.might_contain_many('bloom', [101]), {101: False})
+        self.assertEqual(bloom_filter.add('bloom', [101]), True)
+        self.assertEqual(bloom_filter.might_contain_many('bloom', [101]), {101: True})
+        self.assertEqual(bloom_filter.add('missing', [101]), False)
+        self.assertEqual(bloom_filter.might_contain_many('missing', [101]), None)
+
+        # a rebuild from items read before an add or a touch is dropped
+        for change in [lambda: bloom_filter.add('missing', [3]), lambda: bloom_filter.touch('missing')]:
+            generation = bloom_filter.get_generation('missing')
+            change()
+            self.assertEqual(bloom_filter.rebuild('missing', [2], generation), False)
+            self.assertEqual(bloom_filter.might_contain_many('missing', [2]), None)
+        self.assertEqual(bloom_filter.rebuild('missing', [2], bloom_filter.get_generation('missing')), True)
+        self.assertEqual(bloom_filter.might_contain_many('missing', [2]), {2: True})
+
+        # one caller schedules a rebuild
+        self.assertEqual(bloom_filter.claim_rebuild('bloom'), True)
+        self.assertEqual(bloom_filter.claim_rebuild('bloom'), False)
+        bloom_filter.release_rebuild('bloom')
+        self.assertEqual(bloom_filter.claim_rebuild('bloom'), True)
+
+        # counters of every process are kept in redis
+        other_process_filter = RedisBloomFilter(num_bits=1024, num_hashes=4, stats_flush_interval=0)
+        other_process_filter.might_contain_many('bloom', [1, 2])
+        self.assertEqual(bloom_filter.stats()['checks'], 105)
+        bloom_filter.reset_stats()
+        self.assertEqual(bloom_filter.stats()['checks'], 0)
+        with self.assertRaises(ValueError):
+            RedisBloomFilter(num_bits=1001, num_hashes=4)
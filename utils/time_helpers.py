@@ -1,6 +1,16 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 import pytz
 
 
 def utc_now():
     return datetime.now().replace(tzinfo=pytz.utc)
+
+
+def datetime_to_timestamp(dt):
+    # aware datetime => int microseconds since epoch, same unit as hbase row keys
+    return (dt - datetime(1970, 1, 1, tzinfo=pytz.utc)) // timedelta(microseconds=1)
+
+
+def timestamp_to_datetime(timestamp):
+    # int microseconds since epoch => aware datetime, inverse of datetime_to_timestamp
+    return datetime(1970, 1, 1, tzinfo=pytz.utc) + timedelta(microseconds=timestamp)